@@ -1,11 +1,8 @@
 import streamlit as st
-import time
-import requests
-import os
-
-API_KEY = os.getenv('GEMINI_API_KEY')
-MODEL_NAME = "gemini-flash-latest"
-API_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{MODEL_NAME}:generateContent?key={API_KEY}"
+import llm_providers
+import roadmap_engine
+from quota_scheduler import QuotaExhausted
+from roadmap_engine import ROADMAP_SYSTEM_INSTRUCTION, RoadmapRequest
 
 
 st.markdown("""
@@ -22,65 +19,75 @@ st.markdown("""
 
 def call_gemini_api(prompt, use_search=True):
     """
-    Calls the Gemini API with exponential backoff and Google Search grounding.
+    Calls the roadmap LLM router (hedged across Gemini models) with Google Search grounding.
     Returns the generated text and a list of source links.
+
+    No retry loop here: the quota scheduler already queues the call and the
+    router fails over, so retrying would only add to the shared rate limit.
     """
-    payload = {
-        "contents": [{"parts": [{"text": prompt}]}],
-        "systemInstruction": {
-            "parts": [{
-                "text": (
-                    "You are an expert Educational Consultant and Study Architect. "
-                    "Your goal is to create highly structured, realistic, and actionable learning paths. "
-                    "Always provide a structured schedule (e.g., Week 1, Week 2)"
-                    "include verified external links for study materials with Header as (Relevant Links: link.xyz) which should open when clicked"
-                    "Format the output in clear Markdown."
-                )
-            }]
-        }
-    }
-
-    # Enable Google Search grounding to get real links
-    if use_search:
-        payload["tools"] = [{"google_search": {}}]
-
-    max_retries = 5
-    for i in range(max_retries):
+    try:
+        response = llm_providers.generate(
+            "roadmap", prompt, system=ROADMAP_SYSTEM_INSTRUCTION, use_search=use_search
+        )
+        text = response.text or "Error: No content generated. Please try again."
+        return text, response.links
+
+    except Exception as e:
+        return describe_error(e), []
+
+
+def describe_error(e):
+    if isinstance(e, QuotaExhausted):
+        wait = f" in about {int(e.retry_after) + 1} s" if e.retry_after else " shortly"
+        return f"The AI service is busy right now. Please try again{wait}."
+    return f"Error communicating with API: {str(e)}"
+
+
+def show_source_links(source_links):
+    if source_links:
+        with st.expander("📚 Verified Source Links & References"):
+            st.write("The AI used these sources to build your path:")
+            for link in source_links:
+                st.markdown(f"- [{link['title']}]({link['url']})")
+
+
+def generate_outlined_path(request):
+    """Long plans: a phase outline first, then every phase written in parallel and shown as it lands."""
+    with st.spinner("Planning the phases of your learning path..."):
         try:
-            response = requests.post(API_URL, json=payload)
-            response.raise_for_status()
-            result = response.json()
-
-            # Extract text content
-            try:
-                text = result["candidates"][0]["content"]["parts"][0]["text"]
-            except (KeyError, IndexError):
-                text = "Error: No content generated. Please try again."
-
-            # Extract grounding sources (links)
-            links = []
-            try:
-                grounding_metadata = result["candidates"][0].get("groundingMetadata", {})
-                if "groundingAttributions" in grounding_metadata:
-                    for attr in grounding_metadata["groundingAttributions"]:
-                        web = attr.get("web", {})
-                        if web.get("uri") and web.get("title"):
-                            links.append({"title": web["title"], "url": web["uri"]})
-            except (KeyError, IndexError):
-                pass # No links found, just continue
-
-            return text, links
-
-        except requests.exceptions.RequestException as e:
-            if i < max_retries - 1:
-                time.sleep(2**i)
-                continue
-            else:
-                return f"Error communicating with API: {str(e)}", []
+            outline = roadmap_engine.generate_outline(request)
         except Exception as e:
-            return f"An unexpected error occurred: {str(e)}", []
+            st.error(describe_error(e))
+            return
+
+    st.markdown("### 📅 Your Personalized Learning Schedule")
+    st.markdown("\n".join(
+        f"{i + 1}. **{phase['title']}** (Weeks {phase['start_week']}-{phase['end_week']})"
+        for i, phase in enumerate(outline)
+    ))
+    st.markdown("---")
 
-    return "Failed to generate content after multiple retries.", []
+    slots = []
+    for phase in outline:
+        slot = st.empty()
+        slot.info(f"⏳ Writing weeks {phase['start_week']}-{phase['end_week']}: {phase['title']}...")
+        slots.append(slot)
+
+    source_links, failed = [], 0
+    for index, section in roadmap_engine.expand_phases(request, outline):
+        phase = outline[index]
+        with slots[index].container():
+            st.markdown(f"## Phase {index + 1}: {phase['title']} (Weeks {phase['start_week']}-{phase['end_week']})")
+            if isinstance(section, Exception):
+                failed += 1
+                st.warning(describe_error(section))
+            else:
+                st.markdown(section.text)
+                source_links.extend(section.links)
+
+    if failed:
+        st.caption("Generate again to retry the missing phases; finished phases are kept.")
+    show_source_links(source_links)
 
 # --- Streamlit UI ---
 
@@ -96,6 +103,9 @@ It uses AI to find the best resources and structure your learning journey.
 with st.sidebar:
     st.header("Your Goals")
 
+    if llm_providers.feature_pressure("roadmap") == "throttled":
+        st.warning("The AI service is rate limited right now; generating may take a while.")
+
     subject = st.text_input("Broad Subject", placeholder="e.g. CS, Science, Biology")
     topic = st.text_input("Specific Topic", placeholder="e.g. React.js, Maxwell Theory, Genetics")
 
@@ -124,8 +134,11 @@ with st.sidebar:
 
 # Main Content Area
 if generate_btn:
+    request = RoadmapRequest(subject, topic, current_knowledge, duration, hours_per_week)
     if not subject or not topic:
         st.error("Please enter both a Subject and a Specific Topic.")
+    elif roadmap_engine.needs_outline(request):
+        generate_outlined_path(request)
     else:
         with st.spinner("Consulting the AI Study Architect... this may take a moment..."):
 
@@ -156,11 +169,7 @@ if generate_btn:
             st.markdown(generated_text)
 
             # Display collected sources in an expander if available
-            if source_links:
-                with st.expander("📚 Verified Source Links & References"):
-                    st.write("The AI used these sources to build your path:")
-                    for link in source_links:
-                        st.markdown(f"- [{link['title']}]({link['url']})")
+            show_source_links(source_links)
             
 
 else:
@@ -0,0 +1,284 @@
+"""
+Headless HTTP API for NOVA-AI.
+
+Exposes ingest, load-by-ID, ask (plain and streaming), summary and quiz on top
+of the same helpers the Streamlit pages use. One process keeps a single
+embedding model and a size-bounded cache of loaded indexes, and runs the blocking
+work on a bounded worker pool so many clients can share it.
+
+Run with:
+    uvicorn api_server:app --host 0.0.0.0 --port 8000
+"""
+import asyncio
+import hmac
+import io
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from fastapi import FastAPI, File, Header, HTTPException, UploadFile
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+import quiz_engine
+from cache_policy import BoundedCache, cache_stats
+from gemini_agent import answer_question, ask_ai_stream
+from langchain_vector_conversion import convert_to_vector_db
+from supabase_db import (
+    VectorDBNotFound,
+    content_key,
+    create_alias,
+    delete_vector_db,
+    find_shared_index,
+    get_vector_db_version,
+    load_vector_db_from_supabase,
+    register_content,
+    save_vector_db_to_supabase,
+)
+from quota_scheduler import QuotaExhausted, is_rate_limit_error, retry_after_from_error
+from vector_compression import DEFAULT_VECTOR_ENCODING
+
+# ----------------- Worker pool -----------------
+
+API_WORKERS = int(os.getenv("API_WORKERS", "8"))
+# Requests allowed to wait for a worker before new ones are turned away with 503.
+API_MAX_PENDING = int(os.getenv("API_MAX_PENDING", "64"))
+# Loaded indexes may use at most this much of the global cache budget (cache_policy)
+INDEX_CACHE_MB = os.getenv("API_INDEX_CACHE_MB")
+# How long a DB's manifest version is trusted before an append shows up
+INDEX_VERSION_TTL = float(os.getenv("API_INDEX_VERSION_TTL", "10"))
+# Destructive endpoints need this token in an X-Admin-Token header; unset, they are off
+ADMIN_TOKEN = os.getenv("USAGE_ADMIN_TOKEN")
+
+worker_pool = ThreadPoolExecutor(max_workers=API_WORKERS, thread_name_prefix="api-worker")
+admission = threading.BoundedSemaphore(API_WORKERS + API_MAX_PENDING)
+
+
+async def run_in_pool(fn, *args):
+    """Run a blocking call on the worker pool, or fail fast when the pool is saturated."""
+    if not admission.acquire(blocking=False):
+        raise HTTPException(status_code=503, detail="Server busy, retry shortly", headers={"Retry-After": "1"})
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(worker_pool, fn, *args)
+    finally:
+        admission.release()
+
+
+# ----------------- Shared index cache -----------------
+
+index_cache = BoundedCache(
+    "api_indexes",
+    max_bytes=int(float(INDEX_CACHE_MB) * 1e6) if INDEX_CACHE_MB else None,
+)
+index_versions = BoundedCache("api_index_versions", ttl=INDEX_VERSION_TTL)
+
+
+def index_key(db_id: str):
+    # Appends (from any process) bump the manifest version, so the old entry is never served again
+    return db_id, index_versions.get_or_load(db_id, lambda: get_vector_db_version(db_id))
+
+
+def get_indexes(db_ids: List[str]):
+    vector_dbs = []
+    for db_id in db_ids:
+        try:
+            vectordb = index_cache.get_or_load(index_key(db_id), lambda: load_vector_db_from_supabase(db_id))
+        except VectorDBNotFound:
+            raise HTTPException(status_code=404, detail=f"Could not fetch file for id: {db_id}")
+        vector_dbs.append(vectordb)
+    return vector_dbs
+
+
+# ----------------- Schemas -----------------
+
+class AskRequest(BaseModel):
+    question: str
+    db_ids: List[str]
+    history: List[List[str]] = []
+
+
+class TextRequest(BaseModel):
+    text: str
+
+
+class QuizRequest(BaseModel):
+    text: str
+    asked_questions: List[str] = []
+
+
+# ----------------- Endpoints -----------------
+
+app = FastAPI(title="NOVA-AI API")
+
+FILE_TYPES = {".pdf": "pdf", ".txt": "text", ".docx": "docx"}
+
+
+def ingest_file(file_bytes: bytes, file_name: str) -> str:
+    mode_of_file = FILE_TYPES.get(os.path.splitext(file_name)[1].lower())
+    if mode_of_file is None:
+        raise HTTPException(status_code=400, detail="Unsupported file type")
+
+    # A file that is already indexed only gets a new ID for the shared index
+    key = content_key(file_bytes, mode_of_file, DEFAULT_VECTOR_ENCODING)
+    shared_id = find_shared_index(key)
+    alias_id = create_alias(shared_id, key) if shared_id else None
+    if alias_id:
+        return alias_id
+
+    # convert_to_vector_db reads .getvalue() and .name like a Streamlit upload;
+    # the uuid prefix keeps concurrent uploads of the same name apart on disk
+    upload = io.BytesIO(file_bytes)
+    upload.name = f"{uuid.uuid4()}_{os.path.basename(file_name)}"
+    try:
+        vectordb = convert_to_vector_db(upload, mode_of_file)
+        db_id = save_vector_db_to_supabase(vectordb)
+        register_content(db_id, key)
+    finally:
+        shutil.rmtree(f"{upload.name}_DB", ignore_errors=True)
+
+    # A new DB starts at manifest version 0
+    index_versions.put(db_id, 0)
+    index_cache.put((db_id, 0), vectordb)
+    return db_id
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "cache": cache_stats()}
+
+
+@app.post("/ingest")
+async def ingest(file: UploadFile = File(...)):
+    file_bytes = await file.read()
+    db_id = await run_in_pool(ingest_file, file_bytes, file.filename)
+    return {"db_id": db_id}
+
+
+@app.post("/db/{db_id}/load")
+async def load(db_id: str):
+    vector_dbs = await run_in_pool(get_indexes, [db_id])
+    return {"db_id": db_id, "chunks": vector_dbs[0].index.ntotal}
+
+
+def require_admin(token: Optional[str]) -> None:
+    if not (ADMIN_TOKEN and token and hmac.compare_digest(token, ADMIN_TOKEN)):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+@app.delete("/db/{db_id}")
+async def delete(db_id: str, x_admin_token: Optional[str] = Header(None)):
+    require_admin(x_admin_token)
+
+    def delete_and_forget():
+        key = index_key(db_id)
+        # Shared indexes stay in storage while other IDs still refer to them
+        delete_vector_db(db_id)
+        index_cache.invalidate(key)
+        index_versions.invalidate(db_id)
+
+    await run_in_pool(delete_and_forget)
+    return {"db_id": db_id, "deleted": True}
+
+
+def llm_error(error: Exception) -> HTTPException:
+    """429 when we or the provider are out of quota, 502 for any other upstream failure."""
+    if isinstance(error, QuotaExhausted):
+        retry_after = error.retry_after
+    elif is_rate_limit_error(error):
+        retry_after = retry_after_from_error(error)
+    else:
+        return HTTPException(status_code=502, detail=f"Could not get an answer: {error}")
+    return HTTPException(
+        status_code=429,
+        detail="LLM quota exhausted, retry shortly",
+        headers={"Retry-After": str(int(retry_after or 0) + 1)},
+    )
+
+
+async def run_llm(fn, *args):
+    """run_in_pool for calls whose LLM and quota errors map to 429/502."""
+    try:
+        return await run_in_pool(fn, *args)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise llm_error(e) from e
+
+
+@app.post("/ask")
+async def ask(request: AskRequest):
+    def answer():
+        vector_dbs = get_indexes(request.db_ids)
+        history = [tuple(turn) for turn in request.history]
+        return answer_question(request.question, history, vector_dbs)
+
+    return {"answer": await run_llm(answer)}
+
+
+@app.post("/ask/stream")
+async def ask_stream(request: AskRequest):
+    vector_dbs = await run_in_pool(get_indexes, request.db_ids)
+    history = [tuple(turn) for turn in request.history]
+
+    if not admission.acquire(blocking=False):
+        raise HTTPException(status_code=503, detail="Server busy, retry shortly", headers={"Retry-After": "1"})
+
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+    done = object()
+
+    def produce():
+        try:
+            for chunk in ask_ai_stream(request.question, history, vector_dbs):
+                loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+        except Exception as e:
+            # Handed to the event loop, which turns it into a status or a cut stream
+            loop.call_soon_threadsafe(chunks.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(chunks.put_nowait, done)
+            admission.release()
+
+    worker_pool.submit(produce)
+
+    # Routing and quota errors come before the first chunk and still get a status
+    first = await chunks.get()
+    if isinstance(first, Exception):
+        raise llm_error(first) from first
+
+    async def body():
+        chunk = first
+        while chunk is not done:
+            if isinstance(chunk, Exception):
+                # Headers are already sent; abort so the client sees a broken stream
+                raise chunk
+            yield chunk
+            chunk = await chunks.get()
+
+    return StreamingResponse(body(), media_type="text/plain; charset=utf-8")
+
+
+@app.post("/summary")
+async def summary(request: TextRequest):
+    result = await run_llm(quiz_engine.generate_summary, request.text)
+    if result is None:
+        raise HTTPException(status_code=400, detail="Missing text or GEMINI_API_KEY")
+    return {"summary": result}
+
+
+@app.post("/quiz")
+async def quiz(request: QuizRequest):
+    result = await run_llm(quiz_engine.generate_quiz, request.text, request.asked_questions)
+    if result is None:
+        raise HTTPException(status_code=400, detail="Missing text or GEMINI_API_KEY")
+    return result
+
+
+@app.post("/extract")
+async def extract(file: UploadFile = File(...)):
+    file_bytes = await file.read()
+    text = await run_in_pool(quiz_engine.extract_file_text, file_bytes, file.filename)
+    return {"text": text}
@@ -1,7 +1,19 @@
+import hmac
+import os
+import time
+import uuid
+
 import streamlit as st
 
+from usage_ledger import get_ledger, set_session
+
 st.set_page_config(layout="wide")
 
+# One ID per browser session; every LLM call of this run is logged under it
+if "session_id" not in st.session_state:
+    st.session_state.session_id = str(uuid.uuid4())
+set_session(st.session_state.session_id)
+
 pages = [
     st.Page("main_chat.py", title="Chat", icon="🤖"),
     st.Page("quiz_summary.py", title="Summary & Quiz", icon="🧠"),
@@ -10,5 +22,57 @@ pages = [
 ]
 
 
+# Spend across every session is for operators only: set USAGE_ADMIN_TOKEN
+# and open the app with ?admin=<token>
+USAGE_ADMIN_TOKEN = os.getenv("USAGE_ADMIN_TOKEN")
+
+
+def is_usage_admin() -> bool:
+    token = st.query_params.get("admin")
+    if USAGE_ADMIN_TOKEN and token and hmac.compare_digest(token, USAGE_ADMIN_TOKEN):
+        # Page switches drop the query string; stay admin for the session
+        st.session_state.usage_admin = True
+    return st.session_state.get("usage_admin", False)
+
+
+def show_usage_report():
+    ledger = get_ledger()
+    with st.sidebar.expander("📊 LLM usage"):
+        session_rows = ledger.totals(session_id=st.session_state.session_id)
+        if session_rows:
+            cost = sum(row["cost_usd"] for row in session_rows)
+            tokens = sum(row["input_tokens"] + row["output_tokens"] for row in session_rows)
+            st.caption(f"This session: {tokens:,} tokens, ${cost:.4f}")
+            st.table({
+                row["feature"]: {
+                    "calls": row["calls"],
+                    "tokens in": row["input_tokens"],
+                    "tokens out": row["output_tokens"],
+                    "cache hits": row["cache_hits"],
+                    "avg s": row["avg_latency"],
+                }
+                for row in session_rows
+            })
+        else:
+            st.caption("No LLM calls in this session yet.")
+
+        if not is_usage_admin():
+            return
+        st.caption("Whole server, last 24 h")
+        server_rows = ledger.totals(("feature", "model"), since=time.time() - 24 * 3600)
+        if server_rows:
+            st.table({
+                f"{row['feature']} · {row['model']}": {
+                    "calls": row["calls"],
+                    "tokens in": row["input_tokens"],
+                    "tokens out": row["output_tokens"],
+                    "cost $": row["cost_usd"],
+                }
+                for row in server_rows
+            })
+
+
 pg = st.navigation(pages, position="top")
+# Drawn before the page, which may st.stop() or st.rerun() part way through
+show_usage_report()
 pg.run()
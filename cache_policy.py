@@ -0,0 +1,250 @@
+"""
+Bounded, size-aware caches for everything the app loads more than once.
+
+st.cache_resource / st.cache_data entries never expire and are counted in
+entries, not bytes, so a long-running pod keeps every FAISS index it ever
+loaded. Caches made here share one global byte budget, evict the least
+recently used entry across all of them, expire after a TTL, and keep
+"not found" results only briefly.
+"""
+import functools
+import hashlib
+import inspect
+import os
+import sys
+import threading
+import time
+
+MAX_CACHE_BYTES = int(float(os.getenv("CACHE_MAX_MB", "1024")) * 1e6)
+DEFAULT_TTL = float(os.getenv("CACHE_TTL_SECONDS", "3600"))
+# A failed load (bad ID, unreadable file) is retried after this long
+NEGATIVE_TTL = float(os.getenv("CACHE_NEGATIVE_TTL", "30"))
+
+
+# ----------------- Size accounting -----------------
+
+def deep_sizeof(obj, seen=None) -> int:
+    """Rough recursive size in bytes of plain Python containers and objects."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+
+def _faiss_store_size(vectordb) -> int:
+    index = vectordb.index
+    try:
+        # Bytes per stored vector for the actual encoding (fp16, int8, PCA...)
+        code_size = index.sa_code_size()
+    except Exception:
+        code_size = index.d * 4
+    documents = getattr(vectordb.docstore, "_dict", {}).values()
+    # ~200 bytes of Document / metadata overhead per chunk on top of its text
+    return index.ntotal * code_size + sum(len(doc.page_content) + 200 for doc in documents)
+
+
+def estimate_size(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if hasattr(value, "index") and hasattr(value, "docstore"):
+        return _faiss_store_size(value)
+    return deep_sizeof(value)
+
+
+# ----------------- Caches -----------------
+
+class _Entry:
+    __slots__ = ("value", "size", "expires_at", "last_used", "negative")
+
+    def __init__(self, value, size, expires_at, negative):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+        self.last_used = time.monotonic()
+        self.negative = negative
+
+
+class BoundedCache:
+    """
+    One named cache under the global byte budget.
+
+    max_bytes caps this cache on its own as well; ttl is how long a hit stays
+    valid; negative(value) marks results (None by default) that are kept for
+    NEGATIVE_TTL only, so a bad ID is not cached for good.
+    """
+
+    def __init__(self, name, max_bytes=None, ttl=DEFAULT_TTL, negative_ttl=NEGATIVE_TTL,
+                 negative=lambda value: value is None):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.negative = negative
+        self._entries = {}
+        self._loading = {}
+        self.stats = dict(hits=0, misses=0, negative_hits=0, evicted=0, expired=0, too_large=0)
+        with _lock:
+            _registry[name] = self
+
+    @property
+    def bytes_used(self) -> int:
+        return sum(entry.size for entry in self._entries.values())
+
+    def get(self, key, default=None):
+        with _lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry.expires_at <= time.monotonic():
+                del self._entries[key]
+                self.stats["expired"] += 1
+                return default
+            entry.last_used = time.monotonic()
+            self.stats["negative_hits" if entry.negative else "hits"] += 1
+            return entry.value
+
+    def put(self, key, value) -> None:
+        negative = self.negative(value)
+        size = estimate_size(value)
+        ttl = self.negative_ttl if negative else self.ttl
+        with _lock:
+            self._entries.pop(key, None)
+            if size > min(MAX_CACHE_BYTES, self.max_bytes or MAX_CACHE_BYTES):
+                self.stats["too_large"] += 1
+                return
+            self._entries[key] = _Entry(value, size, time.monotonic() + ttl, negative)
+            _evict(self)
+
+    def get_or_load(self, key, loader):
+        """Cached value for key, calling loader() once on a miss even if many threads ask at once."""
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+
+        with _lock:
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            # Another thread may have loaded it while we waited
+            value = self.get(key, missing)
+            if value is not missing:
+                return value
+            with _lock:
+                self.stats["misses"] += 1
+            try:
+                value = loader()
+                self.put(key, value)
+            finally:
+                # Only once the value is in: a caller arriving now must find it, not load again
+                with _lock:
+                    self._loading.pop(key, None)
+            return value
+
+    def invalidate(self, key) -> None:
+        with _lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with _lock:
+            self._entries.clear()
+
+
+_lock = threading.RLock()
+_registry = {}
+
+
+def get_cache(name, **options) -> BoundedCache:
+    """The cache called name, created on first use. Page scripts rerun, so caches are looked up by name."""
+    with _lock:
+        cache = _registry.get(name)
+        if cache is None:
+            cache = BoundedCache(name, **options)
+        return cache
+
+
+def _evict(cache: BoundedCache) -> None:
+    """Drop expired entries, then least recently used ones until both budgets fit. Holds _lock."""
+    now = time.monotonic()
+    for owner in _registry.values():
+        for key in [k for k, e in owner._entries.items() if e.expires_at <= now]:
+            del owner._entries[key]
+            owner.stats["expired"] += 1
+
+    while cache.max_bytes is not None and cache.bytes_used > cache.max_bytes:
+        _drop_oldest([cache])
+    while sum(owner.bytes_used for owner in _registry.values()) > MAX_CACHE_BYTES:
+        _drop_oldest(_registry.values())
+
+
+def _drop_oldest(caches) -> None:
+    owner, key = min(
+        ((owner, key) for owner in caches for key in owner._entries),
+        key=lambda item: item[0]._entries[item[1]].last_used,
+    )
+    del owner._entries[key]
+    owner.stats["evicted"] += 1
+
+
+def cache_stats() -> dict:
+    with _lock:
+        caches = {
+            cache.name: dict(cache.stats, entries=len(cache._entries), bytes=cache.bytes_used)
+            for cache in _registry.values()
+        }
+    return {
+        "max_bytes": MAX_CACHE_BYTES,
+        "bytes": sum(cache["bytes"] for cache in caches.values()),
+        "caches": caches,
+    }
+
+
+# ----------------- Decorator -----------------
+
+def _key_part(value):
+    # File contents are hashed so the key does not hold a second copy
+    if isinstance(value, (bytes, bytearray)):
+        return hashlib.sha1(value).hexdigest()
+    return value
+
+
+def bounded_cache(name=None, max_bytes=None, ttl=DEFAULT_TTL, negative_ttl=NEGATIVE_TTL,
+                  negative=lambda value: value is None):
+    """
+    Caches a loader in a BoundedCache.
+
+    Like st.cache_resource, parameters whose name starts with an underscore
+    are left out of the key (for unhashable things like embeddings). The
+    cache object is available as fn.cache.
+    """
+    def decorator(fn):
+        cache = get_cache(
+            name or f"{fn.__module__}.{fn.__qualname__}",
+            max_bytes=max_bytes, ttl=ttl, negative_ttl=negative_ttl, negative=negative,
+        )
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = tuple(
+                (param, _key_part(value))
+                for param, value in bound.arguments.items()
+                if not param.startswith("_")
+            )
+            return cache.get_or_load(key, lambda: fn(*args, **kwargs))
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
@@ -0,0 +1,55 @@
+import os
+import re
+from functools import lru_cache
+
+# Messages rendered on every rerun; older ones sit behind "Show earlier messages".
+CHAT_WINDOW = int(os.getenv("CHAT_WINDOW", "20"))
+
+# ----------------- Math normalization -----------------
+# Compiled once per process instead of on every question.
+
+_DISPLAY_BLOCK = re.compile(r"\\\[\s*(.*?)\s*\\\]", flags=re.DOTALL)
+# Plain [ ... ] is only math when it looks like LaTeX; citations like [1],
+# markdown links and "[optional]" stay as they are
+_BRACKET_BLOCK = re.compile(r"\[\s*([^\[\]]*?)\s*\](?!\()")
+_LATEX_HINT = re.compile(r"\\[A-Za-z]|\^|_[{\d]")
+_DOLLAR_BLOCK = re.compile(r"\$\$\s*(.*?)\s*\$\$", flags=re.DOTALL)
+_LONE_BACKSLASH = re.compile(r"^\s*\\\s*$", flags=re.MULTILINE)
+_INLINE_PAREN = re.compile(r"\\\((.*?)\\\)")
+
+
+def _bracket_math(match) -> str:
+    body = match.group(1)
+    return f"$$\n{body}\n$$" if _LATEX_HINT.search(body) else match.group(0)
+
+
+def normalize_llm_math(text: str) -> str:
+    text = _DISPLAY_BLOCK.sub(r"$$\n\1\n$$", text)
+    text = _BRACKET_BLOCK.sub(_bracket_math, text)
+    text = _DOLLAR_BLOCK.sub(r"$$\n\1\n$$", text)
+    text = _LONE_BACKSLASH.sub("", text)
+    text = text.replace(r"\$", "$")
+    text = _INLINE_PAREN.sub(r"$\1$", text)
+    lines = text.splitlines()
+    cleaned = []
+    for line in lines:
+        if line.strip() == "$$":
+            cleaned.append("$$")
+        else:
+            cleaned.append(line.rstrip())
+    return "\n".join(cleaned)
+
+
+@lru_cache(maxsize=2048)
+def render_markdown(role: str, content: str) -> str:
+    """Markdown ready for st.markdown, computed once per distinct message."""
+    if role == "assistant":
+        return normalize_llm_math(content).replace("\n", "  \n")
+    return content
+
+
+def visible_window(messages, extra_pages: int = 0):
+    """Returns (hidden_count, visible_messages) for the newest CHAT_WINDOW * (1 + extra_pages) messages."""
+    shown = CHAT_WINDOW * (1 + extra_pages)
+    hidden = max(0, len(messages) - shown)
+    return hidden, messages[hidden:]
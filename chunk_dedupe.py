@@ -0,0 +1,165 @@
+import hashlib
+import os
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+# ----------------- Settings -----------------
+
+# A line that shows up on at least this share of pages is a header/footer.
+BOILERPLATE_PAGE_SHARE = 0.5
+BOILERPLATE_MIN_PAGES = 3
+# Only this many non-empty lines at the top and bottom of a page can be
+# header/footer; a repeated line inside the body is content.
+PAGE_EDGE_LINES = 3
+
+# MinHash with 64 permutations split into 8 bands of 8 rows: chunks with a
+# Jaccard similarity around 0.8 and above end up in the same LSH bucket.
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 8
+SHINGLE_WORDS = 3
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.85"))
+
+_MERSENNE_PRIME = (1 << 31) - 1
+_rng = np.random.RandomState(1234)
+_PERM_A = _rng.randint(1, _MERSENNE_PRIME, size=MINHASH_PERMUTATIONS).astype(np.int64)
+_PERM_B = _rng.randint(0, _MERSENNE_PRIME, size=MINHASH_PERMUTATIONS).astype(np.int64)
+
+_WHITESPACE = re.compile(r"\s+")
+_DIGITS = re.compile(r"\d+")
+
+
+def normalize(text: str) -> str:
+    return _WHITESPACE.sub(" ", text).strip().lower()
+
+
+def _line_key(line: str) -> str:
+    # Page numbers and dates are the usual difference between two footers
+    return _DIGITS.sub("0", normalize(line))
+
+
+# ----------------- Page level: headers / footers -----------------
+
+def _edge_positions(lines):
+    """Indexes of the first and last PAGE_EDGE_LINES non-empty lines of a page."""
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    return set(filled[:PAGE_EDGE_LINES]) | set(filled[-PAGE_EDGE_LINES:])
+
+
+def strip_repeated_lines(documents):
+    """
+    Remove lines at the top or bottom of a page that repeat on many pages
+    (running headers, footers, page numbers, copyright lines) before the
+    text is split into chunks.
+
+    Returns the number of lines removed.
+    """
+    if len(documents) < BOILERPLATE_MIN_PAGES:
+        return 0
+
+    page_lines = Counter()
+    for document in documents:
+        lines = document.page_content.splitlines()
+        page_lines.update({_line_key(lines[i]) for i in _edge_positions(lines)})
+
+    min_pages = max(BOILERPLATE_MIN_PAGES, int(len(documents) * BOILERPLATE_PAGE_SHARE))
+    boilerplate = {line for line, pages in page_lines.items() if pages >= min_pages}
+    if not boilerplate:
+        return 0
+
+    removed = 0
+    for document in documents:
+        lines = document.page_content.splitlines()
+        edges = _edge_positions(lines)
+        kept = []
+        for i, line in enumerate(lines):
+            if i in edges and _line_key(line) in boilerplate:
+                removed += 1
+            else:
+                kept.append(line)
+        document.page_content = "\n".join(kept)
+    return removed
+
+
+# ----------------- Chunk level: exact + near duplicates -----------------
+
+def _shingle_hashes(text: str) -> np.ndarray:
+    words = text.split()
+    if len(words) < SHINGLE_WORDS:
+        shingles = {text}
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in shingles],
+        dtype=np.int64,
+    )
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    hashes = _shingle_hashes(text)
+    permuted = (_PERM_A[:, None] * hashes[None, :] + _PERM_B[:, None]) % _MERSENNE_PRIME
+    return permuted.min(axis=1)
+
+
+def dedupe_chunks(docs):
+    """
+    Drop chunks that are exact or near duplicates of an earlier chunk.
+
+    The first occurrence is kept and its metadata counts how many copies were
+    folded into it. Returns (kept_docs, stats).
+    """
+    kept = []
+    seen_exact = {}
+    signatures = []
+    buckets = defaultdict(list)
+    rows = MINHASH_PERMUTATIONS // LSH_BANDS
+    exact_duplicates = near_duplicates = empty_chunks = 0
+
+    for doc in docs:
+        text = normalize(doc.page_content)
+        if not text:
+            empty_chunks += 1
+            continue
+
+        digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        if digest in seen_exact:
+            original = kept[seen_exact[digest]]
+            original.metadata["duplicate_count"] = original.metadata.get("duplicate_count", 0) + 1
+            exact_duplicates += 1
+            continue
+
+        signature = minhash_signature(text)
+        band_keys = [
+            (band, signature[band * rows:(band + 1) * rows].tobytes())
+            for band in range(LSH_BANDS)
+        ]
+        candidates = {position for key in band_keys for position in buckets[key]}
+        match = next(
+            (
+                position for position in sorted(candidates)
+                if np.mean(signatures[position] == signature) >= NEAR_DUPLICATE_THRESHOLD
+            ),
+            None,
+        )
+        if match is not None:
+            original = kept[match]
+            original.metadata["duplicate_count"] = original.metadata.get("duplicate_count", 0) + 1
+            near_duplicates += 1
+            continue
+
+        position = len(kept)
+        kept.append(doc)
+        signatures.append(signature)
+        seen_exact[digest] = position
+        for key in band_keys:
+            buckets[key].append(position)
+
+    stats = {
+        "chunks_before_dedupe": len(docs),
+        "chunks_after_dedupe": len(kept),
+        "exact_duplicates": exact_duplicates,
+        "near_duplicates": near_duplicates,
+        "empty_chunks": empty_chunks,
+    }
+    return kept, stats
@@ -1,6 +1,7 @@
 import streamlit as st
 import os
 from pathlib import Path
+from cache_policy import cache_stats
 
 
 st.set_page_config(page_title="Settings", page_icon="⚙️",layout="wide")
@@ -63,6 +64,18 @@ else:
 
 st.markdown("---")
 
+# ================= CACHE SECTION =================
+with st.expander("🗄️ Cache usage on this server"):
+    stats = cache_stats()
+    st.caption(f"{stats['bytes'] / 1e6:.1f} MB of {stats['max_bytes'] / 1e6:.0f} MB in use")
+    if stats["caches"]:
+        st.table({
+            name: {**cache, "bytes": f"{cache['bytes'] / 1e6:.1f} MB"}
+            for name, cache in stats["caches"].items()
+        })
+
+st.markdown("---")
+
 # ================= CONTACT SECTION =================
 st.header("📬 Contact Developer")
 st.write("Have questions or feedback? Reach out to me!")
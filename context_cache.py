@@ -0,0 +1,151 @@
+"""
+Document context cache for repeated summary and quiz calls on one document.
+
+Every "Next 5 Questions" used to resend the same 25,000 characters. A
+document is now registered once with Gemini's cached-content API and the
+handle is reused by every later summary and quiz call on it; each call only
+sends the short task.
+
+Where explicit caching is not available (Groq, a model that rejects it, a
+document below the minimum cache size, a call with a system prompt or
+search), the document is sent as the first part of the prompt instead.
+Every call on the same document then shares one long identical prefix,
+which the providers' implicit prefix caching can reuse.
+
+FakeContextBackend stands in for the Gemini API in tests and with
+LLM_PROVIDER_MODE=fake:
+
+    python context_cache.py     # summary + quiz batches on fake providers
+"""
+import hashlib
+import itertools
+import os
+import threading
+from dataclasses import dataclass
+
+from cache_policy import get_cache
+from quota_scheduler import fingerprint
+
+# How long Gemini keeps a registered document; storage is billed per hour
+CONTEXT_CACHE_TTL = int(os.getenv("CONTEXT_CACHE_TTL_SECONDS", "3600"))
+# Handles are dropped locally a bit before the server forgets them
+HANDLE_TTL_MARGIN = 60
+# Gemini refuses caches below ~1-4k tokens depending on the model; shorter
+# documents are not worth a registration round trip anyway
+MIN_CACHE_CHARS = int(os.getenv("CONTEXT_CACHE_MIN_CHARS", "8000"))
+# A model or document that could not be cached is retried after this long
+UNCACHEABLE_TTL = 600
+
+
+@dataclass(frozen=True)
+class DocumentContext:
+    text: str
+
+    @property
+    def key(self) -> str:
+        return hashlib.sha256(self.text.encode("utf-8")).hexdigest()
+
+    @property
+    def preamble(self) -> str:
+        return f"DOCUMENT:\n{self.text}"
+
+    def prefixed(self, task: str) -> str:
+        """The document first, then the task, so calls on it share the longest prefix."""
+        return f"{self.preamble}\n\n{task}"
+
+
+# ----------------- Backends -----------------
+
+class GeminiContextBackend:
+    def create(self, api_key: str, model: str, context: DocumentContext) -> str:
+        from google.genai import types
+        from llm_providers import _gemini_client
+
+        cached = _gemini_client(api_key).caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                contents=[types.Content(role="user", parts=[types.Part(text=context.preamble)])],
+                ttl=f"{CONTEXT_CACHE_TTL}s",
+                display_name=f"doc-{context.key[:16]}",
+            ),
+        )
+        return cached.name
+
+
+class FakeContextBackend:
+    """In-memory handles; counts registrations so tests can check the reuse."""
+
+    def __init__(self, min_chars: int = 0):
+        self.min_chars = min_chars
+        self.documents = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def create(self, api_key: str, model: str, context: DocumentContext) -> str:
+        if len(context.text) < self.min_chars:
+            raise ValueError("Cached content is too small")
+        with self._lock:
+            handle = f"cachedContents/fake-{next(self._ids)}"
+            self.documents[handle] = context.text
+        return handle
+
+
+# ----------------- Handle cache -----------------
+
+class ContextCache:
+    """
+    One handle per (API key, model, document), created once even when many
+    threads ask at the same time. None means "use the prompt prefix".
+    """
+
+    def __init__(self, backend, name: str, min_chars: int = MIN_CACHE_CHARS):
+        self.backend = backend
+        self.min_chars = min_chars
+        self.handles = get_cache(
+            name,
+            ttl=CONTEXT_CACHE_TTL - HANDLE_TTL_MARGIN,
+            negative_ttl=UNCACHEABLE_TTL,
+        )
+
+    def handle(self, api_key: str, model: str, context: DocumentContext):
+        if len(context.text) < self.min_chars:
+            return None
+        key = (fingerprint(api_key), model, context.key)
+        return self.handles.get_or_load(key, lambda: self._create(api_key, model, context))
+
+    def _create(self, api_key, model, context):
+        try:
+            return self.backend.create(api_key, model, context)
+        except Exception as e:
+            print(f"Context cache unavailable for {model}, sending the document inline: {e}")
+            return None
+
+    def invalidate(self, api_key: str, model: str, context: DocumentContext) -> None:
+        """Forget a handle the provider no longer knows (expired or deleted)."""
+        self.handles.invalidate((fingerprint(api_key), model, context.key))
+
+
+gemini_contexts = ContextCache(GeminiContextBackend(), "gemini_context_handles")
+fake_contexts = ContextCache(FakeContextBackend(), "fake_context_handles", min_chars=0)
+
+
+if __name__ == "__main__":
+    os.environ["LLM_PROVIDER_MODE"] = "fake"
+    os.environ.setdefault("GEMINI_API_KEY", "fake")
+
+    import context_cache
+    import llm_providers
+    import quiz_engine
+
+    fake = context_cache.fake_contexts
+
+    text = "Photosynthesis turns light into chemical energy. " * 600
+    quiz_engine.generate_summary(text)
+    for _ in range(3):
+        quiz_engine.generate_quiz(text, [])
+
+    print(f"documents registered: {len(fake.backend.documents)}")
+    print(f"handle cache: {fake.handles.stats}")
+    for feature in ("summary", "quiz"):
+        for provider in llm_providers.get_router(feature).providers:
+            print(f"{provider.key}: {provider.calls} calls, {provider.cached_calls} on a cached document")
@@ -0,0 +1,143 @@
+import os
+import re
+from dataclasses import dataclass
+
+# ----------------- Budgets -----------------
+
+# Everything the chat history may add to a prompt: rolling summary + recent turns.
+MEMORY_TOKEN_BUDGET = int(os.getenv("CHAT_MEMORY_TOKENS", "1200"))
+# Hard cap on the rolling summary itself.
+SUMMARY_TOKEN_BUDGET = int(os.getenv("CHAT_SUMMARY_TOKENS", "300"))
+
+# Questions with a pronoun or reference that only earlier turns resolve need
+# rewriting before they can be used as a retrieval query on their own.
+# Words like "why", "explain" or "this" also start plenty of standalone
+# questions, so they don't count.
+FOLLOW_UP_PATTERN = re.compile(
+    r"\b(it|its|they|them|their|these|those|he|him|his|she|her|"
+    r"the (above|former|latter)|(the )?(same|previous|last|earlier) (one|answer|question|point|part)|"
+    r"you (just )?(said|say|mentioned))\b",
+    re.IGNORECASE,
+)
+# Elliptical continuations: "and for mitosis?", "what about the second law?"
+CONTINUATION_PATTERN = re.compile(r"^\s*(and|or|also|what about|how about)\b", re.IGNORECASE)
+
+SUMMARY_PROMPT = """Update the running summary of a study chat with the new messages.
+Keep facts, topics and open questions the student cares about. Use at most {max_words} words.
+NO PREAMBLE.
+
+CURRENT SUMMARY:
+{summary}
+
+NEW MESSAGES:
+{messages}
+"""
+
+REWRITE_PROMPT = """Rewrite the student's last question as a standalone search query
+that can be understood without the conversation. Keep it short.
+Return ONLY the rewritten question.
+
+CONVERSATION:
+{history}
+
+LAST QUESTION: {question}
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token is close enough for budgeting English text
+    return len(text) // 4 + 1
+
+
+def format_messages(messages) -> str:
+    return "\n".join(f"{role}: {content}" for role, content in messages)
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    return text[: max_tokens * 4]
+
+
+@dataclass
+class ConversationMemory:
+    """
+    Rolling summary of old turns + verbatim recent turns, kept under MEMORY_TOKEN_BUDGET.
+
+    Old messages are folded into the summary in chunks (down to half the
+    budget) so the summarizer runs every few turns, not on every question.
+    """
+    summary: str = ""
+    summarized_upto: int = 0
+
+    def update(self, history, generate=None):
+        """
+        Returns the recent messages to keep verbatim, folding older ones into the summary.
+
+        history is the list of (role, content) pairs before the current question;
+        generate(prompt) -> str writes the summary. Without it the overflow is dropped.
+        """
+        if self.summarized_upto > len(history):
+            # History was cleared or replaced
+            self.summary, self.summarized_upto = "", 0
+
+        recent_budget = MEMORY_TOKEN_BUDGET - estimate_tokens(self.summary)
+        tail_start, used = self._tail_start(history, recent_budget)
+
+        if tail_start > self.summarized_upto:
+            # Over budget: fold until the tail fits in half the budget
+            tail_start, _ = self._tail_start(history, recent_budget // 2)
+            overflow = history[self.summarized_upto:tail_start]
+            if generate is not None:
+                self.summary = self._summarize(overflow, generate)
+            self.summarized_upto = tail_start
+
+        return history[tail_start:]
+
+    def _tail_start(self, history, budget):
+        tail_start, used = len(history), 0
+        while tail_start > self.summarized_upto:
+            cost = estimate_tokens(history[tail_start - 1][1])
+            if used + cost > budget:
+                break
+            used += cost
+            tail_start -= 1
+        return tail_start, used
+
+    def _summarize(self, overflow, generate) -> str:
+        prompt = SUMMARY_PROMPT.format(
+            max_words=SUMMARY_TOKEN_BUDGET * 3 // 4,
+            summary=self.summary or "(empty)",
+            messages=format_messages(overflow),
+        )
+        try:
+            new_summary = generate(prompt).strip()
+        except Exception as e:
+            print(f"Summary update failed: {e}")
+            return self.summary
+        return _truncate(new_summary, SUMMARY_TOKEN_BUDGET)
+
+    def context(self, recent) -> str:
+        """The history block that goes into the prompt."""
+        parts = []
+        if self.summary:
+            parts.append(f"Summary of earlier conversation: {self.summary}")
+        if recent:
+            parts.append(format_messages(recent))
+        return "\n".join(parts)
+
+
+def is_follow_up(question: str) -> bool:
+    return bool(FOLLOW_UP_PATTERN.search(question) or CONTINUATION_PATTERN.match(question))
+
+
+def rewrite_query(question: str, history_context: str, generate) -> str:
+    """Turns a follow-up into a standalone retrieval query; self-contained questions skip the LLM."""
+    if not history_context or not is_follow_up(question):
+        return question
+    try:
+        rewritten = generate(
+            REWRITE_PROMPT.format(history=history_context, question=question)
+        ).strip()
+    except Exception as e:
+        print(f"Query rewrite failed: {e}")
+        return question
+    return rewritten or question
@@ -0,0 +1,264 @@
+"""
+Durable outbox for Google Docs exports.
+
+Saving a summary or quiz used to block the page on the Apps Script webhook.
+Exports are now written to a local SQLite table and the page returns at
+once; a background worker delivers them with timeouts and retries with
+backoff, and survives restarts because the queue is on disk.
+
+For local runs, point DOCS_WEBHOOK_URL at the stand-in webhook:
+
+    python docs_outbox.py --stand-in --port 8765 --failure-rate 0.3
+    DOCS_WEBHOOK_URL=http://127.0.0.1:8765 streamlit run app.py
+"""
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from functools import lru_cache
+
+import requests
+
+DOCS_WEBHOOK_URL = os.getenv(
+    "DOCS_WEBHOOK_URL",
+    "https://script.google.com/macros/s/AKfycbw1Jew58JG48DYdKIVMrCt-7m-g4slyLmDfH8AgNDIdFQqgEXRmS8owx8sYkMxfe2yPgQ/exec",
+)
+OUTBOX_PATH = os.getenv("DOCS_OUTBOX_PATH", ".docs_outbox.sqlite3")
+
+# Exports picked up per worker cycle, sent over one keep-alive session
+OUTBOX_BATCH_SIZE = int(os.getenv("DOCS_OUTBOX_BATCH_SIZE", "10"))
+# Apps Script can take a while to spin up, so allow a long read
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 60
+MAX_ATTEMPTS = 8
+BASE_BACKOFF = 2.0
+MAX_BACKOFF = 300.0
+POLL_SECONDS = 5.0
+# A row left in "sending" longer than any batch can take was claimed by a
+# cycle that failed before recording the result; it is claimed again
+SENDING_TIMEOUT = OUTBOX_BATCH_SIZE * (CONNECT_TIMEOUT + READ_TIMEOUT)
+
+STATUSES = ("queued", "sending", "delivered", "failed")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS exports (
+    id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS exports_due ON exports (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS exports_session ON exports (session_id, created_at);
+"""
+
+
+class PermanentError(Exception):
+    """The webhook rejected the export; retrying would not help."""
+
+
+def backoff(attempts: int) -> float:
+    delay = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** (attempts - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class DocsOutbox:
+    def __init__(self, path: str = OUTBOX_PATH, webhook_url: str = DOCS_WEBHOOK_URL):
+        self.webhook_url = webhook_url
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+            # Exports that were mid-flight when the process died are sent again
+            self._db.execute("UPDATE exports SET status = 'queued' WHERE status = 'sending'")
+        self._worker = threading.Thread(target=self._run, name="docs-outbox", daemon=True)
+        self._worker.start()
+
+    # ----------------- Producer side -----------------
+
+    def enqueue(self, session_id: str, title: str, summary=None, quiz_results=None) -> str:
+        payload = {"title": title}
+        if summary:
+            payload["summary"] = summary
+        if quiz_results:
+            payload["quiz_results"] = quiz_results
+
+        export_id = str(uuid.uuid4())
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO exports (id, session_id, title, payload, status, next_attempt_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (export_id, session_id, title, json.dumps(payload), now, now, now),
+            )
+        self._wake.set()
+        return export_id
+
+    def session_exports(self, session_id: str, limit: int = 20):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, title, status, attempts, next_attempt_at, last_error, created_at "
+                "FROM exports WHERE session_id = ? ORDER BY created_at DESC LIMIT ?",
+                (session_id, limit),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def retry(self, export_id: str) -> None:
+        """Puts a failed export back in the queue."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE exports SET status = 'queued', attempts = 0, next_attempt_at = ?, updated_at = ? "
+                "WHERE id = ? AND status = 'failed'",
+                (time.time(), time.time(), export_id),
+            )
+        self._wake.set()
+
+    # ----------------- Worker side -----------------
+
+    def _claim_due(self):
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, payload, attempts FROM exports "
+                "WHERE (status = 'queued' AND next_attempt_at <= ?) OR (status = 'sending' AND updated_at < ?) "
+                "ORDER BY next_attempt_at LIMIT ?",
+                (now, now - SENDING_TIMEOUT, OUTBOX_BATCH_SIZE),
+            ).fetchall()
+            self._db.executemany(
+                "UPDATE exports SET status = 'sending', updated_at = ? WHERE id = ?",
+                [(now, row["id"]) for row in rows],
+            )
+        return rows
+
+    def _next_due_in(self) -> float:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MIN(next_attempt_at) FROM exports WHERE status = 'queued'"
+            ).fetchone()
+        if row[0] is None:
+            return POLL_SECONDS
+        return max(0.0, min(POLL_SECONDS, row[0] - time.time()))
+
+    def _deliver(self, http, payload: dict) -> None:
+        response = http.post(self.webhook_url, json=payload, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        if response.ok:
+            return
+        if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+            raise PermanentError(f"HTTP {response.status_code}: {response.text[:200]}")
+        raise RuntimeError(f"HTTP {response.status_code}")
+
+    def _record(self, row, error=None, permanent=False) -> None:
+        now = time.time()
+        attempts = row["attempts"] + 1
+        if error is None:
+            status, next_attempt = "delivered", now
+        elif permanent or attempts >= MAX_ATTEMPTS:
+            status, next_attempt = "failed", now
+        else:
+            status, next_attempt = "queued", now + backoff(attempts)
+        with self._lock:
+            self._db.execute(
+                "UPDATE exports SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ? "
+                "WHERE id = ?",
+                (status, attempts, next_attempt, None if error is None else str(error)[:500], now, row["id"]),
+            )
+
+    def _run(self):
+        http = requests.Session()
+        while True:
+            try:
+                rows = self._claim_due()
+                for row in rows:
+                    try:
+                        self._deliver(http, json.loads(row["payload"]))
+                        self._record(row)
+                    except PermanentError as e:
+                        self._record(row, e, permanent=True)
+                    except Exception as e:
+                        self._record(row, e)
+                if not rows:
+                    self._wake.wait(self._next_due_in())
+                    self._wake.clear()
+            except Exception as e:
+                # A locked or broken database must not stop deliveries for good
+                print(f"Docs outbox worker error, retrying in {POLL_SECONDS:.0f} s: {e}")
+                self._wake.wait(POLL_SECONDS)
+                self._wake.clear()
+
+
+@lru_cache(maxsize=1)
+def get_outbox() -> DocsOutbox:
+    """One outbox and worker per process."""
+    return DocsOutbox()
+
+
+# ----------------- Local stand-in webhook -----------------
+
+def stand_in_server(port: int = 8765, failure_rate: float = 0.0, delay: float = 0.0,
+                    failure_status: int = 503):
+    """
+    A local webhook that logs exports; failure_rate of the calls answer
+    failure_status to exercise retries (503) or permanent rejections (400).
+
+    The settings and the received payloads are attributes of the returned
+    server, so tests can change them while it runs. Port 0 picks a free port.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(self.server.delay)
+            if random.random() < self.server.failure_rate:
+                self.send_response(self.server.failure_status)
+                self.end_headers()
+                return
+            payload = json.loads(body or b"{}")
+            self.server.received.append(payload)
+            print(f"received export: {payload.get('title')} ({len(body)} bytes)")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b'{"status": "ok"}')
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.failure_rate = failure_rate
+    server.failure_status = failure_status
+    server.delay = delay
+    server.received = []
+    return server
+
+
+def serve_stand_in(port: int = 8765, failure_rate: float = 0.0, delay: float = 0.0):
+    server = stand_in_server(port, failure_rate, delay)
+    print(f"Stand-in Docs webhook on http://127.0.0.1:{server.server_port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Google Docs export outbox tools")
+    parser.add_argument("--stand-in", action="store_true", help="run the local stand-in webhook")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds before the stand-in answers")
+    args = parser.parse_args()
+    if args.stand_in:
+        serve_stand_in(args.port, args.failure_rate, args.delay)
+    else:
+        parser.print_help()
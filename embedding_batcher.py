@@ -0,0 +1,145 @@
+"""
+Cross-session micro-batching for embeddings.
+
+Every chat question used to run its own batch-of-one forward pass. Here all
+sessions of the process hand their texts to one worker thread, which waits
+at most EMBED_MAX_WAIT_MS after the first request for others to arrive and
+embeds them in a single call. Alone, a request pays only that wait; under
+load, dozens of questions share one forward pass.
+
+    python embedding_batcher.py --threads 32 --requests 20   # throughput benchmark
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from functools import lru_cache
+
+from langchain_core.embeddings import Embeddings
+
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "64"))
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", "5"))
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings model so concurrent calls are embedded together.
+
+    Queries are batched through base.embed_documents, which gives the same
+    vectors as embed_query for models without a query prompt (all-mpnet has
+    none). Document lists of a full batch or more skip the queue.
+    """
+
+    def __init__(self, base: Embeddings, max_batch: int = EMBED_MAX_BATCH,
+                 max_wait_ms: float = EMBED_MAX_WAIT_MS):
+        self.base = base
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.stats = {"batches": 0, "texts": 0, "largest_batch": 0}
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    def embed_query(self, text: str):
+        return self._submit([text])[0]
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        if len(texts) >= self.max_batch:
+            return self.base.embed_documents(texts)
+        return self._submit(texts)
+
+    def _submit(self, texts):
+        future = Future()
+        self._queue.put((texts, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request[0])
+            self._embed(batch, size)
+
+    def _embed(self, batch, size):
+        texts = [text for request_texts, _ in batch for text in request_texts]
+        try:
+            vectors = self.base.embed_documents(texts)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.stats["batches"] += 1
+        self.stats["texts"] += size
+        self.stats["largest_batch"] = max(self.stats["largest_batch"], size)
+        start = 0
+        for request_texts, future in batch:
+            future.set_result(vectors[start:start + len(request_texts)])
+            start += len(request_texts)
+
+
+@lru_cache(maxsize=None)
+def get_embeddings(model_name: str) -> BatchingEmbeddings:
+    """
+    The process-wide embedder of one model; every page, the API and ingestion
+    share it. Models are picked through embedding_models.embeddings_for.
+    """
+    from langchain_huggingface.embeddings import HuggingFaceEmbeddings
+    return BatchingEmbeddings(HuggingFaceEmbeddings(model_name=model_name))
+
+
+# ----------------- Benchmark -----------------
+
+def benchmark(embeddings: Embeddings, threads: int, requests: int) -> dict:
+    """Queries per second and per-query latency with `threads` sessions asking at once."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    latencies = []
+
+    def session(n):
+        for i in range(requests):
+            started = time.perf_counter()
+            embeddings.embed_query(f"What does chapter {n} say about topic {i}?")
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(session, range(threads)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "queries_per_s": round(threads * requests / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 1),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare direct and micro-batched query embedding")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=20)
+    args = parser.parse_args()
+
+    from embedding_models import embeddings_for
+    batched = embeddings_for()
+    batched.embed_query("warm up")
+    for name, model in (("direct", batched.base), ("batched", batched)):
+        print(f"{name:>8} 1 thread : {benchmark(model, 1, args.requests)}")
+        print(f"{name:>8} {args.threads} threads: {benchmark(model, args.threads, args.requests)}")
+    print(f"batches: {batched.stats}")
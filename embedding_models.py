@@ -0,0 +1,197 @@
+"""
+Registry of the embedding models an index can be built with.
+
+Every index records the model that built it (and its dimension) in
+index_meta.json, and loaders pick the matching embedder from there, so
+indexes built with different models can be loaded and searched side by
+side. Indexes saved before the model was recorded were all built with
+all-mpnet-base-v2 and keep loading with it.
+
+Every document is embedded with DEFAULT_MODEL. SMALL_DOCUMENT_MODEL can
+send small documents to a faster model, once the benchmark shows it keeps
+retrieval quality on your own files:
+
+    python embedding_models.py notes.pdf --models mpnet minilm
+"""
+import json
+import os
+import random
+import re
+import time
+from dataclasses import dataclass
+
+from langchain_community.vectorstores import FAISS
+
+from embedding_batcher import get_embeddings
+
+INDEX_META_FILE = "index_meta.json"
+
+
+@dataclass(frozen=True)
+class EmbeddingModel:
+    model_id: str
+    name: str
+    dimension: int
+    # Cosine similarity below which a chunk is unrelated to the question;
+    # every model spreads its scores differently
+    relevance_threshold: float
+
+
+EMBEDDING_MODELS = {
+    "mpnet": EmbeddingModel("mpnet", "sentence-transformers/all-mpnet-base-v2", 768, 0.2),
+    "minilm": EmbeddingModel("minilm", "sentence-transformers/all-MiniLM-L6-v2", 384, 0.25),
+}
+
+# Every index without a recorded model was built with this one
+LEGACY_MODEL = "mpnet"
+DEFAULT_MODEL = os.getenv("EMBEDDING_MODEL", "mpnet")
+# Documents up to SMALL_DOCUMENT_CHARS characters are embedded with
+# SMALL_DOCUMENT_MODEL; off (the default model) until benchmarked, e.g. "minilm"
+SMALL_DOCUMENT_MODEL = os.getenv("SMALL_DOCUMENT_MODEL", DEFAULT_MODEL)
+SMALL_DOCUMENT_CHARS = int(os.getenv("SMALL_DOCUMENT_CHARS", "100000"))
+
+
+def get_model(model_id: str) -> EmbeddingModel:
+    try:
+        return EMBEDDING_MODELS[model_id]
+    except KeyError:
+        raise ValueError(f"Unknown embedding model: {model_id}") from None
+
+
+def embeddings_for(model_id: str = DEFAULT_MODEL):
+    """The shared, micro-batched embedder of a registered model."""
+    return get_embeddings(get_model(model_id).name)
+
+
+def model_of(embeddings) -> str:
+    """Registry id of the model behind an embedder made by embeddings_for."""
+    name = getattr(getattr(embeddings, "base", embeddings), "model_name", None)
+    for model in EMBEDDING_MODELS.values():
+        if model.name == name:
+            return model.model_id
+    raise ValueError(f"Embedding model {name!r} is not in the registry")
+
+
+def choose_model(documents) -> str:
+    """The model a new index is built with, picked from the size of the document."""
+    total_chars = sum(len(doc.page_content) for doc in documents)
+    if total_chars <= SMALL_DOCUMENT_CHARS:
+        return SMALL_DOCUMENT_MODEL
+    return DEFAULT_MODEL
+
+
+def model_meta(vectordb: FAISS) -> dict:
+    return {
+        "embedding_model": model_of(vectordb.embedding_function),
+        "dimension": vectordb.index.d,
+    }
+
+
+# ----------------- Local save / load -----------------
+
+def save_index(vectordb: FAISS, folder: str) -> None:
+    """save_local, plus the model metadata load_index needs."""
+    vectordb.save_local(folder)
+    with open(os.path.join(folder, INDEX_META_FILE), "w", encoding="utf-8") as f:
+        json.dump(model_meta(vectordb), f)
+
+
+def load_index(folder: str) -> FAISS:
+    """Load an index folder with the embedder of the model that built it."""
+    meta = {}
+    meta_path = os.path.join(folder, INDEX_META_FILE)
+    if os.path.exists(meta_path):
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+
+    model = get_model(meta.get("embedding_model", LEGACY_MODEL))
+    vectordb = FAISS.load_local(
+        folder,
+        embeddings_for(model.model_id),
+        allow_dangerous_deserialization=True,
+    )
+    if vectordb.index.d != model.dimension:
+        raise ValueError(
+            f"Index has {vectordb.index.d}-dimensional vectors but {model.model_id} "
+            f"produces {model.dimension}"
+        )
+    return vectordb
+
+
+# ----------------- Benchmark -----------------
+
+def _probe_queries(chunks, count: int, seed: int = 0):
+    """
+    (query, chunk index) pairs for retrieval quality without labelled data.
+
+    Each query is one sentence taken from a chunk; a good model ranks the
+    chunk it came from near the top.
+    """
+    rng = random.Random(seed)
+    probes = []
+    for i in rng.sample(range(len(chunks)), min(count, len(chunks))):
+        sentences = [s for s in re.split(r"(?<=[.!?])\s+", chunks[i]) if len(s.split()) >= 8]
+        if sentences:
+            probes.append((rng.choice(sentences), i))
+    return probes
+
+
+def benchmark_models(chunks, model_ids=tuple(EMBEDDING_MODELS), queries: int = 100, k: int = 5) -> list:
+    """Ingestion speed, recall@k and MRR of every model on the same chunks."""
+    import faiss
+    import numpy as np
+
+    probes = _probe_queries(chunks, queries)
+    results = []
+    for model_id in model_ids:
+        model = get_model(model_id)
+        base = embeddings_for(model_id).base
+        base.embed_documents(["warm up"])
+
+        started = time.perf_counter()
+        vectors = np.array(base.embed_documents(chunks), dtype="float32")
+        elapsed = time.perf_counter() - started
+
+        index = faiss.IndexFlatL2(vectors.shape[1])
+        index.add(vectors)
+        query_vectors = np.array(base.embed_documents([q for q, _ in probes]), dtype="float32")
+        _, ranked = index.search(query_vectors, k)
+
+        hits, reciprocal_ranks = 0, 0.0
+        for (_, expected), row in zip(probes, ranked):
+            row = list(row)
+            if expected in row:
+                hits += 1
+                reciprocal_ranks += 1 / (row.index(expected) + 1)
+
+        results.append({
+            "model": model_id,
+            "dimension": model.dimension,
+            "chunks_per_s": round(len(chunks) / elapsed, 1),
+            f"recall_at_{k}": round(hits / max(1, len(probes)), 3),
+            "mrr": round(reciprocal_ranks / max(1, len(probes)), 3),
+            "index_mb": round(vectors.nbytes / 1e6, 2),
+        })
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from langchain_vector_conversion import load_documents, split_documents
+
+    parser = argparse.ArgumentParser(description="Compare embedding models on one document")
+    parser.add_argument("file", help="a .pdf, .txt or .docx file")
+    parser.add_argument("--models", nargs="+", default=list(EMBEDDING_MODELS))
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+
+    mode_of_file = {".pdf": "pdf", ".txt": "text", ".docx": "docx"}[os.path.splitext(args.file)[1].lower()]
+    with open(args.file, "rb") as f:
+        documents = load_documents(f.read(), mode_of_file)
+    chunks = [doc.page_content for doc in split_documents(documents)]
+
+    print(f"{len(chunks)} chunks, {sum(map(len, chunks))} characters")
+    for row in benchmark_models(chunks, args.models, args.queries, args.k):
+        print(row)
@@ -1,37 +1,17 @@
 from langchain_community.vectorstores import FAISS
-from langchain_huggingface.embeddings import HuggingFaceEmbeddings
-from langchain_classic.chains import RetrievalQA
-# from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_groq import ChatGroq
 from langchain_core.prompts import PromptTemplate
 import os
-from google.genai import types
-from google import genai
+import re
+import heapq
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import streamlit as st
+from conversation_memory import ConversationMemory, rewrite_query
+import llm_providers
+from embedding_models import get_model, load_index, model_of
+from quota_scheduler import QuotaExhausted, is_rate_limit_error
 
 load_dotenv()
-# llm = ChatGoogleGenerativeAI(
-#     # model="gemini-2.5-flash-lite",
-#     model="gemini-flash-latest",
-#     temperature=0.7,
-#     max_tokens=3000,
-#     timeout=None,
-#     max_retries=2,
-#     api_key=os.getenv('GEMINI_API_KEY'),
-# )
-llm = ChatGroq(
-    model="llama-3.1-8b-instant",
-    temperature=0.7,
-    max_tokens=None,
-    timeout=None,
-    max_retries=2,
-)
-
-embeddings = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-mpnet-base-v2"
-    )
-
 
 
 FALLBACK_PHRASES = [
@@ -46,41 +26,32 @@ def needs_internet_search(answer: str) -> bool:
     return any(phrase in answer_lower for phrase in FALLBACK_PHRASES)
 
 
-def switch_to_internet_search(retriever_query):
-    if os.getenv('GEMINI_API_KEY'):
-        client = genai.Client(api_key=os.getenv('GEMINI_API_KEY'))
-        
-        model = "gemini-2.5-flash" 
-        
-        contents = [
-            types.Content(
-                role="user",
-                parts=[types.Part.from_text(text=retriever_query)],
-            ),
-        ]
+def busy_message(error: QuotaExhausted) -> str:
+    if error.retry_after:
+        return f"Too many requests right now, please retry in about {int(error.retry_after) + 1} s."
+    return "Too many requests right now, please retry shortly."
 
 
-        tools = [
-            types.Tool(google_search=types.GoogleSearchRetrieval()),
-        ]
+def internet_search(retriever_query):
+    """Web-grounded answer; raises instead of returning an error message."""
+    if not os.getenv('GEMINI_API_KEY'):
+        raise RuntimeError("GEMINI_API_KEY is not configured")
+    return llm_providers.generate("search", retriever_query, use_search=True).text
 
-        generate_content_config = types.GenerateContentConfig(
-            tools=tools,
-        )
 
+def switch_to_internet_search(retriever_query):
+    if os.getenv('GEMINI_API_KEY'):
         try:
-        
-            response = client.models.generate_content(
-                model=model,
-                contents=contents,
-                config=generate_content_config,
-            )
-            response_after_internet_search = response.text
+            response_after_internet_search = internet_search(retriever_query)
             return response_after_internet_search
 
+        except QuotaExhausted as e:
+            response_after_internet_search = busy_message(e)
+            print(f"Detailed Error: {e}")
+            return response_after_internet_search
         except Exception as e:
         
-            if "429" in str(e):
+            if is_rate_limit_error(e):
                 response_after_internet_search = "Quota exceeded. Please wait a moment or check your billing."
             elif "400" in str(e):
                 response_after_internet_search = "Invalid API key, Check your API key in Settings"
@@ -92,60 +63,256 @@ def switch_to_internet_search(retriever_query):
         return "Head over to Settings and configure your Gemini API key"
 
 
-def ask_ai(retriever_query, full_history,data_base_live_connected):
+def chat_generate(prompt):
+    """Non-streaming chat calls go through the hedged provider router."""
+    return llm_providers.generate("chat", prompt).text
 
-    vector_embeddings = FAISS.load_local(
-        f'{data_base_live_connected}',
-        embeddings,
-        allow_dangerous_deserialization=True
-    )
 
-    retriever = vector_embeddings.as_retriever(
-        search_type="similarity",
-        search_kwargs={"k": 3},
-        score_threshold=0.5
-    )
+# ----------------- Sharded retrieval -----------------
+
+# FAISS releases the GIL while searching, so one thread per shard gives real parallelism.
+SHARD_SEARCH_WORKERS = int(os.getenv("SHARD_SEARCH_WORKERS", "8"))
+shard_search_pool = ThreadPoolExecutor(
+    max_workers=SHARD_SEARCH_WORKERS,
+    thread_name_prefix="faiss-shard",
+)
+
+
+def load_vector_db(data_base_live_connected):
+    """Accepts an already loaded FAISS store or a path saved with save_local."""
+    if isinstance(data_base_live_connected, FAISS):
+        return data_base_live_connected
+    return load_index(f'{data_base_live_connected}')
+
+
+def relevance_score(distance) -> float:
+    # FAISS returns the squared L2 distance; for unit-length embeddings that
+    # is 2 - 2 * cosine, so this is the cosine similarity of query and chunk
+    return 1.0 - distance / 2
+
 
-    prompt_template = """
+def search_shards(retriever_query, vector_dbs, k=3):
+    """
+    Search every vector DB in parallel and merge the hits into a global top-k.
+
+    The query is embedded once per embedding model among the shards and the
+    same vector is sent to every shard of that model. Scores of different
+    models are not comparable, so each hit is scored as its cosine
+    similarity minus the relevance threshold of the model that built its
+    shard before the merge: above 0 means related, whatever the model.
+    Returns a list of (Document, relevance) pairs, most relevant first.
+    """
+    if not vector_dbs:
+        return []
+
+    query_vectors = {}
+    for db in vector_dbs:
+        model = db.embedding_function
+        if id(model) not in query_vectors:
+            query_vectors[id(model)] = model.embed_query(retriever_query)
+
+    def query_vector(db):
+        return query_vectors[id(db.embedding_function)]
+
+    def scored(db, hits):
+        threshold = get_model(model_of(db.embedding_function)).relevance_threshold
+        return [(doc, relevance_score(distance) - threshold) for doc, distance in hits]
+
+    if len(vector_dbs) == 1:
+        db = vector_dbs[0]
+        return scored(db, db.similarity_search_with_score_by_vector(query_vector(db), k=k))
+
+    futures = [
+        shard_search_pool.submit(db.similarity_search_with_score_by_vector, query_vector(db), k)
+        for db in vector_dbs
+    ]
+    hits = [hit for db, future in zip(vector_dbs, futures) for hit in scored(db, future.result())]
+    return heapq.nlargest(k, hits, key=lambda hit: hit[1])
+
+
+RAG_PROMPT = PromptTemplate(
+    template="""
     Given the following context and a question, generate an answer based on this context
     NO PREAMBLE, Dont repeat the question in answer
     In the answer try to provide as much text as possible from "response" section in the source document context without making much changes.
     If the answer is not found in the context but related to the website then, kindly state "I don't have info on (use appropriate words end with full stop), switching back to Internet search". Don't try to make up an answer.
     If the question is completely unrelated and makes no sense with vector DB context backgroud the tell user that "I can only assist you with the information of file uploaded"
     If the intent of the question is not related to topic like greetings or short msgs (hi,bye,thanks,okay.alr,slangs used) then reply normally as a LLM/chatbot
+    Use the conversation so far only to understand what the question refers to.
 
+    CONVERSATION SO FAR: {history}
     CONTEXT: {context}
     QUESTION: {question}
+    """,
+    input_variables=["history", "context", "question"]
+)
+
+
+def prepare_question(retriever_query, full_history, memory=None):
     """
+    Returns (search_query, history_context) for the current question.
+
+    full_history is the list of (role, content) pairs from the chat, which may
+    end with the current question. With a ConversationMemory kept across turns
+    old messages are summarized; without one they are just dropped, so the
+    prompt stays bounded either way.
+    """
+    history = list(full_history or [])
+    if history and history[-1] == ("user", retriever_query):
+        history = history[:-1]
+
+    if memory is None:
+        # Nothing carries a summary to the next turn, so don't pay for one
+        memory, summarizer = ConversationMemory(), None
+    else:
+        summarizer = chat_generate
+    recent = memory.update(history, summarizer)
+    history_context = memory.context(recent)
+
+    search_query = rewrite_query(retriever_query, history_context, chat_generate)
+    return search_query, history_context
 
-    PROMPT = PromptTemplate(
-        template=prompt_template,
-        input_variables=["context", "question"]
-    )
 
+# ----------------- Routing -----------------
+#
+# Decided before any answering LLM call:
+#   smalltalk -> one conversational reply, no retrieval
+#   internet  -> nothing in the document is even loosely related, go straight to web search
+#   document  -> RAG answer over the retrieved chunks; if the model says the
+#                chunks don't answer it, the web search still runs afterwards
+#
+# The cut-off is the relevance_threshold of each embedding model (see
+# search_shards). Questions about a document usually score 0.3-0.7 cosine
+# against their best chunk, unrelated ones below the threshold, so only the
+# clear misses skip RAG.
+
+SMALL_TALK_PATTERN = re.compile(
+    r"^\s*(hi+|hello|hey+|yo|sup|hola|bye|goodbye|see you|thanks?|thank you|thx|ty|"
+    r"ok|okay|k|alr|alright|cool|nice|great|awesome|lol|lmao|hmm+|good (morning|afternoon|evening|night)|"
+    r"how are you|who are you|what can you do)"
+    r"(\s+(bro|man|dude|buddy|so much|a lot|again|there))?[\s!.?]*$",
+    re.IGNORECASE,
+)
 
-    qa = RetrievalQA.from_chain_type(
-        llm=llm,
-        chain_type="stuff",
-        retriever=retriever,
-        input_key="query",
-        chain_type_kwargs={"prompt": PROMPT},
-        verbose=True
+SMALL_TALK_PROMPT = PromptTemplate(
+    template="""
+    You are a friendly study assistant for the files the student uploaded.
+    Reply briefly and naturally to this message. NO PREAMBLE.
+
+    MESSAGE: {question}
+    """,
+    input_variables=["question"]
+)
+
+INTERNET_PREFIX = "Information unavailable in file uploaded\nInternet Search result:\n"
+
+
+def is_small_talk(retriever_query) -> bool:
+    return bool(SMALL_TALK_PATTERN.match(retriever_query))
+
+
+def resolve_vector_dbs(data_base_live_connected):
+    """
+    data_base_live_connected can be a single vector DB (path or FAISS object)
+    or a list of them; all of them are searched and merged before the LLM call.
+    """
+    if isinstance(data_base_live_connected, (list, tuple, set)):
+        shards = list(data_base_live_connected)
+    else:
+        shards = [data_base_live_connected]
+    return [load_vector_db(shard) for shard in shards if shard is not None]
+
+
+def route_question(retriever_query, full_history, data_base_live_connected, memory=None):
+    """
+    Returns (route, search_query, rag_inputs); rag_inputs is only set for "document".
+    """
+    if is_small_talk(retriever_query):
+        return "smalltalk", retriever_query, None
+
+    search_query, history_context = prepare_question(retriever_query, full_history, memory)
+    hits = search_shards(search_query, resolve_vector_dbs(data_base_live_connected), k=3)
+
+    # Relevance is already measured against each model's own threshold
+    if max((relevance for _, relevance in hits), default=-1.0) < 0:
+        return "internet", search_query, None
+
+    rag_inputs = {
+        "history": history_context or "(none)",
+        "context": "\n\n".join(doc.page_content for doc, _ in hits),
+        "question": retriever_query,
+    }
+    return "document", search_query, rag_inputs
+
+
+def answer_question(retriever_query, full_history, data_base_live_connected, memory=None):
+    """
+    The answer to one question, without any Streamlit calls.
+
+    Errors are raised (QuotaExhausted when our own scheduler refuses the
+    call); ask_ai shows them on the page, the HTTP API maps them to statuses.
+    """
+    route, search_query, rag_inputs = route_question(
+        retriever_query, full_history, data_base_live_connected, memory
     )
-    try:
-        result = qa.invoke(retriever_query)
-        print(result)
-        result = result["result"]
 
-        if needs_internet_search(result):
-            internet_answer = switch_to_internet_search(retriever_query)
-            final_answer = f"Information unavailable in file uploaded\nInternet Search result:\n{internet_answer}"
-        else:
-            final_answer = result
+    if route == "smalltalk":
+        return chat_generate(SMALL_TALK_PROMPT.format(question=retriever_query))
+
+    if route == "internet":
+        return INTERNET_PREFIX + internet_search(search_query)
+
+    # Tokens and latency of the call are in usage_ledger
+    result = llm_providers.generate("chat", RAG_PROMPT.format(**rag_inputs)).text
+
+    # The retrieved chunks can still miss the point; the model says so
+    if needs_internet_search(result):
+        return INTERNET_PREFIX + internet_search(search_query)
+    return result
+
+
+def ask_ai(retriever_query, full_history,data_base_live_connected,memory=None):
+    try:
+        return answer_question(retriever_query, full_history, data_base_live_connected, memory)
+    except QuotaExhausted as e:
+        # Our own scheduler refused the call; the key itself is fine
+        st.warning(busy_message(e))
+        print(e)
+        return ""
     except Exception as e:
-        st.warning("You exceeded your current quota, Please try later or get a new API key")
+        if is_rate_limit_error(e):
+            st.warning("You exceeded your current quota, Please try later or get a new API key")
+        else:
+            st.error(f"Could not get an answer: {e}")
         print(e)
         return ""
 
-    return final_answer
+
+def ask_ai_stream(retriever_query, full_history, data_base_live_connected, memory=None):
+    """
+    Same as answer_question but yields the answer in chunks as the LLM
+    produces them. Errors are raised, like answer_question.
+
+    The fallback check needs the whole answer, so the internet search result
+    (if any) is yielded after the document answer has finished streaming.
+    """
+    route, search_query, rag_inputs = route_question(
+        retriever_query, full_history, data_base_live_connected, memory
+    )
+
+    if route == "smalltalk":
+        yield from llm_providers.stream("chat", SMALL_TALK_PROMPT.format(question=retriever_query))
+        return
+
+    if route == "internet":
+        yield INTERNET_PREFIX + internet_search(search_query)
+        return
+
+    streamed = []
+    for chunk in llm_providers.stream("chat", RAG_PROMPT.format(**rag_inputs)):
+        streamed.append(chunk)
+        yield chunk
+
+    if needs_internet_search("".join(streamed)):
+        yield "\n" + INTERNET_PREFIX + internet_search(search_query)
 
@@ -0,0 +1,287 @@
+"""
+Background ingestion jobs.
+
+Parsing, embedding and uploading a file runs in a separate process so the
+Streamlit script run returns at once with a job ID. Workers publish their
+progress into a shared dict that any rerun (or any session) can poll.
+
+The database ID is published as soon as the local index is saved (stage
+"indexed"); compression and the upload to Supabase continue after that.
+A file that was already ingested with the same settings is not embedded
+again: the job hands out a new ID for the shared index (stage
+"deduplicated") right away.
+Optionally a study pack (summary + quiz question bank) is generated last
+and stored under the same ID for the Summary & Quiz page.
+
+Appends to an existing ID run as jobs too; their ID is only published once
+the new delta is uploaded (stage "done", with the new version).
+
+Finished jobs are dropped from the table JOB_RESULT_TTL after their result
+was first read, or JOB_UNREAD_TTL after they finished if nobody asks.
+"""
+import multiprocessing
+import os
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from vector_compression import DEFAULT_VECTOR_ENCODING
+
+# Embedding is CPU heavy, so cap how many files one node ingests at a time.
+# Jobs beyond this stay in the "queued" stage until a worker frees up.
+MAX_CONCURRENT_INGESTIONS = int(os.getenv("MAX_CONCURRENT_INGESTIONS", "2"))
+
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "600"))
+JOB_UNREAD_TTL = float(os.getenv("JOB_UNREAD_TTL", "86400"))
+FINISHED_STAGES = ("done", "failed")
+
+JOB_STAGES = (
+    "queued", "deduplicated", "parsing", "ocr", "chunking", "embedding", "indexed", "encoding", "uploading",
+    "study_pack",
+    "done", "failed",
+)
+
+
+def _init_worker(ingestion_workers):
+    # Each worker OCRs in its own pool; size them so they don't oversubscribe the CPUs
+    from ocr_pages import set_ingestion_workers
+    set_ingestion_workers(ingestion_workers)
+
+
+def _progress_writer(jobs, job_id):
+    state = dict(jobs[job_id])
+
+    def progress(stage, **fields):
+        state["stage"] = stage
+        state.update(fields)
+        state["updated_at"] = time.time()
+        # Manager dicts only see assignments, not in-place mutation of values
+        jobs[job_id] = dict(state)
+
+    return progress
+
+
+def _run_ingestion(job_id, file_bytes, file_name, mode_of_file, vector_encoding, jobs,
+                   study_pack=False, gemini_api_key=None):
+    """Runs inside a worker process: parse -> split -> embed -> save locally -> upload -> study pack."""
+    # Imported here so the parent process never pays for the model load
+    from langchain_vector_conversion import load_documents, split_documents, embed_documents
+    from embedding_models import choose_model, embeddings_for, save_index
+    from supabase_db import (
+        content_key, create_alias, find_shared_index, load_study_pack, new_db_id, register_content,
+        save_vector_db_to_supabase,
+    )
+
+    progress = _progress_writer(jobs, job_id)
+    try:
+        key = content_key(file_bytes, mode_of_file, vector_encoding)
+        shared_id = find_shared_index(key)
+        db_id = create_alias(shared_id, key) if shared_id else None
+        if db_id:
+            progress("deduplicated", db_id=db_id, shared_id=shared_id)
+            if study_pack and load_study_pack(db_id) is None:
+                documents = load_documents(file_bytes, mode_of_file)
+                _build_study_pack(db_id, documents, gemini_api_key, progress)
+            progress("done")
+            return
+
+        progress("parsing", pages_parsed=0, started_at=time.time())
+        documents = load_documents(file_bytes, mode_of_file, progress)
+
+        progress("chunking")
+        docs = split_documents(documents, progress)
+
+        embedding_model = choose_model(documents)
+        progress("embedding", chunks_embedded=0, chunks_total=len(docs), embedding_model=embedding_model)
+        vectordb = embed_documents(docs, embeddings_for(embedding_model), progress)
+
+        local_path = f"{file_name}_DB"
+        save_index(vectordb, local_path)
+
+        # The session can chat on the local copy while the upload runs
+        db_id = new_db_id()
+        progress("indexed", db_id=db_id, local_path=local_path)
+
+        save_vector_db_to_supabase(vectordb, progress, vector_encoding, db_id=db_id)
+        register_content(db_id, key)
+
+        if study_pack:
+            _build_study_pack(db_id, documents, gemini_api_key, progress)
+        progress("done")
+    except Exception as e:
+        traceback.print_exc()
+        progress("failed", error=str(e))
+
+
+def _run_append(job_id, db_id, file_bytes, mode_of_file, jobs):
+    """Runs inside a worker process: parse -> split -> embed with the DB's model -> upload a delta."""
+    from langchain_vector_conversion import load_documents, split_documents, embed_documents
+    from embedding_models import embeddings_for
+    from supabase_db import append_to_vector_db_in_supabase, get_embedding_model
+
+    progress = _progress_writer(jobs, job_id)
+    try:
+        progress("parsing", pages_parsed=0, started_at=time.time())
+        documents = load_documents(file_bytes, mode_of_file, progress)
+
+        progress("chunking")
+        docs = split_documents(documents, progress)
+
+        # Only the new file is embedded, with the model of the existing index
+        embedding_model = get_embedding_model(db_id)
+        progress("embedding", chunks_embedded=0, chunks_total=len(docs), embedding_model=embedding_model)
+        vectordb = embed_documents(docs, embeddings_for(embedding_model), progress)
+
+        progress("uploading")
+        version = append_to_vector_db_in_supabase(db_id, vectordb)
+        progress("done", db_id=db_id, version=version)
+    except Exception as e:
+        traceback.print_exc()
+        progress("failed", error=str(e))
+
+
+def _build_study_pack(db_id, documents, gemini_api_key, progress):
+    # The index is already usable, so a failure here is reported, not fatal
+    import llm_providers
+    import quiz_engine
+    from supabase_db import save_study_pack
+
+    # The Settings page may set the key after this worker started; it is
+    # passed with the job and scoped to these calls, never written to os.environ
+    with llm_providers.using_gemini_key(gemini_api_key):
+        if not quiz_engine.api_key_configured():
+            progress("study_pack", study_pack_error="no Gemini API key configured")
+            return
+        try:
+            text = "\n".join(document.page_content for document in documents)
+            pack = quiz_engine.build_study_pack(text, progress=progress)
+            save_study_pack(db_id, pack)
+            progress("study_pack", study_pack_questions=len(pack["questions"]))
+        except Exception as e:
+            traceback.print_exc()
+            progress("study_pack", study_pack_error=str(e))
+
+
+class IngestionQueue:
+    """Process pool plus a shared progress table, one per node."""
+
+    def __init__(self, max_workers: int = MAX_CONCURRENT_INGESTIONS):
+        # spawn, not fork: the parent already holds torch / FAISS threads
+        ctx = multiprocessing.get_context("spawn")
+        self._manager = ctx.Manager()
+        self.jobs = self._manager.dict()
+        self._pool = ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=ctx,
+            initializer=_init_worker, initargs=(max_workers,),
+        )
+
+    def _submit(self, fn, file_name, *args, **fields) -> str:
+        self._prune()
+        job_id = str(uuid.uuid4())
+        self.jobs[job_id] = {
+            "job_id": job_id,
+            "file_name": file_name,
+            "stage": "queued",
+            "submitted_at": time.time(),
+            **fields,
+        }
+        future = self._pool.submit(fn, job_id, *args)
+        future.add_done_callback(lambda f: self._on_worker_exit(job_id, f))
+        return job_id
+
+    def submit(self, file_bytes: bytes, file_name: str, mode_of_file: str,
+               vector_encoding: str = DEFAULT_VECTOR_ENCODING, study_pack: bool = False) -> str:
+        return self._submit(
+            _run_ingestion, file_name, file_bytes, file_name, mode_of_file, vector_encoding, self.jobs,
+            study_pack, os.getenv("GEMINI_API_KEY"),
+        )
+
+    def submit_append(self, db_id: str, file_bytes: bytes, file_name: str, mode_of_file: str) -> str:
+        """Adds a file to an existing ID as a new delta."""
+        return self._submit(_run_append, file_name, db_id, file_bytes, mode_of_file, self.jobs, append_to=db_id)
+
+    def _on_worker_exit(self, job_id, future):
+        # The worker records its own errors; this only catches crashed processes
+        error = future.exception()
+        if error is not None:
+            state = dict(self.jobs.get(job_id, {}))
+            state.update(stage="failed", error=str(error), updated_at=time.time())
+            self.jobs[job_id] = state
+
+    def status(self, job_id: str):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        if job["stage"] in FINISHED_STAGES and "read_at" not in job:
+            # Start the clock for dropping the result
+            job = dict(job, read_at=time.time())
+            self.jobs[job_id] = job
+        return dict(job)
+
+    def _prune(self) -> None:
+        now = time.time()
+        for job_id, job in self.jobs.items():
+            if job["stage"] not in FINISHED_STAGES:
+                continue
+            if "read_at" in job:
+                expires_at = job["read_at"] + JOB_RESULT_TTL
+            else:
+                expires_at = job.get("updated_at", job["submitted_at"]) + JOB_UNREAD_TTL
+            if expires_at <= now:
+                self.jobs.pop(job_id, None)
+
+    def active_count(self) -> int:
+        return sum(1 for job in self.jobs.values() if job["stage"] not in FINISHED_STAGES)
+
+
+def describe_progress(job: dict):
+    """Returns (label, fraction or None) for showing a job in the UI."""
+    stage = job["stage"]
+    if stage == "queued":
+        return "Waiting for a free ingestion worker...", None
+    if stage == "deduplicated":
+        return "This file is already indexed, reusing it...", None
+    if stage == "parsing":
+        return f"Parsing file... {job.get('pages_parsed', 0)} pages", None
+    if stage == "ocr":
+        done, total = job.get("pages_ocr_done", 0), job.get("pages_ocr_total", 0)
+        return f"Running OCR on scanned pages... {done}/{total}", (done / total if total else None)
+    if stage == "chunking":
+        return "Splitting text into chunks...", None
+    if stage == "embedding":
+        done, total = job.get("chunks_embedded", 0), job.get("chunks_total", 0)
+        return f"Embedding chunks with {job.get('embedding_model')}... {done}/{total}", (done / total if total else None)
+    if stage == "indexed":
+        return "Index ready, preparing upload...", None
+    if stage == "encoding":
+        return f"Compressing vectors ({job['vector_encoding']}), recall@10 {job['recall']:.1%}", None
+    if stage == "study_pack":
+        done, total = job.get("questions_generated", 0), job.get("questions_total", 0)
+        return f"Writing summary and quiz bank... {done}/{total} questions", (done / total if total else None)
+    if stage == "uploading":
+        done, total = job.get("bytes_uploaded", 0), job.get("bytes_total", 0)
+        return f"Uploading index... {done / 1e6:.1f}/{total / 1e6:.1f} MB", (done / total if total else None)
+    if stage == "done" and job.get("append_to"):
+        return f"Added to {job['append_to']} (version {job['version']})", 1.0
+    if stage == "done":
+        label = "File converted to vector DB successfully!"
+        if job.get("shared_id"):
+            label = "This file was already indexed, so your ID reuses that index instantly."
+        duplicates = job.get("exact_duplicates", 0) + job.get("near_duplicates", 0)
+        if duplicates or job.get("boilerplate_lines_removed"):
+            label += (
+                f" Skipped {duplicates} duplicate chunks and "
+                f"{job.get('boilerplate_lines_removed', 0)} header/footer lines."
+            )
+        if job.get("recall") is not None:
+            label += f" ({job['vector_encoding']} index keeps {job['recall']:.1%} of top-10 results)"
+        if job.get("study_pack_questions"):
+            label += f" Summary and {job['study_pack_questions']} quiz questions are ready on the Quiz page."
+        elif job.get("study_pack_error"):
+            label += f" Quiz bank was not created: {job['study_pack_error']}."
+        return label, 1.0
+    label = f"Ingestion failed: {job.get('error', 'unknown error')}"
+    if job.get("db_id"):
+        label += " The ID works in this session only, since the upload did not finish."
+    return label, None
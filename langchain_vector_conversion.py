@@ -1,22 +1,28 @@
 from langchain_community.document_loaders import TextLoader,PyPDFLoader,Docx2txtLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_huggingface.embeddings import HuggingFaceEmbeddings
+from embedding_models import choose_model, embeddings_for, save_index
 from langchain_community.vectorstores import FAISS
 import tempfile
 import os
-import random
-import streamlit as st
-
-def convert_to_vector_db(filename,mode_of_file):
-    if mode_of_file == "pdf":
-        suffix = ".pdf"
-    elif mode_of_file == "text":
-        suffix = ".txt"
-    elif mode_of_file == "docx":
-        suffix = ".docx"
+from chunk_dedupe import strip_repeated_lines, dedupe_chunks
+from ocr_pages import needs_ocr, ocr_pdf_pages
+
+EMBED_BATCH_SIZE = 64
+
+FILE_SUFFIXES = {"pdf": ".pdf", "text": ".txt", "docx": ".docx"}
+
+
+def _report(progress, stage, **fields):
+    if progress is not None:
+        progress(stage, **fields)
+
+
+def load_documents(file_bytes, mode_of_file, progress=None):
+    """Parse the raw bytes of an uploaded file into one Document per page."""
+    suffix = FILE_SUFFIXES.get(mode_of_file, "")
     tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
     try:
-        tmp.write(filename.getvalue())  # write bytes
+        tmp.write(file_bytes)  # write bytes
         tmp.flush()
         tmp.close()
         tmp_path = tmp.name
@@ -28,31 +34,70 @@ def convert_to_vector_db(filename,mode_of_file):
             loader = Docx2txtLoader(tmp_path)
         else:
             raise ValueError(f"Unsupported file type")
-        documents = loader.load()
-        unique_id_to_store_text = random.randint(1,2000)
-        text_in_file_uploaded = f"raw_text_of_file_uploaded_{unique_id_to_store_text}.txt"
-        with open(text_in_file_uploaded,"a",encoding='utf-8') as f:
-            f.write(documents[0].page_content)
-        st.session_state["raw_text_file_path"] = text_in_file_uploaded
-
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size =500,
-            chunk_overlap  = 0,
-            length_function = len,
-        )
-
-        docs = text_splitter.split_documents(documents)
-
-        embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2")
-
-        vector_embeddings = FAISS.from_documents(docs,embeddings)
-        vector_embeddings.save_local(f"{filename.name}_DB")
-        return vector_embeddings
+
+        documents = []
+        for document in loader.lazy_load():
+            documents.append(document)
+            _report(progress, "parsing", pages_parsed=len(documents))
+
+        if mode_of_file == "pdf":
+            # Scanned pages have no text layer; OCR just those ones
+            scanned = {
+                document.metadata.get("page", i): document
+                for i, document in enumerate(documents)
+                if needs_ocr(document.page_content)
+            }
+            for page_number, text in ocr_pdf_pages(file_bytes, scanned, progress).items():
+                scanned[page_number].page_content = text
+                scanned[page_number].metadata["ocr"] = True
+        return documents
     finally:
-            
+
             try:
                 if os.path.exists(tmp.name):
                     os.remove(tmp.name)
             except Exception:
                 pass
 
+
+def split_documents(documents, progress=None):
+    """
+    Split pages into chunks, without repeated headers/footers and duplicate chunks.
+
+    Boilerplate would otherwise be embedded once per page and crowd the k=3
+    context; what was removed is reported through progress("chunking", ...).
+    """
+    boilerplate_lines_removed = strip_repeated_lines(documents)
+
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size =500,
+        chunk_overlap  = 0,
+        length_function = len,
+    )
+
+    docs, dedupe_stats = dedupe_chunks(text_splitter.split_documents(documents))
+    _report(progress, "chunking", boilerplate_lines_removed=boilerplate_lines_removed, **dedupe_stats)
+    return docs
+
+
+def embed_documents(docs, embeddings, progress=None):
+    """Embed chunks in batches so progress can be reported while the index grows."""
+    vector_embeddings = None
+    for start in range(0, len(docs), EMBED_BATCH_SIZE):
+        batch = docs[start:start + EMBED_BATCH_SIZE]
+        if vector_embeddings is None:
+            vector_embeddings = FAISS.from_documents(batch, embeddings)
+        else:
+            vector_embeddings.add_documents(batch)
+        _report(progress, "embedding", chunks_embedded=start + len(batch), chunks_total=len(docs))
+    if vector_embeddings is None:
+        raise ValueError("No text could be extracted from the file")
+    return vector_embeddings
+
+
+def convert_to_vector_db(filename,mode_of_file,progress=None):
+    documents = load_documents(filename.getvalue(), mode_of_file, progress)
+    docs = split_documents(documents, progress)
+    vector_embeddings = embed_documents(docs, embeddings_for(choose_model(documents)), progress)
+    save_index(vector_embeddings, f"{filename.name}_DB")
+    return vector_embeddings
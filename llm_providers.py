@@ -0,0 +1,764 @@
+"""
+Provider layer for every LLM call in the app.
+
+Each feature (chat, search, quiz, summary, roadmap) gets a HedgedRouter over
+an ordered list of providers. The router sends the request to the provider
+with the best recent latency. If no answer has arrived by that provider's
+p95, it sends the same request to the next provider and keeps whichever
+finishes first. Latency is tracked per provider and shared by all features.
+
+FakeProvider has configurable latency and failure rate, for tests and load
+tests without real API keys (set LLM_PROVIDER_MODE=fake).
+
+Every attempt first takes a token from quota_scheduler, so hedges and
+failovers never push a shared key past its rate limit.
+
+Calls about one document pass it as a DocumentContext; providers send it
+through context_cache (a cached-content handle or a shared prompt prefix)
+instead of inside the prompt.
+
+Every attempt, hedges included, is written to usage_ledger.
+"""
+import contextvars
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+from context_cache import ContextCache, DocumentContext, fake_contexts, gemini_contexts
+from usage_ledger import estimate_tokens, get_ledger
+from quota_scheduler import (
+    FEATURE_PRIORITY,
+    INTERACTIVE,
+    QuotaExhausted,
+    fingerprint,
+    is_rate_limit_error,
+    retry_after_from_error,
+    scheduler,
+)
+
+load_dotenv()
+
+# Hedge once the primary is slower than this percentile of its own history
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+# Until a provider has enough samples, hedge after this many seconds
+DEFAULT_HEDGE_DELAY = float(os.getenv("LLM_DEFAULT_HEDGE_DELAY", "8"))
+MIN_HEDGE_DELAY = 0.25
+MIN_LATENCY_SAMPLES = 10
+LATENCY_WINDOW = 200
+HEDGE_WORKERS = int(os.getenv("LLM_HEDGE_WORKERS", "32"))
+# A hung connection would otherwise hold a hedge worker forever
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "60"))
+
+
+@dataclass
+class LLMResponse:
+    text: str
+    provider: str
+    model: str
+    latency: float = 0.0
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    links: list = field(default_factory=list)
+    hedged: bool = False
+    # The document came from a provider-side cache; cached_tokens of the input were not billed in full
+    context_cached: bool = False
+    cached_tokens: Optional[int] = None
+
+
+class ProviderCancelled(Exception):
+    pass
+
+
+# ----------------- Latency tracking -----------------
+
+class LatencyTracker:
+    """Rolling window of call latencies (seconds) for one provider."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.failures = 0
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+
+    def percentile(self, q: float, default: Optional[float] = None) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < MIN_LATENCY_SAMPLES:
+                return default
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self) -> dict:
+        return {
+            "samples": len(self._samples),
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "failures": self.failures,
+        }
+
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def get_tracker(key: str) -> LatencyTracker:
+    with _trackers_lock:
+        if key not in _trackers:
+            _trackers[key] = LatencyTracker()
+        return _trackers[key]
+
+
+def latency_report() -> dict:
+    with _trackers_lock:
+        return {key: tracker.snapshot() for key, tracker in _trackers.items()}
+
+
+# ----------------- API keys -----------------
+
+# A Gemini key given for the current call, e.g. by an ingestion worker that
+# started before the key was entered in Settings. Without one the
+# environment is used. Hedge threads inherit it through copy_context().
+_gemini_key = contextvars.ContextVar("gemini_api_key", default=None)
+
+
+def gemini_api_key():
+    return _gemini_key.get() or os.getenv("GEMINI_API_KEY")
+
+
+@contextmanager
+def using_gemini_key(api_key):
+    """Route the Gemini calls made inside this block through api_key."""
+    token = _gemini_key.set(api_key)
+    try:
+        yield
+    finally:
+        _gemini_key.reset(token)
+
+
+# ----------------- Providers -----------------
+
+def _inline(prompt: str, context: Optional[DocumentContext]) -> str:
+    return prompt if context is None else context.prefixed(prompt)
+
+
+def _fill_usage(usage: Optional[dict], response: LLMResponse) -> None:
+    if usage is not None:
+        usage.update(
+            input_tokens=response.input_tokens,
+            output_tokens=response.output_tokens,
+            cached_tokens=response.cached_tokens,
+            context_cached=response.context_cached,
+        )
+
+
+class Provider:
+    name = "provider"
+
+    def __init__(self, model: str):
+        self.model = model
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}:{self.model}"
+
+    @property
+    def tracker(self) -> LatencyTracker:
+        return get_tracker(self.key)
+
+    def available(self) -> bool:
+        return True
+
+    def quota_key(self):
+        """(key fingerprint, model) bucket in quota_scheduler, or None for no quota."""
+        return None
+
+    def supports_search(self) -> bool:
+        return False
+
+    def generate(self, prompt: str, system: Optional[str] = None, use_search: bool = False,
+                 cancel: Optional[threading.Event] = None, json_schema: Optional[dict] = None,
+                 context: Optional[DocumentContext] = None) -> LLMResponse:
+        """
+        json_schema asks for structured JSON output where the provider supports
+        it; context is the document the prompt is about.
+        """
+        raise NotImplementedError
+
+    def stream(self, prompt: str, system: Optional[str] = None, json_schema: Optional[dict] = None,
+               context: Optional[DocumentContext] = None, usage: Optional[dict] = None) -> Iterator[str]:
+        """
+        Yields the answer in text chunks; providers without streaming yield it whole.
+
+        usage, if given, is filled with what the provider reports for the call
+        (input_tokens, output_tokens, cached_tokens, context_cached).
+        """
+        response = self.generate(prompt, system, json_schema=json_schema, context=context)
+        _fill_usage(usage, response)
+        yield response.text
+
+
+class GroqProvider(Provider):
+    name = "groq"
+
+    def available(self) -> bool:
+        return bool(os.getenv("GROQ_API_KEY"))
+
+    def quota_key(self):
+        return (fingerprint(os.getenv("GROQ_API_KEY")), self.model)
+
+    def _client(self, json_schema):
+        client = _groq_client(self.model)
+        if json_schema is not None:
+            # Groq's JSON mode guarantees valid JSON, the schema itself stays in the prompt
+            client = client.bind(response_format={"type": "json_object"})
+        return client
+
+    @staticmethod
+    def _messages(prompt, system, context):
+        # Groq caches shared prompt prefixes on its own, so the document goes first
+        return ([("system", system)] if system else []) + [("human", _inline(prompt, context))]
+
+    def generate(self, prompt, system=None, use_search=False, cancel=None, json_schema=None, context=None):
+        result = self._client(json_schema).invoke(self._messages(prompt, system, context))
+        usage = getattr(result, "usage_metadata", None) or {}
+        return LLMResponse(
+            text=result.content,
+            provider=self.name,
+            model=self.model,
+            input_tokens=usage.get("input_tokens"),
+            output_tokens=usage.get("output_tokens"),
+        )
+
+    def stream(self, prompt, system=None, json_schema=None, context=None, usage=None):
+        for chunk in self._client(json_schema).stream(self._messages(prompt, system, context)):
+            # Only the last chunk carries usage_metadata
+            metadata = getattr(chunk, "usage_metadata", None)
+            if metadata and usage is not None:
+                usage.update(input_tokens=metadata.get("input_tokens"), output_tokens=metadata.get("output_tokens"))
+            if chunk.content:
+                yield chunk.content
+
+
+@lru_cache(maxsize=8)
+def _groq_client(model: str):
+    from langchain_groq import ChatGroq
+    return ChatGroq(model=model, temperature=0.7, max_tokens=None, timeout=LLM_REQUEST_TIMEOUT, max_retries=0)
+
+
+class GeminiProvider(Provider):
+    name = "gemini"
+
+    def __init__(self, model: str, temperature: float = 0.7):
+        super().__init__(model)
+        self.temperature = temperature
+
+    def available(self) -> bool:
+        # Read at call time: the Settings page can change the key mid-session
+        return bool(gemini_api_key())
+
+    def quota_key(self):
+        return (fingerprint(gemini_api_key()), self.model)
+
+    def supports_search(self) -> bool:
+        return True
+
+    def _config(self, system, use_search=False, json_schema=None, cached_content=None):
+        from google.genai import types
+
+        return types.GenerateContentConfig(
+            temperature=self.temperature,
+            system_instruction=system,
+            tools=[types.Tool(google_search=types.GoogleSearch())] if use_search else None,
+            response_mime_type="application/json" if json_schema is not None else None,
+            response_schema=json_schema,
+            cached_content=cached_content,
+        )
+
+    def _context_handle(self, system, use_search, context):
+        # A system prompt or tools would have to be part of the cached content
+        if context is None or system or use_search:
+            return None
+        return gemini_contexts.handle(gemini_api_key(), self.model, context)
+
+    def generate(self, prompt, system=None, use_search=False, cancel=None, json_schema=None, context=None):
+        handle = self._context_handle(system, use_search, context)
+        if handle is not None:
+            try:
+                return self._generate(prompt, system, use_search, json_schema, handle)
+            except Exception as e:
+                if is_rate_limit_error(e):
+                    raise
+                # Most likely the cache expired on the server; send the document inline
+                gemini_contexts.invalidate(gemini_api_key(), self.model, context)
+        return self._generate(_inline(prompt, context), system, use_search, json_schema)
+
+    def _generate(self, contents, system, use_search, json_schema, handle=None):
+        response = _gemini_client(gemini_api_key()).models.generate_content(
+            model=self.model,
+            contents=contents,
+            config=self._config(system, use_search, json_schema, handle),
+        )
+        usage = response.usage_metadata
+        return LLMResponse(
+            text=response.text or "",
+            provider=self.name,
+            model=self.model,
+            input_tokens=getattr(usage, "prompt_token_count", None),
+            output_tokens=getattr(usage, "candidates_token_count", None),
+            links=_grounding_links(response),
+            context_cached=handle is not None,
+            cached_tokens=getattr(usage, "cached_content_token_count", None),
+        )
+
+    def stream(self, prompt, system=None, json_schema=None, context=None, usage=None):
+        usage = {} if usage is None else usage
+        handle = self._context_handle(system, False, context)
+        if handle is not None:
+            started = False
+            usage["context_cached"] = True
+            try:
+                for chunk in self._stream(prompt, system, json_schema, handle, usage):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started or is_rate_limit_error(e):
+                    raise
+                gemini_contexts.invalidate(gemini_api_key(), self.model, context)
+        usage["context_cached"] = False
+        yield from self._stream(_inline(prompt, context), system, json_schema, usage=usage)
+
+    def _stream(self, contents, system, json_schema, handle=None, usage=None):
+        chunks = _gemini_client(gemini_api_key()).models.generate_content_stream(
+            model=self.model,
+            contents=contents,
+            config=self._config(system, json_schema=json_schema, cached_content=handle),
+        )
+        for chunk in chunks:
+            # The counts are complete on the last chunk; earlier ones may carry partial counts
+            metadata = getattr(chunk, "usage_metadata", None)
+            if metadata is not None and usage is not None:
+                usage.update(
+                    input_tokens=getattr(metadata, "prompt_token_count", None),
+                    output_tokens=getattr(metadata, "candidates_token_count", None),
+                    cached_tokens=getattr(metadata, "cached_content_token_count", None),
+                )
+            if chunk.text:
+                yield chunk.text
+
+
+@lru_cache(maxsize=4)
+def _gemini_client(api_key: str):
+    from google import genai
+    return genai.Client(api_key=api_key)
+
+
+def _grounding_links(response) -> list:
+    links = []
+    try:
+        metadata = response.candidates[0].grounding_metadata
+        for chunk in (metadata.grounding_chunks or []) if metadata else []:
+            if chunk.web and chunk.web.uri and chunk.web.title:
+                links.append({"title": chunk.web.title, "url": chunk.web.uri})
+    except (AttributeError, IndexError, TypeError):
+        pass
+    return links
+
+
+class FakeProvider(Provider):
+    """
+    Local stand-in with a configurable latency distribution.
+
+    latency is a callable returning seconds, e.g. lognormal_latency(0.8, 0.4);
+    failure_rate is the share of calls that raise; rpm, if given, puts the
+    provider under a quota_scheduler bucket like a real key. Documents are
+    registered with contexts (a ContextCache over FakeContextBackend), or
+    sent inline when it is None.
+    """
+    name = "fake"
+
+    def __init__(self, model: str = "fake", latency: Callable[[], float] = lambda: 0.05,
+                 failure_rate: float = 0.0, reply: Optional[Callable[[str], str]] = None,
+                 rpm: Optional[float] = None, contexts: Optional[ContextCache] = fake_contexts):
+        super().__init__(model)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.reply = reply or (lambda prompt: f"[{model}] {prompt[:80]}")
+        self.rpm = rpm
+        self.contexts = contexts
+        self.calls = 0
+        self.cached_calls = 0
+        if rpm is not None:
+            scheduler.set_rpm(self.quota_key(), rpm)
+
+    def _prompt(self, prompt, context):
+        """(prompt as sent, handle or None)"""
+        handle = None
+        if context is not None and self.contexts is not None:
+            handle = self.contexts.handle("fake", self.model, context)
+        if handle is None:
+            return _inline(prompt, context), None
+        self.cached_calls += 1
+        return prompt, handle
+
+    def quota_key(self):
+        return ("fake", self.model) if self.rpm is not None else None
+
+    def supports_search(self) -> bool:
+        return True
+
+    def generate(self, prompt, system=None, use_search=False, cancel=None, json_schema=None, context=None):
+        self.calls += 1
+        prompt, handle = self._prompt(prompt, context)
+        delay = max(0.0, self.latency())
+        if cancel is not None and cancel.wait(delay):
+            raise ProviderCancelled(self.key)
+        if cancel is None:
+            time.sleep(delay)
+        if random.random() < self.failure_rate:
+            raise RuntimeError(f"{self.key} failed")
+        return LLMResponse(
+            text=self.reply(prompt),
+            provider=self.name,
+            model=self.model,
+            input_tokens=len(prompt) // 4 + (len(context.text) // 4 if handle else 0),
+            output_tokens=20,
+            context_cached=handle is not None,
+            cached_tokens=len(context.text) // 4 if handle else None,
+        )
+
+    def stream(self, prompt, system=None, json_schema=None, context=None, usage=None):
+        # Same latency as generate, spread over a few chunks
+        self.calls += 1
+        prompt, handle = self._prompt(prompt, context)
+        text = self.reply(prompt)
+        if usage is not None:
+            usage.update(
+                input_tokens=len(prompt) // 4 + (len(context.text) // 4 if handle else 0),
+                output_tokens=len(text) // 4,
+                context_cached=handle is not None,
+                cached_tokens=len(context.text) // 4 if handle else None,
+            )
+        pieces = 5
+        delay = max(0.0, self.latency()) / pieces
+        if random.random() < self.failure_rate:
+            raise RuntimeError(f"{self.key} failed")
+        step = max(1, len(text) // pieces)
+        for start in range(0, len(text), step):
+            time.sleep(delay)
+            yield text[start:start + step]
+
+
+def lognormal_latency(median: float, sigma: float = 0.5) -> Callable[[], float]:
+    import math
+    return lambda: random.lognormvariate(math.log(median), sigma)
+
+
+def spiky_latency(base: float, spike: float, spike_rate: float) -> Callable[[], float]:
+    """Mostly base seconds, but spike seconds for spike_rate of the calls (a p99 spike)."""
+    return lambda: spike if random.random() < spike_rate else base
+
+
+# ----------------- Hedged router -----------------
+
+_hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+
+
+class HedgedRouter:
+    """Sends each request to the fastest provider and hedges to the next one past its p95."""
+
+    def __init__(self, providers: List[Provider], hedge_percentile: float = HEDGE_PERCENTILE,
+                 default_hedge_delay: float = DEFAULT_HEDGE_DELAY, priority: int = INTERACTIVE,
+                 feature: Optional[str] = None):
+        self.providers = providers
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_delay = default_hedge_delay
+        self.priority = priority
+        # The usage_ledger label of every call made through this router
+        self.feature = feature
+
+    def ranked(self, use_search: bool = False) -> List[Provider]:
+        candidates = [
+            p for p in self.providers
+            if p.available() and (p.supports_search() or not use_search)
+        ]
+        if candidates and all(scheduler.is_open(p.quota_key()) for p in candidates):
+            raise QuotaExhausted("Every provider is rate limited right now, please retry shortly")
+        candidates = [p for p in candidates if not scheduler.is_open(p.quota_key())]
+        # Configured order wins until there is latency data to say otherwise;
+        # a provider without data ranks first so it gets some
+        return sorted(
+            candidates,
+            key=lambda p: p.tracker.percentile(0.5, default=float(self.providers.index(p)) * 1e-3),
+        )
+
+    def hedge_delay(self, provider: Provider) -> float:
+        delay = provider.tracker.percentile(self.hedge_percentile, default=self.default_hedge_delay)
+        return max(MIN_HEDGE_DELAY, delay)
+
+    def generate(self, prompt: str, system: Optional[str] = None, use_search: bool = False,
+                 json_schema: Optional[dict] = None, context: Optional[DocumentContext] = None) -> LLMResponse:
+        providers = self.ranked(use_search)
+        if not providers:
+            raise RuntimeError("No LLM provider is configured, check your API keys in Settings")
+
+        attempts = {}
+        errors = []
+
+        def launch(provider, hedge=False):
+            # Quota is taken in the caller's thread: a call queueing for a token
+            # never holds a shared hedge worker, so batch work waiting on its
+            # bucket cannot starve interactive calls of threads. With another
+            # attempt still running, don't queue for a backup at all.
+            try:
+                scheduler.acquire(provider.quota_key(), self.priority, timeout=0 if attempts else None)
+            except QuotaExhausted as e:
+                errors.append(e)
+                return
+            cancel = threading.Event()
+            started = time.perf_counter()
+            # copy_context so the attempt is logged under the caller's session
+            future = _hedge_pool.submit(
+                contextvars.copy_context().run,
+                self._call, provider, prompt, system, use_search, cancel, json_schema, context, hedge,
+            )
+            attempts[future] = (provider, cancel, started)
+
+        launch(providers[0])
+        next_provider = 1
+        timeout = self.hedge_delay(providers[0])
+
+        while attempts or next_provider < len(providers):
+            done = set()
+            if attempts:
+                done, _ = wait(list(attempts), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                provider = attempts.pop(future)[0]
+                try:
+                    response = future.result()
+                except ProviderCancelled:
+                    continue
+                except Exception as e:
+                    provider.tracker.record_failure()
+                    errors.append(e)
+                    continue
+
+                provider.tracker.record(response.latency)
+                response.hedged = next_provider > 1
+                self._cancel_losers(attempts)
+                return response
+
+            # Nothing usable yet: deadline passed or the running attempt failed.
+            # A slow call is only hedged when the backup has quota to spare;
+            # a failed one always fails over (and may queue for a token).
+            failed = bool(done) or not attempts
+            if next_provider < len(providers) and (
+                failed or scheduler.has_capacity(providers[next_provider].quota_key())
+            ):
+                launch(providers[next_provider], hedge=True)
+                timeout = self.hedge_delay(providers[next_provider])
+                next_provider += 1
+            elif attempts:
+                timeout = None
+            else:
+                break
+
+        raise errors[-1] if errors else RuntimeError("All LLM providers failed")
+
+    def stream(self, prompt: str, system: Optional[str] = None, json_schema: Optional[dict] = None,
+               context: Optional[DocumentContext] = None) -> Iterator[str]:
+        """
+        Streams from the fastest provider. Streams are not hedged: a provider
+        that fails before its first chunk is skipped for the next one, a failure
+        mid-stream is raised because the caller already holds partial output.
+        """
+        providers = self.ranked()
+        if not providers:
+            raise RuntimeError("No LLM provider is configured, check your API keys in Settings")
+
+        errors = []
+        for provider in providers:
+            scheduler.acquire(provider.quota_key(), self.priority)
+            started = time.perf_counter()
+            chunks = []
+            usage = {}
+            try:
+                for chunk in provider.stream(prompt, system, json_schema, context, usage=usage):
+                    chunks.append(chunk)
+                    yield chunk
+            except GeneratorExit:
+                # The caller stopped reading early; what was generated is still billed
+                self._record_stream(provider, prompt, context, chunks, started, usage)
+                raise
+            except Exception as e:
+                if is_rate_limit_error(e):
+                    scheduler.report_rate_limited(provider.quota_key(), retry_after_from_error(e))
+                provider.tracker.record_failure()
+                self._record_stream(provider, prompt, context, chunks, started, usage, error=e)
+                if chunks:
+                    raise
+                errors.append(e)
+                continue
+            provider.tracker.record(time.perf_counter() - started)
+            self._record_stream(provider, prompt, context, chunks, started, usage)
+            return
+
+        raise errors[-1] if errors else RuntimeError("All LLM providers failed")
+
+    def _record_stream(self, provider, prompt, context, chunks, started, usage, error=None):
+        # Counts come from the provider (Gemini sends them on the last chunk);
+        # a stream cut short never gets there, so its tokens are estimated
+        context_cached = usage.get("context_cached", False)
+        input_tokens, cached_tokens = usage.get("input_tokens"), usage.get("cached_tokens")
+        estimated = input_tokens is None
+        if estimated:
+            input_tokens = estimate_tokens(_inline(prompt, context))
+            if context_cached:
+                cached_tokens = estimate_tokens(context.preamble)
+        output_tokens = usage.get("output_tokens")
+        get_ledger().record(
+            self.feature or "unknown", provider.name, provider.model,
+            input_tokens=input_tokens,
+            output_tokens=estimate_tokens("".join(chunks)) if output_tokens is None else output_tokens,
+            cached_tokens=cached_tokens,
+            latency=time.perf_counter() - started,
+            context_cached=context_cached, streamed=True, estimated=estimated, error=error,
+        )
+
+    def _call(self, provider, prompt, system, use_search, cancel, json_schema=None, context=None,
+              hedge=False) -> LLMResponse:
+        # The quota token was taken by launch, before this was submitted
+        if cancel.is_set():
+            raise ProviderCancelled(provider.key)
+
+        started = time.perf_counter()
+        try:
+            response = provider.generate(prompt, system, use_search, cancel, json_schema, context)
+        except ProviderCancelled:
+            raise
+        except Exception as e:
+            if is_rate_limit_error(e):
+                scheduler.report_rate_limited(provider.quota_key(), retry_after_from_error(e))
+            get_ledger().record(
+                self.feature or "unknown", provider.name, provider.model,
+                latency=time.perf_counter() - started, hedge=hedge, error=e,
+            )
+            raise
+        # Provider latency only, time spent queueing for quota is not its fault
+        response.latency = time.perf_counter() - started
+        # Logged even if another attempt wins: a finished call is billed either way
+        get_ledger().record_response(self.feature or "unknown", response, hedge)
+        return response
+
+    @staticmethod
+    def _cancel_losers(attempts):
+        for future, (provider, cancel, started) in attempts.items():
+            cancel.set()
+            if not future.cancel():
+                # Already running: let it finish in the background, but count how
+                # long we had been waiting so a slow provider drops in the ranking
+                provider.tracker.record(time.perf_counter() - started)
+        attempts.clear()
+
+
+# ----------------- Per-feature policies -----------------
+
+FEATURES = ("chat", "search", "quiz", "summary", "roadmap")
+
+
+def _real_providers(feature: str) -> List[Provider]:
+    if feature == "chat":
+        return [GroqProvider("llama-3.1-8b-instant"), GeminiProvider("gemini-2.5-flash-lite")]
+    if feature == "search":
+        # Grounded search is Gemini only; hedge across two Gemini models
+        return [GeminiProvider("gemini-2.5-flash"), GeminiProvider("gemini-2.5-flash-lite")]
+    if feature in ("quiz", "summary"):
+        return [GeminiProvider("gemini-2.5-flash-lite"), GroqProvider("llama-3.3-70b-versatile")]
+    if feature == "roadmap":
+        return [GeminiProvider("gemini-flash-latest"), GeminiProvider("gemini-2.5-flash-lite")]
+    raise ValueError(f"Unknown LLM feature: {feature}")
+
+
+def fake_quiz_reply(prompt: str) -> str:
+    """Schema-valid quiz JSON with as many questions as the prompt asks for."""
+    match = re.search(r"EXACTLY (\d+) QUESTIONS", prompt)
+    count = int(match.group(1)) if match else 5
+    questions = [
+        {
+            "question": f"Sample question {uuid.uuid4().hex[:8]}?",
+            "options": {"A": "First", "B": "Second", "C": "Third", "D": "Fourth"},
+            "answer": random.choice("ABCD"),
+            "reason": "Generated by the fake provider.",
+            "type": "MCQ",
+            "difficulty": random.choice(["Easy", "Medium", "Hard"]),
+        }
+        for _ in range(count)
+    ]
+    return json.dumps({"questions": questions})
+
+
+def _fake_providers(feature: str) -> List[Provider]:
+    reply = fake_quiz_reply if feature == "quiz" else None
+    return [
+        FakeProvider(f"{feature}-primary", latency=spiky_latency(0.05, 2.0, 0.02), reply=reply),
+        FakeProvider(f"{feature}-backup", latency=lognormal_latency(0.1), reply=reply),
+    ]
+
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def get_router(feature: str) -> HedgedRouter:
+    with _routers_lock:
+        if feature not in _routers:
+            if os.getenv("LLM_PROVIDER_MODE") == "fake":
+                providers = _fake_providers(feature)
+            else:
+                providers = _real_providers(feature)
+            _routers[feature] = HedgedRouter(providers, priority=FEATURE_PRIORITY[feature], feature=feature)
+        return _routers[feature]
+
+
+def set_router(feature: str, router: HedgedRouter) -> None:
+    """Replace the router of a feature, e.g. with FakeProviders in tests."""
+    router.feature = router.feature or feature
+    with _routers_lock:
+        _routers[feature] = router
+
+
+def feature_pressure(*features) -> str:
+    """Backpressure for the UI: 'ok', 'busy' or 'throttled' across the providers of these features."""
+    keys = {p.quota_key() for feature in features for p in get_router(feature).providers if p.available()}
+    return scheduler.pressure(keys)
+
+
+def generate(feature: str, prompt: str, system: Optional[str] = None, use_search: bool = False,
+             json_schema: Optional[dict] = None, context: Optional[DocumentContext] = None) -> LLMResponse:
+    return get_router(feature).generate(
+        prompt, system=system, use_search=use_search, json_schema=json_schema, context=context
+    )
+
+
+def stream(feature: str, prompt: str, system: Optional[str] = None, json_schema: Optional[dict] = None,
+           context: Optional[DocumentContext] = None) -> Iterator[str]:
+    return get_router(feature).stream(prompt, system=system, json_schema=json_schema, context=context)
@@ -0,0 +1,350 @@
+"""
+Load test: how many concurrent students can one pod hold?
+
+Drives the real pages (main_chat.py, quiz_summary.py, ai_learning_path.py)
+through Streamlit's AppTest with N simulated sessions. LLM calls go to the
+FakeProviders (LLM_PROVIDER_MODE=fake) and Supabase Storage is replaced by an
+in-memory bucket; the embedding model, FAISS and every page's own code run
+for real.
+
+AppTest swaps process-wide Streamlit state on each run, so sessions cannot
+rerun in parallel threads. Instead all N sessions stay resident and take
+their steps round-robin: memory and cache growth are those of N live
+sessions, and the CPU capacity is derived from the measured rerun time.
+
+    python load_test.py --sessions 5,10,25 --steps 6 --json report.json
+"""
+import argparse
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PAGES = ("main_chat.py", "quiz_summary.py", "ai_learning_path.py")
+
+SAMPLE_TEXT = """
+Photosynthesis converts light energy into chemical energy stored in glucose.
+It takes place in the chloroplasts, mainly in the leaves of green plants.
+The light dependent reactions happen in the thylakoid membranes and produce ATP and NADPH.
+The Calvin cycle uses ATP and NADPH in the stroma to fix carbon dioxide into sugars.
+Chlorophyll absorbs mostly blue and red light and reflects green light.
+Factors that limit the rate of photosynthesis are light intensity, carbon dioxide and temperature.
+"""
+
+CHAT_QUESTIONS = (
+    "What is photosynthesis?",
+    "Where does the Calvin cycle happen?",
+    "Why are leaves green?",
+    "What limits the rate of it?",
+    "Explain that in simple words",
+)
+
+
+# ----------------- Stub backends -----------------
+
+class FakeBucket:
+    def __init__(self, objects):
+        self._objects = objects
+
+    def upload(self, path, file, file_options=None):
+        upsert = str((file_options or {}).get("upsert", "false")).lower() == "true"
+        if path in self._objects and not upsert:
+            raise RuntimeError(f"409 Duplicate: {path} already exists")
+        self._objects[path] = file if isinstance(file, bytes) else file.read()
+
+    def download(self, path):
+        if path not in self._objects:
+            raise RuntimeError(f"404 Object not found: {path}")
+        return self._objects[path]
+
+    def list(self, path, options=None):
+        prefix = path.rstrip("/") + "/"
+        search = (options or {}).get("search", "")
+        names = [key[len(prefix):] for key in self._objects if key.startswith(prefix)]
+        return [{"name": name} for name in names if "/" not in name and search in name]
+
+    def remove(self, paths):
+        for path in paths:
+            self._objects.pop(path, None)
+
+
+class FakeStorage:
+    def __init__(self):
+        self.objects = {}
+
+    def from_(self, bucket):
+        return FakeBucket(self.objects)
+
+
+class FakeSupabase:
+    """In-memory stand-in for the parts of the Supabase client the app uses."""
+
+    def __init__(self):
+        self.storage = FakeStorage()
+
+
+fake_supabase = FakeSupabase()
+
+
+def install_stub_backends():
+    """Must run before any page module is imported."""
+    os.environ["LLM_PROVIDER_MODE"] = "fake"
+    os.environ.setdefault("GEMINI_API_KEY", "load-test")
+    os.environ.setdefault("GROQ_API_KEY", "load-test")
+    os.environ.setdefault("SUPABASE_URL", "http://supabase.invalid")
+    os.environ.setdefault("SUPABASE_KEY", "load-test")
+    # Every index stays far below this, so nothing tries the real TUS endpoint
+    os.environ["RESUMABLE_UPLOAD_THRESHOLD"] = str(1 << 40)
+
+    sys.modules["supabase"] = types.SimpleNamespace(
+        create_client=lambda url, key: fake_supabase,
+        Client=FakeSupabase,
+    )
+    sys.path.insert(0, HERE)
+
+
+def seed_database():
+    """One DB with an index and a study pack, created through the app's own code."""
+    from langchain_core.documents import Document
+    from langchain_vector_conversion import split_documents, embed_documents
+    from embedding_models import embeddings_for
+    from supabase_db import save_study_pack, save_vector_db_to_supabase
+    import quiz_engine
+
+    docs = split_documents([Document(page_content=SAMPLE_TEXT, metadata={"page": 0})])
+    db_id = save_vector_db_to_supabase(embed_documents(docs, embeddings_for()))
+    save_study_pack(db_id, quiz_engine.build_study_pack(SAMPLE_TEXT, size=15))
+    return db_id
+
+
+# ----------------- Measurements -----------------
+
+def rss_mb() -> float:
+    import psutil
+    return psutil.Process().memory_info().rss / 1e6
+
+
+def session_state_bytes(at) -> int:
+    from cache_policy import deep_sizeof
+
+    state = at.session_state
+    values = getattr(state, "filtered_state", None)
+    if values is None:
+        values = {key: state[key] for key in state}
+    return deep_sizeof(dict(values))
+
+
+def cache_bytes() -> dict:
+    """Bytes held by the bounded caches, st.cache_data / st.cache_resource and the markdown cache."""
+    from cache_policy import cache_stats
+    from chat_rendering import render_markdown
+
+    report = {
+        "markdown_entries": render_markdown.cache_info().currsize,
+        "bounded_cache_bytes": cache_stats()["bytes"],
+    }
+    try:
+        # Private API, the same numbers Streamlit shows in its stats endpoint
+        from streamlit.runtime.caching import cache_data_api, cache_resource_api
+        report["cache_data_bytes"] = sum(s.byte_length for s in cache_data_api._data_caches.get_stats())
+        report["cache_resource_bytes"] = sum(
+            s.byte_length for s in cache_resource_api._resource_caches.get_stats()
+        )
+    except Exception as e:
+        report["cache_error"] = str(e)
+    return report
+
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+# ----------------- Sessions -----------------
+
+def _by_label(elements, label):
+    for element in elements:
+        if element.label == label:
+            return element
+    raise LookupError(f"No widget labelled {label!r}")
+
+
+def chat_steps(at, db_id, steps):
+    yield lambda: at.run()
+    yield lambda: at.radio(key="db_mode").set_value("Search file by ID").run()
+    yield lambda: _by_label(at.text_input, "Search file by ID").set_value(db_id).run()
+    yield lambda: _by_label(at.button, "Load Database").click().run()
+    for i in range(steps):
+        question = CHAT_QUESTIONS[i % len(CHAT_QUESTIONS)]
+        yield lambda question=question: at.chat_input[0].set_value(question).run()
+
+
+def quiz_steps(at, db_id, steps):
+    yield lambda: at.run()
+    yield lambda: _by_label(at.text_input, "...or open a database ID").set_value(db_id).run()
+    yield lambda: _by_label(at.button, "📂 Open ID").click().run()
+    yield lambda: _by_label(at.button, "📌 Generate Summary").click().run()
+    yield lambda: _by_label(at.button, "🧠 Start New Quiz").click().run()
+    for _ in range(steps):
+        # Past the bank's 15 questions this falls through to live (streamed) generation
+        yield lambda: _by_label(at.button, "➡️ Next 5 Questions").click().run()
+
+
+def roadmap_steps(at, db_id, steps):
+    yield lambda: at.run()
+    yield lambda: _by_label(at.text_input, "Broad Subject").set_value("Biology").run()
+    yield lambda: _by_label(at.text_input, "Specific Topic").set_value("Photosynthesis").run()
+    for _ in range(max(1, steps // 3)):
+        yield lambda: _by_label(at.button, "Generate Learning Path").click().run()
+
+
+STEPS = {"main_chat.py": chat_steps, "quiz_summary.py": quiz_steps, "ai_learning_path.py": roadmap_steps}
+
+
+def run_level(sessions: int, steps: int, db_id: str, timeout: float) -> dict:
+    from streamlit.testing.v1 import AppTest
+
+    gc.collect()
+    rss_before = rss_mb()
+    caches_before = cache_bytes()
+
+    apps, plans = [], []
+    for i in range(sessions):
+        page = PAGES[i % len(PAGES)]
+        at = AppTest.from_file(os.path.join(HERE, page), default_timeout=timeout)
+        apps.append((page, at))
+        plans.append(iter(STEPS[page](at, db_id, steps)))
+
+    latencies = {page: [] for page in PAGES}
+    errors = []
+    active = list(range(sessions))
+    while active:
+        still_active = []
+        for i in active:
+            page, at = apps[i]
+            step = next(plans[i], None)
+            if step is None:
+                continue
+            started = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                errors.append(f"{page}: {e}")
+                continue
+            latencies[page].append(time.perf_counter() - started)
+            errors.extend(f"{page}: {exc.message}" for exc in at.exception)
+            still_active.append(i)
+        active = still_active
+
+    gc.collect()
+    state_bytes = [session_state_bytes(at) for _, at in apps]
+    all_latencies = [t for samples in latencies.values() for t in samples] or [0.0]
+    rss_after = rss_mb()
+
+    return {
+        "sessions": sessions,
+        "reruns": len(all_latencies),
+        "errors": errors[:20],
+        "error_count": len(errors),
+        "rss_mb_before": round(rss_before, 1),
+        "rss_mb_after": round(rss_after, 1),
+        "rss_mb_per_session": round((rss_after - rss_before) / sessions, 2),
+        "session_state_kb_mean": round(statistics.mean(state_bytes) / 1e3, 1),
+        "session_state_kb_max": round(max(state_bytes) / 1e3, 1),
+        "caches_before": caches_before,
+        "caches_after": cache_bytes(),
+        "rerun_p50_s": round(percentile(all_latencies, 0.50), 3),
+        "rerun_p99_s": round(percentile(all_latencies, 0.99), 3),
+        "rerun_mean_s": round(statistics.mean(all_latencies), 3),
+        "per_page": {
+            page: {
+                "p50_s": round(percentile(samples, 0.50), 3),
+                "p99_s": round(percentile(samples, 0.99), 3),
+            }
+            for page, samples in latencies.items() if samples
+        },
+    }
+
+
+def capacity(levels, pod_memory_mb: float, p99_slo: float, think_time: float, utilization: float) -> dict:
+    """
+    Sessions one pod can hold, by memory and by CPU.
+
+    Memory: the per-session RSS growth of the largest level against the pod
+    budget. CPU: script reruns share one interpreter, so N students who each
+    rerun every think_time seconds keep it busy N * mean_rerun / think_time
+    of the time; capacity is where that reaches the target utilization.
+    """
+    largest = levels[-1]
+    per_session = max(largest["rss_mb_per_session"], 0.01)
+    by_memory = int((pod_memory_mb - largest["rss_mb_before"]) / per_session)
+    by_cpu = int(utilization * think_time / max(largest["rerun_mean_s"], 1e-3))
+    within_slo = [level["sessions"] for level in levels if level["rerun_p99_s"] <= p99_slo]
+    return {
+        "pod_memory_mb": pod_memory_mb,
+        "p99_slo_s": p99_slo,
+        "think_time_s": think_time,
+        "sessions_by_memory": by_memory,
+        "sessions_by_cpu": by_cpu,
+        "largest_tested_within_slo": max(within_slo) if within_slo else 0,
+        "recommended_sessions_per_pod": max(0, min(by_memory, by_cpu)),
+        "limited_by": "memory" if by_memory < by_cpu else "cpu",
+    }
+
+
+def print_report(report):
+    print(f"{'sessions':>8} {'reruns':>7} {'p50 s':>7} {'p99 s':>7} {'MB/session':>11} {'state KB':>9} {'errors':>7}")
+    for level in report["levels"]:
+        print(
+            f"{level['sessions']:>8} {level['reruns']:>7} {level['rerun_p50_s']:>7} {level['rerun_p99_s']:>7} "
+            f"{level['rss_mb_per_session']:>11} {level['session_state_kb_mean']:>9} {level['error_count']:>7}"
+        )
+    cap = report["capacity"]
+    print(
+        f"\nCapacity: {cap['recommended_sessions_per_pod']} sessions per pod "
+        f"(memory allows {cap['sessions_by_memory']}, CPU allows {cap['sessions_by_cpu']}, "
+        f"limited by {cap['limited_by']}); largest tested level within the "
+        f"{cap['p99_slo_s']} s p99 SLO: {cap['largest_tested_within_slo']}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", default="3,6,12", help="comma separated session counts to test")
+    parser.add_argument("--steps", type=int, default=5, help="interactions per session after setup")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds allowed per rerun")
+    parser.add_argument("--pod-memory-mb", type=float, default=2048)
+    parser.add_argument("--p99-slo", type=float, default=3.0, help="acceptable p99 rerun latency in seconds")
+    parser.add_argument("--think-time", type=float, default=15.0, help="seconds between a student's reruns")
+    parser.add_argument("--utilization", type=float, default=0.7, help="target CPU utilization")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    install_stub_backends()
+    db_id = seed_database()
+
+    # Warm-up: model loads and first-run imports are not per-session costs
+    run_level(len(PAGES), 1, db_id, args.timeout)
+
+    levels = [
+        run_level(int(n), args.steps, db_id, args.timeout)
+        for n in args.sessions.split(",")
+    ]
+    report = {
+        "levels": levels,
+        "capacity": capacity(levels, args.pod_memory_mb, args.p99_slo, args.think_time, args.utilization),
+    }
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
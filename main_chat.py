@@ -1,15 +1,17 @@
 import streamlit as st
-from langchain_community.vectorstores import FAISS
-import tempfile
-from pathlib import Path
 import os
 import re
-from langchain_huggingface.embeddings import HuggingFaceEmbeddings
+from embedding_models import load_index
 from dotenv import load_dotenv
 from supabase import create_client, Client
 from gemini_agent import ask_ai,switch_to_internet_search
-from langchain_vector_conversion import convert_to_vector_db
-from supabase_db import save_vector_db_to_supabase,load_vector_db_from_supabase
+from conversation_memory import ConversationMemory
+import llm_providers
+from chat_rendering import render_markdown, visible_window
+from cache_policy import bounded_cache
+from vector_compression import VECTOR_ENCODINGS, DEFAULT_VECTOR_ENCODING
+from ingest_jobs import IngestionQueue, MAX_CONCURRENT_INGESTIONS, describe_progress
+from supabase_db import load_vector_db_from_supabase,get_vector_db_version,vector_db_exists,VectorDBNotFound
 
 # ----------------- Supabase client setup -----------------
 
@@ -34,33 +36,35 @@ def get_supabase_client():
 supabase: Client = get_supabase_client()
 
 
+# Loaded indexes share the byte budget in cache_policy instead of living
+# forever in st.cache_resource; a failed ID load is only remembered briefly.
+@bounded_cache("local_indexes")
+def load_faiss_local(path):
+    # Picks the embedder of the model recorded next to the index
+    return load_index(path)
 
-@st.cache_resource
-def load_embeddings():
-    return HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-mpnet-base-v2"
-    )
 
-embeddings = load_embeddings()
+@st.cache_resource
+def get_ingestion_queue():
+    # One pool per process, shared by every session and kept across reruns
+    return IngestionQueue(MAX_CONCURRENT_INGESTIONS)
 
+ingestion_queue = get_ingestion_queue()
 
-@st.cache_data
-def cached_convert_to_vector_db(uploaded_file, file_type_by_user):
-    return convert_to_vector_db(uploaded_file, file_type_by_user)
 
+@bounded_cache("remote_indexes")
+def cached_load_vector_db_from_supabase(db_id, version=0):
+    # version is part of the key so an append invalidates only that ID
+    return load_vector_db_from_supabase(db_id)
 
-@st.cache_resource
-def load_faiss_local(path, _embeddings):
-    return FAISS.load_local(
-        path,
-        _embeddings,
-        allow_dangerous_deserialization=True
-    )
 
-
-@st.cache_resource
-def cached_load_vector_db_from_supabase(db_id, _embeddings):
-    return load_vector_db_from_supabase(db_id, _embeddings)
+def detect_file_type(uploaded_file):
+    if uploaded_file.name.endswith(".pdf") and uploaded_file.type == "application/pdf":
+        return "pdf"
+    elif uploaded_file.name.endswith(".txt") and uploaded_file.type == "text/plain":
+        return "text"
+    elif uploaded_file.name.endswith(".docx") or uploaded_file.type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
+        return "docx"
 
 
 
@@ -97,12 +101,34 @@ st.markdown("""
 
 
 # ---------- SESSION STATE ----------
-if "active_db_id" not in st.session_state:
-    st.session_state.active_db_id = None
+# A course can span many uploaded files, each with its own database ID.
+if "active_db_ids" not in st.session_state:
+    st.session_state.active_db_ids = []
+
+# Indexes built in this session are already on disk, no need to download them again.
+if "local_db_paths" not in st.session_state:
+    st.session_state.local_db_paths = {}
+
+if "db_versions" not in st.session_state:
+    st.session_state.db_versions = {}
+
+# Background ingestion jobs started from this session
+if "ingest_jobs" not in st.session_state:
+    st.session_state.ingest_jobs = []
+    st.session_state.settled_jobs = set()
+    st.session_state.ready_jobs = set()
 
 if "topic_name" not in st.session_state:
     st.session_state.topic_name = "Your Knowledge. Powered by AI"
 
+# Rolling summary of older turns, so long chats keep a bounded prompt
+if "chat_memory" not in st.session_state:
+    st.session_state.chat_memory = ConversationMemory()
+
+# How many extra windows of older messages the user asked to see
+if "history_pages" not in st.session_state:
+    st.session_state.history_pages = 0
+
 if "messages" not in st.session_state:
     st.session_state["messages"] = [
         {"role": "assistant", "content": "Ask me anything"}
@@ -113,7 +139,99 @@ def clear_chat_history():
     st.session_state["messages"] = [
         {"role": "assistant", "content": "Ask me anything"}
     ]
-    st.session_state.active_db_id = None
+    st.session_state.active_db_ids = []
+    st.session_state.chat_memory = ConversationMemory()
+    st.session_state.history_pages = 0
+
+
+def parse_db_ids(raw_ids):
+    ids = []
+    for db_id in re.split(r"[,\s]+", raw_ids.strip()):
+        if db_id and db_id not in ids:
+            ids.append(db_id)
+    return ids
+
+
+def get_vector_db(db_id):
+    local_path = st.session_state.local_db_paths.get(db_id)
+    if local_path:
+        return load_faiss_local(local_path)
+    try:
+        return cached_load_vector_db_from_supabase(
+            db_id, st.session_state.db_versions.get(db_id, 0)
+        )
+    except VectorDBNotFound:
+        st.error(f"Could not fetch file for id: {db_id}")
+        st.error("Please Enter a valid ID or upload a file to get a new ID")
+        return None
+
+
+def finish_ingestion_job(job):
+    db_id = job["db_id"]
+    if job.get("append_to"):
+        # Reload the ID at its new version; a local copy predates the append
+        st.session_state.db_versions[db_id] = job["version"]
+        st.session_state.local_db_paths.pop(db_id, None)
+    # Deduplicated uploads have no local copy and load from Supabase
+    elif job.get("local_path"):
+        st.session_state.local_db_paths[db_id] = job["local_path"]
+    if db_id not in st.session_state.active_db_ids:
+        st.session_state.active_db_ids.append(db_id)
+
+
+def render_ingestion_jobs():
+    """Shows the background jobs of this session; reruns the page when one settles."""
+    just_settled = False
+    for job_id in st.session_state.ingest_jobs:
+        job = ingestion_queue.status(job_id)
+        if job is None:
+            continue
+
+        # The ID is usable on the local index before the upload finishes
+        if job.get("db_id") and job_id not in st.session_state.ready_jobs:
+            st.session_state.ready_jobs.add(job_id)
+            finish_ingestion_job(job)
+            just_settled = True
+
+        if job["stage"] in ("done", "failed") and job_id not in st.session_state.settled_jobs:
+            st.session_state.settled_jobs.add(job_id)
+            just_settled = True
+
+        label, fraction = describe_progress(job)
+        st.caption(job["file_name"])
+        if job["stage"] == "failed":
+            st.error(label)
+        elif job["stage"] == "done":
+            st.success(label)
+        elif fraction is None:
+            st.info(label)
+        else:
+            st.progress(fraction, text=label)
+
+        if job.get("db_id") and job["stage"] != "failed":
+            st.markdown("##### Your Unique Database ID")
+            st.text_input(
+                label="",
+                value=job["db_id"],
+                key=f"generated_id_display_{job_id}",
+            )
+            if job["stage"] == "done":
+                st.caption("Use this ID later with *Search file by ID*.")
+            else:
+                st.caption("You can chat with it now; it opens on other devices once the upload finishes.")
+
+    if just_settled:
+        # Let the chat pick up the new database
+        st.rerun()
+
+
+def show_ingestion_jobs():
+    running = any(
+        (ingestion_queue.status(job_id) or {}).get("stage") not in (None, "done", "failed")
+        for job_id in st.session_state.ingest_jobs
+    )
+    # Poll only while something is still running; settled jobs render once
+    st.fragment(run_every=1 if running else None)(render_ingestion_jobs)()
 
 
 # ============================================================================================
@@ -124,9 +242,15 @@ with st.sidebar:
     st.markdown("## Pym1t Assistant")
     st.markdown("### 🗪  Chat Controls")
 
+    pressure = llm_providers.feature_pressure("chat", "search")
+    if pressure == "throttled":
+        st.warning("The AI service is rate limited right now; answers will be delayed.")
+    elif pressure == "busy":
+        st.caption("⏳ Many questions in flight, answers may be queued.")
+
     mode = st.radio(
         "Choose an action:",
-        ("Upload a new file","Search file by ID"),
+        ("Upload a new file","Search file by ID","Append to existing ID"),
         key="db_mode",
     )
 
@@ -135,52 +259,82 @@ with st.sidebar:
     if mode == "Search file by ID":
         search_id = st.text_input(
             "Search file by ID",
-            placeholder="Enter Database ID"
+            placeholder="Enter one or more Database IDs (comma separated)"
         )
 
         if st.button("Load Database", type="primary", use_container_width=True):
-            if search_id:
-                cached_load_vector_db_from_supabase(search_id, embeddings)
-                st.session_state.active_db_id = search_id
-                st.success(f'Loaded chat with id {search_id}')
+            search_ids = parse_db_ids(search_id)
+            if search_ids:
+                for db_id in search_ids:
+                    st.session_state.db_versions[db_id] = get_vector_db_version(db_id)
+                loaded_ids = [
+                    db_id for db_id in search_ids
+                    if get_vector_db(db_id) is not None
+                ]
+                if loaded_ids:
+                    st.session_state.active_db_ids = loaded_ids
+                    st.success(f'Loaded chat with id {", ".join(loaded_ids)}')
             else:
                 st.warning("Please enter a valid ID.")
 
+    elif mode == "Append to existing ID":
+        append_id = st.text_input(
+            "Database ID to extend",
+            placeholder="Enter Database ID"
+        )
+        appended_file = st.file_uploader(
+            "New file to add",
+            type=["pdf", "txt", "docx"],
+        )
+
+        if st.button("Append", type="primary", use_container_width=True):
+            if not append_id or appended_file is None:
+                st.warning("Please enter an ID and upload a file first.")
+            elif not vector_db_exists(append_id.strip()):
+                st.error(f"Could not find a database with ID {append_id.strip()}")
+            else:
+                # Parsing, embedding and the upload run in a background worker
+                job_id = ingestion_queue.submit_append(
+                    append_id.strip(), appended_file.getvalue(), appended_file.name,
+                    detect_file_type(appended_file),
+                )
+                st.session_state.ingest_jobs.append(job_id)
+
     else:
         uploaded_file = st.file_uploader(
             "Upload a new file",
             type=["pdf", "txt", "docx"],
         )
 
+        vector_encoding = st.selectbox(
+            "Vector storage",
+            VECTOR_ENCODINGS,
+            index=VECTOR_ENCODINGS.index(DEFAULT_VECTOR_ENCODING),
+            help="Smaller encodings upload and load faster at a small cost in retrieval recall.",
+        )
+
+        prepare_study_pack = st.checkbox(
+            "Also prepare summary & quiz bank",
+            help="Generated once in the background and opened by ID on the Summary & Quiz page.",
+        )
+
         if st.button("Upload", type="primary", use_container_width=True):
             if uploaded_file is None:
                 st.warning("Please upload a file first.")
             else:
-                if uploaded_file.name.endswith(".pdf") and uploaded_file.type == "application/pdf":
-                    file_type_by_user = "pdf"
-                elif uploaded_file.name.endswith(".txt") and uploaded_file.type == "text/plain":
-                    file_type_by_user = "text"
-                elif uploaded_file.name.endswith(".docx") or uploaded_file.type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-                    file_type_by_user = "docx"
-                DATABASE = cached_convert_to_vector_db(uploaded_file, file_type_by_user)
-
-                db = load_faiss_local(
-                    f"{uploaded_file.name}_DB",
-                    embeddings
+                file_type_by_user = detect_file_type(uploaded_file)
+                # Runs in a background worker, the page stays usable meanwhile
+                job_id = ingestion_queue.submit(
+                    uploaded_file.getvalue(), uploaded_file.name, file_type_by_user,
+                    vector_encoding, prepare_study_pack,
                 )
+                st.session_state.ingest_jobs.append(job_id)
 
-                database_saved_with_id = save_vector_db_to_supabase(db)
+    if st.session_state.ingest_jobs:
+        show_ingestion_jobs()
 
-                st.session_state.active_db_id = database_saved_with_id
-
-                st.success("File converted to vector DB successfully!")
-                st.markdown("##### Your Unique Database ID")
-                st.text_input(
-                    label="",
-                    value=database_saved_with_id,
-                    key="generated_id_display",
-                )
-                st.caption("Use this ID later with *Search file by ID*.")
+    if st.session_state.active_db_ids:
+        st.caption(f"Chatting with {len(st.session_state.active_db_ids)} database(s)")
 
     st.markdown("---")
     st.button("🗑️ Clear Chat History", on_click=clear_chat_history, use_container_width=True)
@@ -200,13 +354,26 @@ with st.sidebar:
 
 st.subheader(st.session_state.topic_name)
 
-for message in st.session_state.messages:
+# Only the newest messages are rendered, so a rerun costs the same however long the chat is
+hidden_messages, visible_messages = visible_window(
+    st.session_state.messages, st.session_state.history_pages
+)
+if hidden_messages:
+    if st.button(f"⬆️ Show earlier messages ({hidden_messages} hidden)"):
+        st.session_state.history_pages += 1
+        st.rerun()
+elif st.session_state.history_pages:
+    if st.button("⬇️ Hide earlier messages"):
+        st.session_state.history_pages = 0
+        st.rerun()
+
+for message in visible_messages:
     with st.chat_message(message["role"]):
-        st.markdown(message["content"])
+        st.markdown(render_markdown(message["role"], message["content"]))
 
 
 if retriever_query := st.chat_input("Ask a question"):
-    if st.session_state.active_db_id:
+    if st.session_state.active_db_ids:
         st.session_state.messages.append({"role": "user", "content": retriever_query})
 
         with st.chat_message("user"):
@@ -216,49 +383,20 @@ if retriever_query := st.chat_input("Ask a question"):
 
                 full_history = [(m['role'], m['content']) for m in st.session_state.messages]
 
-                if mode == "Search file by ID":
-
-                    def save_faiss_to_temp(vectorstore):
-                        temp_dir = Path(tempfile.mkdtemp())
-                        vectorstore.save_local(str(temp_dir))
-                        return temp_dir
-
-                    response_data = ask_ai(
-                        retriever_query,
-                        full_history,
-                        str(
-                            save_faiss_to_temp(
-                                cached_load_vector_db_from_supabase(search_id, embeddings)
-                            )
-                        )
-                    )
-                else:
-                    response_data = ask_ai(
-                        retriever_query,
-                        full_history,
-                        f"{uploaded_file.name}_DB"
-                    )
+                vector_dbs = [
+                    get_vector_db(db_id) for db_id in st.session_state.active_db_ids
+                ]
+
+                response_data = ask_ai(
+                    retriever_query,
+                    full_history,
+                    [db for db in vector_dbs if db is not None],
+                    memory=st.session_state.chat_memory,
+                )
 
                 answer_text = response_data
 
-                def normalize_llm_math(text: str) -> str:
-                    text = re.sub(r"\[\s*(.*?)\s*\]", r"$$\n\1\n$$", text, flags=re.DOTALL)
-                    text = re.sub(r"\$\$\s*(.*?)\s*\$\$", r"$$\n\1\n$$", text, flags=re.DOTALL)
-                    text = re.sub(r"^\s*\\\s*$", "", text, flags=re.MULTILINE)
-                    text = text.replace(r"\$", "$")
-                    text = re.sub(r"\\\((.*?)\\\)", r"$\1$", text)
-                    lines = text.splitlines()
-                    cleaned = []
-                    for line in lines:
-                        if line.strip() == "$$":
-                            cleaned.append("$$")
-                        else:
-                            cleaned.append(line.rstrip())
-                    return "\n".join(cleaned)
-
-            st.markdown(
-                normalize_llm_math(answer_text).replace("\n", "  \n")
-            )
+            st.markdown(render_markdown("assistant", answer_text))
 
             st.session_state.messages.append(
                 {"role": "assistant", "content": answer_text}
@@ -272,7 +410,7 @@ if retriever_query := st.chat_input("Ask a question"):
         with st.chat_message("assistant"):
             with st.spinner("Thinking..."):
                 llm_reply_without_db = switch_to_internet_search(retriever_query)
-                st.markdown(llm_reply_without_db)
+                st.markdown(render_markdown("assistant", llm_reply_without_db))
             st.session_state.messages.append(
                 {"role": "assistant", "content": llm_reply_without_db}
             )
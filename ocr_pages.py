@@ -0,0 +1,178 @@
+"""
+OCR for scanned PDFs.
+
+Only pages without a text layer are OCR'd. Each one is cut out as its own
+single-page PDF and rasterized + recognized in a process pool. Results are
+cached on disk by the hash of that page, so re-uploading a scan (or the same
+pages inside another file) skips the work.
+"""
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Every ingestion worker process has its own OCR pool; together they get
+# half the CPUs unless OCR_WORKERS pins the size of each pool
+OCR_CPU_SHARE = 0.5
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "0"))
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", ".ocr_cache")
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+# "tesseract" or "rapidocr"; tesseract falls back to rapidocr if the binary is missing
+OCR_ENGINE = os.getenv("OCR_ENGINE", "tesseract")
+
+# Less extracted text than this and the page is treated as a scan
+MIN_TEXT_CHARS = 20
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_size = None
+_rapidocr_engine = None
+
+
+def needs_ocr(text) -> bool:
+    return text is None or len(text.strip()) < MIN_TEXT_CHARS
+
+
+def ocr_workers_for(ingestion_workers: int) -> int:
+    """OCR processes per ingestion worker, so all pools together stay within the CPU share."""
+    if OCR_WORKERS:
+        return OCR_WORKERS
+    cpus = int((os.cpu_count() or 2) * OCR_CPU_SHARE)
+    return max(1, cpus // max(1, ingestion_workers))
+
+
+def set_ingestion_workers(ingestion_workers: int) -> None:
+    """Called once in each ingestion worker process, before any OCR."""
+    global _pool_size
+    _pool_size = ocr_workers_for(ingestion_workers)
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=_pool_size or ocr_workers_for(1),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+# ----------------- Page cache -----------------
+
+def _cache_file(page_digest: str) -> str:
+    return os.path.join(OCR_CACHE_DIR, f"{page_digest}.txt")
+
+
+def _read_cache(page_digest: str):
+    try:
+        with open(_cache_file(page_digest), "r", encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _write_cache(page_digest: str, text: str) -> None:
+    os.makedirs(OCR_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{_cache_file(page_digest)}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, _cache_file(page_digest))
+
+
+# ----------------- Worker side -----------------
+
+def _recognize(image) -> str:
+    global _rapidocr_engine
+    if OCR_ENGINE == "tesseract":
+        import pytesseract
+        try:
+            return pytesseract.image_to_string(image)
+        except pytesseract.TesseractNotFoundError:
+            pass
+
+    import numpy as np
+    from rapidocr import RapidOCR
+    if _rapidocr_engine is None:
+        _rapidocr_engine = RapidOCR()
+    result = _rapidocr_engine(np.array(image))
+    return "\n".join(result.txts or [])
+
+
+def _ocr_single_page(page_pdf: bytes) -> str:
+    from pdf2image import convert_from_bytes
+
+    images = convert_from_bytes(page_pdf, dpi=OCR_DPI)
+    return "\n".join(_recognize(image) for image in images).strip()
+
+
+# ----------------- Public API -----------------
+
+def _split_pages(pdf_bytes: bytes, page_numbers):
+    """Single-page PDFs for the requested pages, so workers only receive what they OCR."""
+    import pypdf
+
+    reader = pypdf.PdfReader(io.BytesIO(pdf_bytes))
+    pages = {}
+    for page_number in page_numbers:
+        writer = pypdf.PdfWriter()
+        writer.add_page(reader.pages[page_number])
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        pages[page_number] = buffer.getvalue()
+    return pages
+
+
+def ocr_pdf_pages(pdf_bytes: bytes, page_numbers, progress=None) -> dict:
+    """
+    OCR the given 0-based pages of a PDF in parallel.
+
+    Returns {page_number: text}. progress("ocr", pages_ocr_done=..., pages_ocr_total=...)
+    is called as pages finish.
+    """
+    page_numbers = list(page_numbers)
+    if not page_numbers:
+        return {}
+
+    texts = {}
+    pending = {}
+    for page_number, page_pdf in _split_pages(pdf_bytes, page_numbers).items():
+        page_digest = hashlib.sha256(page_pdf).hexdigest()
+        cached = _read_cache(page_digest)
+        if cached is not None:
+            texts[page_number] = cached
+        else:
+            pending[page_number] = (page_digest, page_pdf)
+
+    def report():
+        if progress is not None:
+            progress("ocr", pages_ocr_done=len(texts), pages_ocr_total=len(page_numbers))
+
+    report()
+    if pending:
+        pool = _get_pool()
+        futures = {
+            pool.submit(_ocr_single_page, page_pdf): (page_number, page_digest)
+            for page_number, (page_digest, page_pdf) in pending.items()
+        }
+        for future in as_completed(futures):
+            page_number, page_digest = futures[future]
+            try:
+                text = future.result()
+                _write_cache(page_digest, text)
+            except Exception as e:
+                print(f"OCR failed on page {page_number + 1}: {e}")
+                text = ""
+            texts[page_number] = text
+            report()
+
+    return texts
+
+
+def fill_missing_text(pdf_bytes: bytes, page_texts, progress=None):
+    """Returns page_texts with every page that had no text layer replaced by its OCR text."""
+    missing = [i for i, text in enumerate(page_texts) if needs_ocr(text)]
+    ocr_texts = ocr_pdf_pages(pdf_bytes, missing, progress)
+    return [ocr_texts.get(i, text or "") for i, text in enumerate(page_texts)]
@@ -0,0 +1,315 @@
+import io
+import json
+import os
+import re
+import time
+import random
+from dotenv import load_dotenv
+from ocr_pages import fill_missing_text
+import llm_providers
+from context_cache import DocumentContext
+
+# Summary / quiz generation shared by the Streamlit page and the HTTP API.
+# Nothing in here touches the Streamlit UI: errors are raised and the caller
+# decides how to show them.
+
+load_dotenv()
+
+MAX_CONTEXT_CHARS = 25000
+
+# ================= PROMPTS =================
+QUIZ_PROMPT = """
+CRITICAL RULES:
+- NO PREAMBLE
+- ONLY JSON OUTPUT
+- USE ONLY THE DOCUMENT ABOVE
+- EXACTLY {count} QUESTIONS
+- RANDOMIZE CORRECT ANSWERS (Do not always make 'A' the answer)
+
+JSON SCHEMA:
+{{
+  "questions": [
+    {{
+      "question": "string",
+      "options": {{
+        "A": "string",
+        "B": "string",
+        "C": "string",
+        "D": "string"
+      }},
+      "answer": "A|B|C|D",
+      "reason": "string",
+      "type": "True/False | Numerical | Theory | MCQ",
+      "difficulty": "Easy | Medium | Hard"
+    }}
+  ]
+}}
+"""
+
+QUESTION_TYPES = ("True/False", "Numerical", "Theory", "MCQ")
+DIFFICULTIES = ("Easy", "Medium", "Hard")
+OPTION_KEYS = ("A", "B", "C", "D")
+
+# Structured output schema (Gemini response_schema format), same shape as the prompt
+QUESTION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "question": {"type": "STRING"},
+        "options": {
+            "type": "OBJECT",
+            "properties": {key: {"type": "STRING"} for key in OPTION_KEYS},
+            "required": list(OPTION_KEYS),
+        },
+        "answer": {"type": "STRING", "enum": list(OPTION_KEYS)},
+        "reason": {"type": "STRING"},
+        "type": {"type": "STRING", "enum": list(QUESTION_TYPES)},
+        "difficulty": {"type": "STRING", "enum": list(DIFFICULTIES)},
+    },
+    "required": ["question", "options", "answer", "reason", "type", "difficulty"],
+    # Question text first, so a streamed question is readable as early as possible
+    "propertyOrdering": ["question", "options", "answer", "reason", "type", "difficulty"],
+}
+QUIZ_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {"questions": {"type": "ARRAY", "items": QUESTION_SCHEMA}},
+    "required": ["questions"],
+}
+
+# The document itself is passed as a DocumentContext, ahead of these prompts,
+# so every call on the same text can reuse one provider-side cache
+SUMMARY_PROMPT = "Summarize the document above in simple, student-friendly language."
+
+
+# ================= MODEL =================
+def api_key_configured() -> bool:
+    """Every call goes through llm_providers; this only checks a key is set."""
+    return bool(llm_providers.gemini_api_key())
+
+
+# ================= FILE TEXT =================
+def extract_file_text(file_bytes: bytes, file_name: str) -> str:
+    if file_name.endswith(".pdf"):
+        import pypdf
+        pdf_reader = pypdf.PdfReader(io.BytesIO(file_bytes))
+        page_texts = [page.extract_text() for page in pdf_reader.pages]
+        # Scanned pages come back empty from pypdf
+        page_texts = fill_missing_text(file_bytes, page_texts)
+        return "\n".join(page_texts).strip()
+    else:
+        return file_bytes.decode("utf-8").strip()
+
+
+# ================= GENERATION FUNCTIONS =================
+def generate_summary(text: str):
+    if not api_key_configured() or not text: return None
+
+    response = llm_providers.generate("summary", SUMMARY_PROMPT, context=document_context(text))
+    return response.text.strip()
+
+
+def document_context(text: str) -> DocumentContext:
+    """The part of text sent to the model; the same text always gives the same context."""
+    return DocumentContext(text[:MAX_CONTEXT_CHARS])
+
+
+def _quiz_prompt(avoid_questions, count: int) -> str:
+    avoid_text = "\n".join(avoid_questions)
+    return (
+        f"DO NOT repeat these questions:\n{avoid_text}\n\n"
+        f"{QUIZ_PROMPT.format(count=count)}"
+    )
+
+
+def iter_json_objects(chunks, key: str = "questions"):
+    """
+    Yields each complete object of the `key` array as soon as its closing brace arrives.
+
+    chunks is an iterable of text pieces (a streamed response). An object that
+    is not valid JSON is yielded as None so the caller can replace it.
+    """
+    buffer = ""
+    position = 0
+    in_array = False
+    depth = 0
+    in_string = False
+    escaped = False
+    start = None
+
+    for chunk in chunks:
+        buffer += chunk
+        if not in_array:
+            found = re.search(r'"%s"\s*:\s*\[' % re.escape(key), buffer)
+            if not found:
+                continue
+            in_array = True
+            position = found.end()
+
+        while position < len(buffer):
+            char = buffer[position]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char == "{":
+                if depth == 0:
+                    start = position
+                depth += 1
+            elif char == "}":
+                depth -= 1
+                if depth == 0:
+                    try:
+                        yield json.loads(buffer[start:position + 1])
+                    except json.JSONDecodeError:
+                        yield None
+            elif char == "]" and depth == 0:
+                return
+            position += 1
+
+
+def validate_question(question):
+    """Returns the question with normalized fields, or None if it cannot be shown."""
+    if not isinstance(question, dict):
+        return None
+    text = question.get("question")
+    options = question.get("options")
+    if not isinstance(text, str) or not text.strip() or not isinstance(options, dict):
+        return None
+
+    options = {
+        str(key).strip().upper(): value.strip()
+        for key, value in options.items()
+        if str(key).strip().upper() in OPTION_KEYS and isinstance(value, str) and value.strip()
+    }
+    # True/False questions may come with only two options
+    answer = str(question.get("answer", "")).strip().upper()[:1]
+    if len(options) < 2 or answer not in options:
+        return None
+
+    return {
+        "question": text.strip(),
+        "options": options,
+        "answer": answer,
+        "reason": str(question.get("reason") or "").strip(),
+        "type": question.get("type") if question.get("type") in QUESTION_TYPES else "MCQ",
+        "difficulty": question.get("difficulty") if question.get("difficulty") in DIFFICULTIES else "Medium",
+    }
+
+
+def stream_quiz(text: str, current_questions, count: int = 5):
+    """
+    Yields validated questions one by one while the model is still writing.
+
+    Questions that fail to parse or validate are regenerated one at a time
+    afterwards, instead of throwing away the whole batch.
+    """
+    asked = list(current_questions)
+    produced = 0
+    context = document_context(text)
+    chunks = llm_providers.stream("quiz", _quiz_prompt(asked, count), json_schema=QUIZ_SCHEMA, context=context)
+    for raw in iter_json_objects(chunks):
+        question = validate_question(raw)
+        if question is None or question["question"] in asked:
+            continue
+        asked.append(question["question"])
+        produced += 1
+        yield question
+        if produced == count:
+            return
+
+    # One attempt per missing question, so a model that keeps failing costs at most `count` calls
+    for _ in range(count - produced):
+        question = _regenerate_question(context, asked)
+        if question is not None:
+            asked.append(question["question"])
+            yield question
+
+
+def _regenerate_question(context: DocumentContext, asked):
+    try:
+        response = llm_providers.generate(
+            "quiz", _quiz_prompt(asked, 1), json_schema=QUIZ_SCHEMA, context=context
+        )
+    except Exception as e:
+        print(f"Question regeneration failed: {e}")
+        return None
+    for raw in iter_json_objects([response.text]):
+        question = validate_question(raw)
+        if question is not None and question["question"] not in asked:
+            return question
+    return None
+
+
+def generate_quiz(text: str, current_questions):
+    if not api_key_configured() or not text: return None
+
+    return {"questions": list(stream_quiz(text, current_questions))}
+
+
+# ================= STUDY PACK =================
+# A summary plus a bank of tagged questions, generated once at ingestion and
+# stored next to the index, so quiz batches are sampled without an LLM call.
+
+QUESTION_BANK_SIZE = int(os.getenv("QUESTION_BANK_SIZE", "30"))
+QUIZ_BATCH_SIZE = 5
+
+
+def _context_windows(text: str):
+    """Consecutive MAX_CONTEXT_CHARS slices, so the bank covers the whole file."""
+    return [text[start:start + MAX_CONTEXT_CHARS] for start in range(0, len(text), MAX_CONTEXT_CHARS)] or [""]
+
+
+def generate_question_bank(text: str, size: int = QUESTION_BANK_SIZE, progress=None):
+    """Returns up to size questions, generated 5 at a time across the file."""
+    windows = _context_windows(text)
+    bank, seen = [], set()
+    empty_batches = 0
+    batch_number = 0
+    while len(bank) < size and empty_batches < 3:
+        window = windows[batch_number % len(windows)]
+        batch_number += 1
+        try:
+            quiz = generate_quiz(window, [q["question"] for q in bank])
+        except Exception as e:
+            # One bad batch (e.g. malformed JSON) should not lose the rest of the bank
+            print(f"Question bank batch failed: {e}")
+            quiz = None
+        new_questions = [
+            q for q in (quiz or {}).get("questions", [])
+            if q.get("question") and q["question"] not in seen
+        ]
+        if not new_questions:
+            empty_batches += 1
+            continue
+        for q in new_questions[:size - len(bank)]:
+            seen.add(q["question"])
+            bank.append(q)
+        if progress is not None:
+            progress("study_pack", questions_generated=len(bank), questions_total=size)
+    return bank
+
+
+def build_study_pack(text: str, size: int = QUESTION_BANK_SIZE, progress=None) -> dict:
+    if progress is not None:
+        progress("study_pack", questions_generated=0, questions_total=size)
+    return {
+        "summary": generate_summary(text),
+        "questions": generate_question_bank(text, size, progress),
+        "created_at": time.time(),
+    }
+
+
+def sample_quiz(study_pack: dict, asked_questions, n: int = QUIZ_BATCH_SIZE, difficulty=None):
+    """A quiz batch drawn from the bank, skipping asked questions; None once the bank is used up."""
+    asked = set(asked_questions)
+    pool = [
+        q for q in study_pack.get("questions", [])
+        if q["question"] not in asked and (difficulty is None or q.get("difficulty") == difficulty)
+    ]
+    if not pool:
+        return None
+    return {"questions": random.sample(pool, min(n, len(pool)))}
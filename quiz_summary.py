@@ -1,11 +1,11 @@
 import streamlit as st
-import json
-import re
-import os
-import io
 import uuid
-import requests
 from dotenv import load_dotenv
+import quiz_engine
+import llm_providers
+from quiz_engine import extract_file_text
+from cache_policy import bounded_cache
+from docs_outbox import get_outbox
 
 # ================= ENV & PAGE CONFIG =================
 load_dotenv()
@@ -27,125 +27,94 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# ================= CONFIGURATION =================
-DOCS_WEBHOOK_URL = "https://script.google.com/macros/s/AKfycbw1Jew58JG48DYdKIVMrCt-7m-g4slyLmDfH8AgNDIdFQqgEXRmS8owx8sYkMxfe2yPgQ/exec"
-
 # ================= CACHED RESOURCES =================
-@st.cache_resource
-def get_gemini_model():
-    import google.generativeai as genai
-    
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
+def require_api_key():
+    configured = quiz_engine.api_key_configured()
+    if not configured:
         st.error("GEMINI_API_KEY not found in environment variables.")
-        return None
-        
-    genai.configure(api_key=api_key)
-    return genai.GenerativeModel(
-        "gemini-2.5-flash-lite",
-        generation_config={"temperature": 0.7, "top_p": 0.9}
-    )
+    return configured
 
 # ================= EFFICIENT FILE LOADING =================
-@st.cache_data(show_spinner="Reading file...")
+@bounded_cache("file_texts", negative=lambda text: not text)
 def load_file_text(file_bytes: bytes, file_name: str) -> str:
     try:
-        if file_name.endswith(".pdf"):
-            import pypdf
-            pdf_reader = pypdf.PdfReader(io.BytesIO(file_bytes))
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            return text.strip()
-        else:
-            return file_bytes.decode("utf-8").strip()
+        return extract_file_text(file_bytes, file_name)
     except Exception as e:
         st.error(f"Error reading file: {e}")
         return ""
 
-# ================= PROMPTS =================
-QUIZ_PROMPT = """
-CRITICAL RULES:
-- NO PREAMBLE
-- ONLY JSON OUTPUT
-- USE ONLY PROVIDED TEXT
-- EXACTLY 5 QUESTIONS
-- RANDOMIZE CORRECT ANSWERS (Do not always make 'A' the answer)
-
-TEXT:
-{context}
-
-JSON SCHEMA:
-{{
-  "questions": [
-    {{
-      "question": "string",
-      "options": {{
-        "A": "string",
-        "B": "string",
-        "C": "string",
-        "D": "string"
-      }},
-      "answer": "A|B|C|D",
-      "reason": "string",
-      "type": "True/False | Numerical | Theory | MCQ",
-      "difficulty": "Easy | Medium | Hard"
-    }}
-  ]
-}}
-"""
-
-SUMMARY_PROMPT = "Summarize the following content in simple, student-friendly language:\n\n{context}"
+# ================= DATABASE ID LOADING =================
+# Short TTL: a study pack may still be generating right after ingestion
+@bounded_cache("study_packs", ttl=60)
+def fetch_study_pack(db_id: str):
+    # Imported here: supabase_db connects on import, and only the Open ID path needs it
+    from supabase_db import load_study_pack
+    return load_study_pack(db_id)
+
+@bounded_cache("db_texts", negative=lambda text: not text)
+def fetch_db_text(db_id: str) -> str:
+    from supabase_db import load_vector_db_from_supabase, text_from_vector_db
+    return text_from_vector_db(load_vector_db_from_supabase(db_id))
 
 # ================= GENERATION FUNCTIONS =================
 def generate_summary(text: str):
-    model = get_gemini_model()
-    if not model or not text: return None
-    
-    try:
-        response = model.generate_content(SUMMARY_PROMPT.format(context=text[:25000]))
-        return response.text.strip()
-    except Exception as e:
-        st.error(f"API Error: {e}")
-        return None
-
-def generate_quiz(text: str, current_questions):
-    model = get_gemini_model()
-    if not model or not text: return None
-
-    avoid_text = "\n".join(current_questions)
-    prompt = f"DO NOT repeat these questions:\n{avoid_text}\n\n{QUIZ_PROMPT.format(context=text[:25000])}"
+    if not require_api_key() or not text: return None
 
     try:
-        response = model.generate_content(prompt)
-        raw = re.sub(r"```json|```", "", response.text.strip())
-        return json.loads(raw)
+        return quiz_engine.generate_summary(text)
     except Exception as e:
-        st.error(f"Quiz Generation Error: {e}")
+        st.error(f"API Error: {e}")
         return None
 
 def save_to_google_docs(title, summary=None, quiz_results=None):
-    payload = {"title": title}
-    if summary:
-        payload["summary"] = summary
-    if quiz_results:
-        payload["quiz_results"] = quiz_results
-    
+    """Queues the export; the outbox worker delivers it in the background."""
     try:
-        requests.post(DOCS_WEBHOOK_URL, json=payload)
+        get_outbox().enqueue(st.session_state.session_id, title, summary, quiz_results)
         return True
     except Exception as e:
-        print(f"Error saving to docs: {e}")
+        print(f"Error queueing docs export: {e}")
         return False
 
+EXPORT_STATUS_ICONS = {"queued": "⏳", "sending": "📤", "delivered": "✅", "failed": "❌"}
+PENDING_EXPORT_STATUSES = ("queued", "sending")
+
+def render_exports(polling=False):
+    exports = get_outbox().session_exports(st.session_state.session_id)
+    for export in exports:
+        icon = EXPORT_STATUS_ICONS[export["status"]]
+        line = f"{icon} {export['title']}: {export['status']}"
+        if export["status"] == "queued" and export["attempts"]:
+            line += f" (retry {export['attempts']}, {export['last_error']})"
+        cols = st.columns([5, 1])
+        cols[0].caption(line)
+        if export["status"] == "failed":
+            cols[1].button("Retry", key=f"retry_{export['id']}",
+                           on_click=get_outbox().retry, args=(export["id"],))
+    if polling and not any(e["status"] in PENDING_EXPORT_STATUSES for e in exports):
+        # run_every is fixed when the fragment is created; rerun the page once
+        # so show_exports recreates it without polling
+        st.rerun()
+
+def show_exports():
+    exports = get_outbox().session_exports(st.session_state.session_id)
+    if not exports:
+        return
+    pending = any(e["status"] in PENDING_EXPORT_STATUSES for e in exports)
+    # Poll only while something is still on its way
+    st.fragment(run_every=2 if pending else None)(render_exports)(polling=pending)
+
 # ================= SESSION STATE =================
-if "session_id" not in st.session_state:
-    st.session_state.session_id = str(uuid.uuid4())
+if "text" not in st.session_state:
+    # app.py usually sets session_id already, it also labels usage_ledger rows
+    st.session_state.setdefault("session_id", str(uuid.uuid4()))
     st.session_state.text = None
     st.session_state.summary = None
     st.session_state.quiz = None
     st.session_state.asked_questions = []
     st.session_state.checked_status = {}
+    st.session_state.study_pack = None
+    st.session_state.source_db_id = None
+    st.session_state.stream_batch = False
     
 if "historical_score" not in st.session_state:
     st.session_state.historical_score = 0
@@ -162,17 +131,57 @@ def reset_quiz_state():
     st.session_state.historical_score = 0
     st.session_state.historical_total = 0
 
+def has_source():
+    return bool(st.session_state.text or st.session_state.study_pack or st.session_state.source_db_id)
+
+def ensure_text():
+    """The document text; for a database ID it is only fetched once live generation is needed."""
+    if not st.session_state.text and st.session_state.source_db_id:
+        from supabase_db import VectorDBNotFound
+        with st.spinner("Loading database text..."):
+            try:
+                st.session_state.text = fetch_db_text(st.session_state.source_db_id)
+            except VectorDBNotFound:
+                st.error(f"Could not fetch file for id: {st.session_state.source_db_id}")
+    return st.session_state.text
+
+def set_batch(questions):
+    st.session_state.quiz = {"questions": questions}
+    st.session_state.checked_status = {}
+    # Record these questions so we don't repeat them
+    for q in questions:
+        st.session_state.asked_questions.append(q["question"])
+
 def load_new_batch():
-    """Generates the next batch of questions"""
-    if st.session_state.text:
-        with st.spinner("Generating next batch..."):
-            quiz_data = generate_quiz(st.session_state.text, st.session_state.asked_questions)
-            if quiz_data:
-                st.session_state.quiz = quiz_data
-                st.session_state.checked_status = {}
-                # Record these questions so we don't repeat them
-                for q in quiz_data.get("questions", []):
-                    st.session_state.asked_questions.append(q["question"])
+    """Samples the next batch from the question bank, or queues a live batch that streams in on the page"""
+    quiz_data = None
+    if st.session_state.study_pack:
+        quiz_data = quiz_engine.sample_quiz(st.session_state.study_pack, st.session_state.asked_questions)
+
+    if quiz_data:
+        set_batch(quiz_data["questions"])
+    elif ensure_text():
+        st.session_state.quiz = None
+        st.session_state.stream_batch = True
+
+def stream_new_batch():
+    """Shows each question as soon as the model has written it, then reruns into the interactive quiz"""
+    if not require_api_key(): return
+
+    questions = []
+    with st.status("Generating questions...", expanded=True) as status:
+        try:
+            for q in quiz_engine.stream_quiz(st.session_state.text, st.session_state.asked_questions):
+                questions.append(q)
+                st.markdown(f"**Q{len(questions)}. {q['question']}**")
+                status.update(label=f"Generating questions... {len(questions)}/5")
+        except Exception as e:
+            st.error(f"Quiz Generation Error: {e}")
+            status.update(state="error")
+
+    if questions:
+        set_batch(questions)
+        st.rerun()
 
 def on_next_click():
     """Calculates score for current batch and loads the next one"""
@@ -197,19 +206,44 @@ def on_next_click():
 # ================= SIDEBAR =================
 with st.sidebar:
     st.title("📘 Controls")
+
+    pressure = llm_providers.feature_pressure("quiz", "summary")
+    if pressure == "throttled":
+        st.warning("Quiz generation is rate limited right now; new questions may take a while.")
+    elif pressure == "busy":
+        st.caption("⏳ Many requests in flight, generation is queued.")
     uploaded_file = st.file_uploader("Upload file", type=["pdf", "txt"])
 
     if uploaded_file:
         file_key = f"file_{uploaded_file.name}"
         if file_key != st.session_state.get("last_loaded_file"):
-            text = load_file_text(uploaded_file.getvalue(), uploaded_file.name)
+            with st.spinner("Reading file..."):
+                text = load_file_text(uploaded_file.getvalue(), uploaded_file.name)
             st.session_state.text = text
             st.session_state.last_loaded_file = file_key
+            st.session_state.study_pack = None
+            st.session_state.source_db_id = None
             reset_quiz_state()
             st.success("File Processed!")
 
+    db_id = st.text_input("...or open a database ID", placeholder="ID from the chat page").strip()
+    if st.button("📂 Open ID") and db_id:
+        st.session_state.source_db_id = db_id
+        with st.spinner("Loading study pack..."):
+            st.session_state.study_pack = fetch_study_pack(db_id)
+        st.session_state.text = None
+        st.session_state.summary = None
+        reset_quiz_state()
+        if st.session_state.study_pack:
+            st.success(f"Loaded summary and {len(st.session_state.study_pack['questions'])} prepared questions.")
+        else:
+            st.info("No prepared quiz bank for this ID; questions will be generated live.")
+
     if st.button("📌 Generate Summary"):
-        if st.session_state.text:
+        pack = st.session_state.study_pack
+        if pack and pack.get("summary"):
+            st.session_state.summary = pack["summary"]
+        elif ensure_text():
             with st.spinner("Summarizing..."):
                 st.session_state.summary = generate_summary(st.session_state.text)
         else:
@@ -217,7 +251,7 @@ with st.sidebar:
 
     # Modified: Explicitly resets history when starting a fresh quiz
     if st.button("🧠 Start New Quiz"):
-        if st.session_state.text:
+        if has_source():
             reset_quiz_state() # Clear previous history
             load_new_batch()
         else:
@@ -240,6 +274,10 @@ if st.session_state.summary:
     with st.expander("📌 Summary", expanded=True):
         st.write(st.session_state.summary)
 
+if st.session_state.get("stream_batch"):
+    st.session_state.stream_batch = False
+    stream_new_batch()
+
 if st.session_state.quiz:
     st.subheader("📝 Quiz")
     
@@ -314,7 +352,7 @@ if st.session_state.summary or st.session_state.quiz:
         if st.session_state.summary:
             if st.button("Save Summary"):
                 if save_to_google_docs("AI Tutor - Summary", summary=st.session_state.summary):
-                    st.success("Summary saved!")
+                    st.success("Summary queued for Google Docs!")
                 else:
                     st.error("Save failed.")
 
@@ -322,7 +360,7 @@ if st.session_state.summary or st.session_state.quiz:
         if current_results:
             if st.button("Save Quiz"):
                 if save_to_google_docs("AI Tutor - Quiz Attempt", quiz_results=current_results):
-                    st.success("Quiz saved!")
+                    st.success("Quiz queued for Google Docs!")
                 else:
                     st.error("Save failed.")
 
@@ -330,6 +368,8 @@ if st.session_state.summary or st.session_state.quiz:
         if st.session_state.summary and current_results:
             if st.button("Save Both"):
                 if save_to_google_docs("AI Tutor - Full Session", summary=st.session_state.summary, quiz_results=current_results):
-                    st.success("Full session saved!")
+                    st.success("Full session queued for Google Docs!")
                 else:
-                    st.error("Save failed.")
\ No newline at end of file
+                    st.error("Save failed.")
+
+    show_exports()
@@ -0,0 +1,282 @@
+"""
+Central scheduler for the shared Gemini / Groq quotas.
+
+Every LLM call takes a token from the bucket of its (API key, model) before
+it is sent. Waiting calls are served by priority, so interactive chat goes
+ahead of quiz prefetch and roadmaps. A 429 opens a circuit for that bucket:
+calls fail fast for the retry period the provider gave, instead of retrying
+into the limit. The router then moves on to a provider with spare quota.
+"""
+import hashlib
+import heapq
+import itertools
+import os
+import random
+import re
+import threading
+import time
+
+# ----------------- Priorities -----------------
+
+INTERACTIVE = 0   # chat answers, internet search
+BATCH = 1         # quiz batches, summaries
+BACKGROUND = 2    # roadmaps, prefetch
+
+FEATURE_PRIORITY = {
+    "chat": INTERACTIVE,
+    "search": INTERACTIVE,
+    "quiz": BATCH,
+    "summary": BATCH,
+    "roadmap": BACKGROUND,
+}
+
+# How long a call may wait in the queue before giving up, per priority
+QUEUE_TIMEOUT = {INTERACTIVE: 20.0, BATCH: 60.0, BACKGROUND: 120.0}
+# Lower priority work is shed once this many calls already wait on a bucket
+MAX_QUEUED = {INTERACTIVE: 50, BATCH: 20, BACKGROUND: 10}
+
+# ----------------- Quotas -----------------
+
+# Requests per minute per key and model (free tier defaults).
+# Override with LLM_RPM="gemini-2.5-flash=10,llama-3.1-8b-instant=30".
+DEFAULT_RPM = {
+    "gemini-2.5-flash": 10,
+    "gemini-2.5-flash-lite": 15,
+    "gemini-flash-latest": 10,
+    "llama-3.1-8b-instant": 30,
+    "llama-3.3-70b-versatile": 30,
+}
+FALLBACK_RPM = 10
+BURST_SECONDS = 6
+
+DEFAULT_COOLDOWN = 30.0
+
+
+def _rpm_table():
+    table = dict(DEFAULT_RPM)
+    for item in filter(None, os.getenv("LLM_RPM", "").split(",")):
+        model, _, rpm = item.partition("=")
+        table[model.strip()] = float(rpm)
+    return table
+
+
+RPM = _rpm_table()
+
+
+class QuotaExhausted(Exception):
+    """Raised instead of sending a call that would hit a rate limit."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+_RATE_LIMIT_STATUS = re.compile(r"\b429\b|\bRESOURCE_EXHAUSTED\b")
+
+
+def _status_code(error):
+    """HTTP status of a provider error: google-genai sets .code, groq / httpx .status_code."""
+    for candidate in (error, getattr(error, "response", None)):
+        for attr in ("status_code", "code"):
+            value = getattr(candidate, attr, None)
+            if isinstance(value, int):
+                return value
+    return None
+
+
+def is_rate_limit_error(error) -> bool:
+    """
+    True for a provider's 429 / RESOURCE_EXHAUSTED. Other errors that merely
+    mention a quota (an invalid key, a billing message) do not count.
+    """
+    while error is not None:
+        status = _status_code(error)
+        if status is not None:
+            return status == 429
+        # Errors rewrapped by LangChain keep only the status line of the original
+        if _RATE_LIMIT_STATUS.search(str(error)):
+            return True
+        error = error.__cause__
+    return False
+
+
+_RETRY_PATTERNS = (
+    re.compile(r"retry(?:_?delay)?['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", re.IGNORECASE),
+    re.compile(r"(?:retry|try again) in (\d+(?:\.\d+)?)\s*s", re.IGNORECASE),
+    re.compile(r"(?:retry|try again) in (\d+)m(\d+(?:\.\d+)?)s", re.IGNORECASE),
+)
+
+
+def retry_after_from_error(error):
+    """The wait a provider asked for in its 429 message, in seconds, if it said."""
+    text = str(error)
+    for pattern in _RETRY_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            groups = match.groups()
+            if len(groups) == 2:
+                return int(groups[0]) * 60 + float(groups[1])
+            return float(groups[0])
+    return None
+
+
+def fingerprint(api_key) -> str:
+    # Buckets are per key, but the key itself is never kept
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:12]
+
+
+# ----------------- Buckets -----------------
+
+class _Bucket:
+    def __init__(self, rpm: float):
+        self.rate = rpm / 60.0
+        self.capacity = max(1.0, self.rate * BURST_SECONDS)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.waiters = []
+        self.open_until = 0.0
+        self.rate_limited = 0
+        self.served = 0
+        self.shed = 0
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until_token(self, now) -> float:
+        self.refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class QuotaScheduler:
+    def __init__(self):
+        self._buckets = {}
+        # Per-bucket rates that override RPM, e.g. for a FakeProvider
+        self._rates = {}
+        self._cond = threading.Condition()
+        self._sequence = itertools.count()
+
+    def _bucket(self, key):
+        if key not in self._buckets:
+            self._buckets[key] = _Bucket(self._rates.get(key, RPM.get(key[1], FALLBACK_RPM)))
+        return self._buckets[key]
+
+    def set_rpm(self, key, rpm: float) -> None:
+        """Give one (key fingerprint, model) bucket its own rate instead of the model's RPM."""
+        with self._cond:
+            self._rates[key] = rpm
+            self._buckets.pop(key, None)
+
+    def acquire(self, key, priority: int = INTERACTIVE, timeout=None) -> None:
+        """
+        Block until the (key fingerprint, model) bucket has a token for this call.
+
+        Raises QuotaExhausted when the circuit is open, the queue is too long
+        for this priority, or the wait would exceed the timeout.
+        """
+        if key is None:
+            return
+        timeout = QUEUE_TIMEOUT[priority] if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        with self._cond:
+            bucket = self._bucket(key)
+            if len(bucket.waiters) >= MAX_QUEUED[priority]:
+                bucket.shed += 1
+                raise QuotaExhausted(f"Too many queued requests for {key[1]}", retry_after=5)
+
+            entry = (priority, next(self._sequence))
+            heapq.heappush(bucket.waiters, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if bucket.open_until > now:
+                        raise QuotaExhausted(
+                            f"{key[1]} is rate limited", retry_after=bucket.open_until - now
+                        )
+
+                    if bucket.waiters[0] == entry:
+                        wait = bucket.time_until_token(now)
+                        if wait <= 0:
+                            bucket.tokens -= 1
+                            bucket.served += 1
+                            return
+                    else:
+                        wait = deadline - now
+
+                    remaining = deadline - now
+                    if remaining <= 0 or (bucket.waiters[0] == entry and wait > remaining):
+                        bucket.shed += 1
+                        raise QuotaExhausted(f"Quota for {key[1]} is busy", retry_after=wait)
+                    self._cond.wait(min(wait, remaining))
+            finally:
+                bucket.waiters.remove(entry)
+                heapq.heapify(bucket.waiters)
+                self._cond.notify_all()
+
+    def report_rate_limited(self, key, retry_after=None) -> None:
+        """A provider returned 429: empty the bucket and open the circuit for the cooldown."""
+        if key is None:
+            return
+        cooldown = retry_after if retry_after is not None else DEFAULT_COOLDOWN
+        # Jitter so every node does not come back at the same instant
+        cooldown *= random.uniform(1.0, 1.2)
+        with self._cond:
+            bucket = self._bucket(key)
+            bucket.tokens = 0
+            bucket.updated = time.monotonic()
+            bucket.open_until = max(bucket.open_until, time.monotonic() + cooldown)
+            bucket.rate_limited += 1
+            self._cond.notify_all()
+
+    def is_open(self, key) -> bool:
+        if key is None:
+            return False
+        with self._cond:
+            return self._bucket(key).open_until > time.monotonic()
+
+    def has_capacity(self, key) -> bool:
+        """True when a call on this bucket would go out right now (used before hedging)."""
+        if key is None:
+            return True
+        with self._cond:
+            bucket = self._bucket(key)
+            now = time.monotonic()
+            return (
+                bucket.open_until <= now
+                and not bucket.waiters
+                and bucket.time_until_token(now) <= 0
+            )
+
+    def status(self) -> dict:
+        with self._cond:
+            now = time.monotonic()
+            for bucket in self._buckets.values():
+                bucket.refill(now)
+            return {
+                f"{model} ({key_fingerprint})": {
+                    "queued": len(bucket.waiters),
+                    "tokens": round(bucket.tokens, 2),
+                    "circuit_open_for": max(0.0, round(bucket.open_until - now, 1)),
+                    "served": bucket.served,
+                    "rate_limited": bucket.rate_limited,
+                    "shed": bucket.shed,
+                }
+                for (key_fingerprint, model), bucket in self._buckets.items()
+            }
+
+    def pressure(self, keys) -> str:
+        """'ok', 'busy' (calls are queueing) or 'throttled' (every given bucket is rate limited)."""
+        with self._cond:
+            now = time.monotonic()
+            buckets = [self._buckets[key] for key in keys if key in self._buckets]
+            if not buckets:
+                return "ok"
+            if all(b.open_until > now for b in buckets):
+                return "throttled"
+            if any(b.waiters or b.open_until > now for b in buckets):
+                return "busy"
+            return "ok"
+
+
+scheduler = QuotaScheduler()
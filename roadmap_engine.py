@@ -0,0 +1,207 @@
+import contextvars
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+
+import llm_providers
+from cache_policy import bounded_cache
+
+# Long learning paths, generated outline first and then phase by phase.
+# One prompt for a year-long plan is slow, gets truncated and is lost as a
+# whole on any error; phases are small, run side by side and are cached.
+
+ROADMAP_SYSTEM_INSTRUCTION = (
+    "You are an expert Educational Consultant and Study Architect. "
+    "Your goal is to create highly structured, realistic, and actionable learning paths. "
+    "Always provide a structured schedule (e.g., Week 1, Week 2)"
+    "include verified external links for study materials with Header as (Relevant Links: link.xyz) which should open when clicked"
+    "Format the output in clear Markdown."
+)
+
+DURATION_WEEKS = {
+    "1 Week (Crash Course)": 1,
+    "2 Weeks": 2,
+    "4 Weeks (1 Month)": 4,
+    "8 Weeks (2 Months)": 8,
+    "12 Weeks (3 Months)": 12,
+    "6 Months": 26,
+    "1 Year": 52,
+}
+# Plans at least this long are generated outline first
+OUTLINE_MIN_WEEKS = int(os.getenv("ROADMAP_OUTLINE_MIN_WEEKS", "12"))
+# Phases expanded at the same time; the quota scheduler still paces the calls
+PHASE_WORKERS = int(os.getenv("ROADMAP_PHASE_WORKERS", "4"))
+# Cached phases and outlines stay valid for a day
+ROADMAP_CACHE_TTL = 24 * 3600
+
+OUTLINE_PROMPT = """
+Plan a {weeks}-week learning path for a student learning '{topic}' within the subject of '{subject}'.
+
+User Profile:
+- Current Knowledge: {knowledge}
+- Time Commitment: {hours} hours per week.
+
+Split the {weeks} weeks into {phase_count} consecutive phases that together cover every week exactly once.
+For each phase give a short title, its first and last week, and 2-4 learning goals.
+Return ONLY JSON.
+"""
+
+OUTLINE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "phases": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "title": {"type": "STRING"},
+                    "start_week": {"type": "INTEGER"},
+                    "end_week": {"type": "INTEGER"},
+                    "goals": {"type": "ARRAY", "items": {"type": "STRING"}},
+                },
+                "required": ["title", "start_week", "end_week", "goals"],
+            },
+        }
+    },
+    "required": ["phases"],
+}
+
+PHASE_PROMPT = """
+This is one phase of a {weeks}-week learning path on '{topic}' ({subject}) for a student who is: {knowledge},
+studying {hours} hours per week.
+
+Full outline, for context only:
+{outline}
+
+Write ONLY the phase "{title}" covering Week {start_week} to Week {end_week}. Its goals: {goals}.
+
+Requirements:
+1. One Markdown section per week (e.g. "#### Week {start_week}"), no introduction or conclusion for the whole plan.
+2. For each week, define specific Learning Objectives and Topics to cover.
+3. Provide high-quality, free online resources (URLs to documentation, video tutorials, courses) for each topic.
+4. Include a "Practical Exercise" or "Project" for each week.
+5. The links should be visible and not embedded into any text.
+"""
+
+
+@dataclass(frozen=True)
+class RoadmapRequest:
+    subject: str
+    topic: str
+    knowledge: str
+    duration: str
+    hours_per_week: int
+
+    @property
+    def weeks(self) -> int:
+        return DURATION_WEEKS.get(self.duration, 4)
+
+
+@dataclass
+class PhaseSection:
+    index: int
+    title: str
+    start_week: int
+    end_week: int
+    text: str
+    links: list = field(default_factory=list)
+
+
+def needs_outline(request: RoadmapRequest) -> bool:
+    return request.weeks >= OUTLINE_MIN_WEEKS
+
+
+def phase_count(weeks: int) -> int:
+    # About a month per phase, between 3 and 12 phases
+    return max(3, min(12, round(weeks / 4)))
+
+
+def _validate_outline(phases, weeks: int):
+    """Keeps phases in week order and clamps them so the weeks are covered once."""
+    phases = sorted(
+        (p for p in phases if p.get("title") and isinstance(p.get("start_week"), int)),
+        key=lambda p: p["start_week"],
+    )
+    if not phases:
+        raise ValueError("The outline came back empty, please try again.")
+
+    next_week = 1
+    for i, phase in enumerate(phases):
+        phase["start_week"] = next_week
+        last = weeks if i == len(phases) - 1 else phases[i + 1]["start_week"] - 1
+        phase["end_week"] = max(next_week, min(last, weeks))
+        next_week = phase["end_week"] + 1
+    return [p for p in phases if p["start_week"] <= weeks]
+
+
+@bounded_cache("roadmap_outlines", ttl=ROADMAP_CACHE_TTL)
+def generate_outline(request: RoadmapRequest) -> list:
+    prompt = OUTLINE_PROMPT.format(
+        weeks=request.weeks,
+        topic=request.topic,
+        subject=request.subject,
+        knowledge=request.knowledge,
+        hours=request.hours_per_week,
+        phase_count=phase_count(request.weeks),
+    )
+    response = llm_providers.generate("roadmap", prompt, json_schema=OUTLINE_SCHEMA)
+    return _validate_outline(json.loads(response.text)["phases"], request.weeks)
+
+
+def _outline_text(outline) -> str:
+    return "\n".join(
+        f"- Weeks {p['start_week']}-{p['end_week']}: {p['title']}" for p in outline
+    )
+
+
+@bounded_cache("roadmap_phases", ttl=ROADMAP_CACHE_TTL)
+def expand_phase(request: RoadmapRequest, outline_key: str, index: int, _outline=None) -> PhaseSection:
+    """One phase written out week by week. Cached per request, outline and phase."""
+    phase = _outline[index]
+    prompt = PHASE_PROMPT.format(
+        weeks=request.weeks,
+        topic=request.topic,
+        subject=request.subject,
+        knowledge=request.knowledge,
+        hours=request.hours_per_week,
+        outline=outline_key,
+        title=phase["title"],
+        start_week=phase["start_week"],
+        end_week=phase["end_week"],
+        goals="; ".join(phase.get("goals", [])),
+    )
+    response = llm_providers.generate(
+        "roadmap", prompt, system=ROADMAP_SYSTEM_INSTRUCTION, use_search=True
+    )
+    return PhaseSection(
+        index=index,
+        title=phase["title"],
+        start_week=phase["start_week"],
+        end_week=phase["end_week"],
+        text=response.text,
+        links=response.links,
+    )
+
+
+def expand_phases(request: RoadmapRequest, outline, max_workers: int = PHASE_WORKERS):
+    """
+    Yields (index, PhaseSection or Exception) as each phase finishes, in completion order.
+
+    A failed phase does not stop the others; rerunning only redoes the phases
+    that are not cached yet.
+    """
+    outline_key = _outline_text(outline)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="roadmap-phase") as pool:
+        # copy_context keeps the caller's usage_ledger session on the phase calls
+        futures = {
+            pool.submit(contextvars.copy_context().run, expand_phase, request, outline_key, index,
+                        _outline=outline): index
+            for index in range(len(outline))
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                yield index, future.result()
+            except Exception as e:
+                yield index, e
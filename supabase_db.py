@@ -1,11 +1,42 @@
-import streamlit as st
 import os
+import io
 import uuid
+import time
+import base64
+import pickle
+import zipfile
 import tempfile
 import shutil
+import json
+import hashlib
+import faiss
+import requests
 from dotenv import load_dotenv
 from supabase import create_client, Client
 from langchain_community.vectorstores import FAISS
+from vector_compression import (
+    DEFAULT_VECTOR_ENCODING,
+    applied_encoding,
+    compress_vector_db,
+    index_meta,
+    measure_recall,
+    merge_vector_dbs,
+)
+from embedding_models import (
+    DEFAULT_MODEL,
+    INDEX_META_FILE,
+    LEGACY_MODEL,
+    SMALL_DOCUMENT_CHARS,
+    SMALL_DOCUMENT_MODEL,
+    load_index,
+    model_of,
+)
+
+# Indexes above this size are uploaded in resumable chunks (Supabase's TUS
+# endpoint requires exactly 6 MB chunks).
+RESUMABLE_UPLOAD_THRESHOLD = int(os.getenv("RESUMABLE_UPLOAD_THRESHOLD", str(6 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 6 * 1024 * 1024
+UPLOAD_CHUNK_RETRIES = 5
 
 # ----------------- Supabase client setup -----------------
 
@@ -20,92 +51,482 @@ if SUPABASE_URL is None or SUPABASE_KEY is None:
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface.embeddings import HuggingFaceEmbeddings
-embeddings = HuggingFaceEmbeddings(
-    model_name="sentence-transformers/all-mpnet-base-v2"
-)
+
+# ----------------- Storage layout -----------------
+#
+#   stores/{db_id}.zip                 base index (version 0)
+#   stores/{db_id}/delta_{n}.zip       chunks appended in version n
+#   stores/{db_id}/manifest.json       {"version": n, "deltas": [...], "embedding_model": id}
+#   stores/{db_id}/study_pack.json     summary + quiz question bank (optional)
+#   dedupe/{content_key}.json          {"db_id": id} of the shared index for a document
+#   dedupe/{content_key}/refs/{db_id}  one empty marker per ID that reads it
+#
+# Each zip holds index.faiss + index.pkl and, for newer uploads, index_meta.json
+# (embedding model, vector encoding, dimension, recall of the compact index).
+#
+# Older DBs may have no manifest or no model in it; they were all built with
+# LEGACY_MODEL and load exactly as before.
+
+def _base_path(db_id: str) -> str:
+    return f"stores/{db_id}.zip"
+
+
+def _manifest_path(db_id: str) -> str:
+    return f"stores/{db_id}/manifest.json"
+
+
+def _delta_path(db_id: str, version: int) -> str:
+    return f"stores/{db_id}/delta_{version}.zip"
+
+
+def _study_pack_path(db_id: str) -> str:
+    return f"stores/{db_id}/study_pack.json"
+
+
+def _content_path(content_key: str) -> str:
+    return f"dedupe/{content_key}.json"
+
+
+def _ref_path(content_key: str, db_id: str) -> str:
+    return f"dedupe/{content_key}/refs/{db_id}"
+
+
+def serialize_vector_db(vectordb: FAISS, meta=None) -> bytes:
+    """
+    Zip a FAISS index in memory, in the same layout save_local + make_archive produce.
+
+    index.faiss is faiss.serialize_index and index.pkl is the (docstore,
+    index_to_docstore_id) pickle, so existing loaders read it unchanged.
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("index.faiss", faiss.serialize_index(vectordb.index).tobytes())
+        archive.writestr("index.pkl", pickle.dumps((vectordb.docstore, vectordb.index_to_docstore_id)))
+        if meta is not None:
+            archive.writestr(INDEX_META_FILE, json.dumps(meta))
+    return buffer.getvalue()
+
+
+def _upload_vector_db(vectordb: FAISS, storage_path: str, progress=None, meta=None) -> None:
+    """Serialize a FAISS index in memory and upload it to storage_path."""
+    data = serialize_vector_db(vectordb, meta)
+
+    bytes_total = len(data)
+    if progress is not None:
+        progress("uploading", bytes_uploaded=0, bytes_total=bytes_total)
+
+    if bytes_total > RESUMABLE_UPLOAD_THRESHOLD:
+        _resumable_upload(storage_path, data, progress)
+    else:
+        supabase.storage.from_(BUCKET_NAME).upload(
+            path=storage_path,
+            file=data,
+            file_options={"content-type": "application/zip"},
+        )
+
+    if progress is not None:
+        progress("uploading", bytes_uploaded=bytes_total, bytes_total=bytes_total)
+
+
+# ----------------- Resumable upload -----------------
+#
+# Large indexes go through Supabase's TUS endpoint in fixed size chunks. A
+# dropped connection only re-sends from the last offset the server confirmed.
+
+def _tus_headers(**extra) -> dict:
+    headers = {
+        "authorization": f"Bearer {SUPABASE_KEY}",
+        "apikey": SUPABASE_KEY,
+        "tus-resumable": "1.0.0",
+    }
+    headers.update(extra)
+    return headers
+
+
+def _tus_metadata(storage_path: str) -> str:
+    fields = {
+        "bucketName": BUCKET_NAME,
+        "objectName": storage_path,
+        "contentType": "application/zip",
+    }
+    return ",".join(
+        f"{key} {base64.b64encode(value.encode('utf-8')).decode('ascii')}"
+        for key, value in fields.items()
+    )
+
+
+def _resumable_upload(storage_path: str, data: bytes, progress=None) -> None:
+    endpoint = f"{SUPABASE_URL}/storage/v1/upload/resumable"
+    created = requests.post(
+        endpoint,
+        headers=_tus_headers(**{
+            "upload-length": str(len(data)),
+            "upload-metadata": _tus_metadata(storage_path),
+            "x-upsert": "false",
+        }),
+        timeout=30,
+    )
+    created.raise_for_status()
+    upload_url = created.headers["location"]
+
+    offset, failures = 0, 0
+    while offset < len(data):
+        chunk = data[offset:offset + UPLOAD_CHUNK_SIZE]
+        try:
+            response = requests.patch(
+                upload_url,
+                data=chunk,
+                headers=_tus_headers(**{
+                    "upload-offset": str(offset),
+                    "content-type": "application/offset+octet-stream",
+                }),
+                timeout=120,
+            )
+            response.raise_for_status()
+            offset = int(response.headers["upload-offset"])
+            failures = 0
+        except requests.RequestException:
+            failures += 1
+            if failures > UPLOAD_CHUNK_RETRIES:
+                raise
+            time.sleep(2 ** failures)
+            # Ask the server how much it actually kept before resending
+            head = requests.head(upload_url, headers=_tus_headers(), timeout=30)
+            head.raise_for_status()
+            offset = int(head.headers["upload-offset"])
+
+        if progress is not None:
+            progress("uploading", bytes_uploaded=offset, bytes_total=len(data))
+
+
+def _download_vector_db(storage_path: str) -> FAISS:
+    """Download a zipped FAISS index from storage_path and load it with the model that built it."""
+    file_bytes = supabase.storage.from_(BUCKET_NAME).download(storage_path)
+
+    tmp_dir = tempfile.mkdtemp()
+    zip_path = os.path.join(tmp_dir, "index.zip")
+
+    try:
+        with open(zip_path, "wb") as f:
+            f.write(file_bytes)
+
+        shutil.unpack_archive(zip_path, tmp_dir)
+
+        return load_index(tmp_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def load_manifest(db_id: str) -> dict:
+    try:
+        raw = supabase.storage.from_(BUCKET_NAME).download(_manifest_path(db_id))
+    except Exception:
+        return {"version": 0, "deltas": []}
+    return json.loads(raw)
+
+
+def _save_manifest(db_id: str, manifest: dict) -> None:
+    supabase.storage.from_(BUCKET_NAME).upload(
+        path=_manifest_path(db_id),
+        file=json.dumps(manifest).encode("utf-8"),
+        file_options={"content-type": "application/json", "upsert": "true"},
+    )
+
+
+def get_vector_db_version(db_id: str) -> int:
+    return load_manifest(db_id)["version"]
+
+
+def _object_exists(path: str) -> bool:
+    folder, _, name = path.rpartition("/")
+    entries = supabase.storage.from_(BUCKET_NAME).list(folder, {"search": name})
+    return any(entry["name"] == name for entry in entries)
+
+
+def vector_db_exists(db_id: str) -> bool:
+    """True if db_id has a base index (its own, or the shared one of a deduplicated ID)."""
+    manifest = load_manifest(db_id)
+    if manifest.get("deleted"):
+        return False
+    return _object_exists(_base_path(manifest.get("base_id", db_id)))
+
+
+def get_embedding_model(db_id: str) -> str:
+    """The model a DB was built with; appends must be embedded with the same one."""
+    return load_manifest(db_id).get("embedding_model", LEGACY_MODEL)
 
 
 # ----------------- Save vector DB -----------------
 
-def save_vector_db_to_supabase(vectordb: FAISS) -> str:
+def new_db_id() -> str:
+    return str(uuid.uuid4())
+
+
+def save_vector_db_to_supabase(vectordb: FAISS, progress=None, vector_encoding=DEFAULT_VECTOR_ENCODING,
+                               db_id=None) -> str:
     """
     Save a FAISS vector DB to Supabase Storage.
 
+    vector_encoding ("float32", "float16", "int8", "pca256", ...) shrinks the
+    uploaded index; the recall it keeps versus float32 is stored with it and
+    reported through progress("encoding", recall=...).
+
+    db_id can be reserved up front with new_db_id(), so the ID is handed out
+    while the upload is still running.
+
     Returns:
         db_id (str): unique ID that you can give to the user.
                      Later you can use this id to load the vector DB again.
     """
-    # 1. Save FAISS index to a temporary directory
-    tmp_dir = tempfile.mkdtemp()
-    zip_path = None
+    recall = None
+    # pca falls back to float16 on small indexes; record what was really applied
+    vector_encoding = applied_encoding(vectordb, vector_encoding)
+    if vector_encoding != "float32":
+        compact = compress_vector_db(vectordb, vector_encoding)
+        recall = measure_recall(vectordb, compact)
+        if progress is not None:
+            progress("encoding", vector_encoding=vector_encoding, recall=recall)
+        vectordb = compact
 
-    try:
-        # This will create index files in tmp_dir
-        vectordb.save_local(tmp_dir)
+    db_id = db_id or new_db_id()
+    _upload_vector_db(
+        vectordb, _base_path(db_id), progress,
+        meta=index_meta(vectordb, vector_encoding, recall),
+    )
+    # Appends read the model from here instead of downloading the base index
+    _save_manifest(db_id, {
+        "version": 0,
+        "deltas": [],
+        "embedding_model": model_of(vectordb.embedding_function),
+    })
 
-        # 2. Zip the directory into one file
-        zip_base = os.path.join(tempfile.gettempdir(), str(uuid.uuid4()))
-        zip_path = shutil.make_archive(zip_base, "zip", tmp_dir)  
+    # That db_id is all the user needs
+    return db_id
 
-        # 3. Generate a unique ID for this vector DB
-        db_id = str(uuid.uuid4())
 
-        # 4. Define storage path inside the bucket 
-        storage_path = f"stores/{db_id}.zip"
+# ----------------- Study pack -----------------
 
-        # 5. Upload the zip file to Supabase Storage
-        with open(zip_path, "rb") as f:
-            supabase.storage.from_(BUCKET_NAME).upload(
-            path=storage_path,
-            file=f,
+def save_study_pack(db_id: str, study_pack: dict) -> None:
+    supabase.storage.from_(BUCKET_NAME).upload(
+        path=_study_pack_path(db_id),
+        file=json.dumps(study_pack).encode("utf-8"),
+        file_options={"content-type": "application/json", "upsert": "true"},
     )
 
-        # That db_id is all the user needs
-        return db_id
 
-    finally:
-        # Cleanup temporary files and directory
-        shutil.rmtree(tmp_dir, ignore_errors=True)
-        if zip_path and os.path.exists(zip_path):
-            try:
-                os.remove(zip_path)
-            except OSError:
-                pass
+def load_study_pack(db_id: str):
+    """The stored summary and question bank of a DB, or None if it was ingested without one."""
+    try:
+        return json.loads(supabase.storage.from_(BUCKET_NAME).download(_study_pack_path(db_id)))
+    except Exception:
+        pass
+    # A deduplicated ID shares the pack of the index it points to
+    base_id = load_manifest(db_id).get("base_id")
+    if base_id is None:
+        return None
+    try:
+        return json.loads(supabase.storage.from_(BUCKET_NAME).download(_study_pack_path(base_id)))
+    except Exception:
+        return None
 
 
-# ----------------- Load vector DB -----------------
+def text_from_vector_db(vectordb: FAISS) -> str:
+    """The chunk texts of an index in insertion order, for DBs that have no study pack."""
+    ids = [vectordb.index_to_docstore_id[i] for i in sorted(vectordb.index_to_docstore_id)]
+    return "\n".join(vectordb.docstore.search(doc_id).page_content for doc_id in ids)
+
+
+class VectorDBNotFound(FileNotFoundError):
+    """No vector DB is stored under this ID: never created, deleted, or mistyped."""
 
-def load_vector_db_from_supabase(db_id: str, embeddings) -> FAISS:
 
-    # 1. Compute storage path from id 
-    storage_path = f"stores/{db_id}.zip"
+# ----------------- Append to vector DB -----------------
 
-    # 2. Download zip from Supabase Storage
+def append_to_vector_db_in_supabase(db_id: str, new_vectordb: FAISS) -> int:
+    """
+    Add the chunks of new_vectordb to an existing DB without re-uploading it.
+
+    Only the new chunks are uploaded, as a versioned delta next to the base
+    index, so readers keep using the same db_id.
+
+    Returns:
+        version (int): the version of the DB after the append.
+    """
+    # load_manifest has a default for unknown IDs, so a typo would otherwise
+    # leave an orphan manifest and deltas behind
+    if not vector_db_exists(db_id):
+        raise VectorDBNotFound(f"No vector DB with id {db_id}")
+    manifest = load_manifest(db_id)
+    embedding_model = manifest.get("embedding_model", LEGACY_MODEL)
+    if model_of(new_vectordb.embedding_function) != embedding_model:
+        raise ValueError(f"{db_id} was built with {embedding_model}; embed the new file with the same model")
+    version = manifest["version"] + 1
+    delta_path = _delta_path(db_id, version)
+
+    # Upload is not an upsert: two concurrent appends cannot both claim
+    # the same version, the second one fails here instead of being lost.
+    _upload_vector_db(new_vectordb, delta_path, meta=index_meta(new_vectordb, "float32"))
+
+    manifest["version"] = version
+    manifest["deltas"].append(delta_path)
+    _save_manifest(db_id, manifest)
+    return version
+
+
+# ----------------- Load vector DB -----------------
+
+def load_vector_db_from_supabase(db_id: str) -> FAISS:
+    """Raises VectorDBNotFound when there is no index under db_id."""
+    manifest = load_manifest(db_id)
+    if manifest.get("deleted"):
+        raise VectorDBNotFound(f"No vector DB with id {db_id}")
+
+    # 1. Download and load the base index, which a deduplicated ID shares
     try:
-        file_bytes = supabase.storage.from_(BUCKET_NAME).download(storage_path)
+        vectordb = _download_vector_db(_base_path(manifest.get("base_id", db_id)))
     except Exception as e:
-        st.error(f"Could not fetch file for id: {db_id}")
-        st.error("Please Enter a valid ID or upload a file to get a new ID")
-        return
-        
-        
-    # 3. Write bytes to a temporary zip and extract
-    tmp_dir = tempfile.mkdtemp()
-    zip_path = os.path.join(tmp_dir, "index.zip")
+        raise VectorDBNotFound(f"Could not fetch file for id: {db_id}") from e
 
-    with open(zip_path, "wb") as f:
-        f.write(file_bytes)
+    # 2. Apply the appended deltas in order
+    for delta_path in manifest["deltas"]:
+        merge_vector_dbs(vectordb, _download_vector_db(delta_path))
 
-    shutil.unpack_archive(zip_path, tmp_dir)
+    return vectordb
 
-    # 4. Load FAISS from the extracted folder
-    vectordb = FAISS.load_local(
-        tmp_dir,
-        embeddings,
-        allow_dangerous_deserialization=True,
+
+# ----------------- Deduplication -----------------
+#
+# The same course PDF uploaded by many students is embedded and stored once.
+# Each upload still gets its own ID: a manifest whose base_id points at the
+# shared index. Base indexes are never modified, so appends to any of these
+# IDs go to that ID's own deltas. Every ID holds a ref marker under the
+# content key, and the shared files are removed with the last one.
+
+# Bump when chunking or embedding changes so old entries stop matching
+DEDUPE_VERSION = 1
+
+
+def content_key(file_bytes: bytes, mode_of_file: str, vector_encoding: str) -> str:
+    """Hash of a document plus every setting that changes the index built from it."""
+    settings = {
+        "version": DEDUPE_VERSION,
+        "mode_of_file": mode_of_file,
+        "vector_encoding": vector_encoding,
+        "models": [DEFAULT_MODEL, SMALL_DOCUMENT_MODEL, SMALL_DOCUMENT_CHARS],
+    }
+    digest = hashlib.sha256(file_bytes)
+    digest.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _refs(content_key: str) -> list:
+    entries = supabase.storage.from_(BUCKET_NAME).list(f"dedupe/{content_key}/refs")
+    return [entry["name"] for entry in entries]
+
+
+def _add_ref(content_key: str, db_id: str) -> None:
+    supabase.storage.from_(BUCKET_NAME).upload(
+        path=_ref_path(content_key, db_id),
+        file=b"",
+        file_options={"content-type": "text/plain", "upsert": "true"},
     )
-    shutil.rmtree(tmp_dir, ignore_errors=True)
-    return vectordb
 
+
+def find_shared_index(content_key: str):
+    """db_id of the index already built for this content, or None."""
+    try:
+        raw = supabase.storage.from_(BUCKET_NAME).download(_content_path(content_key))
+    except Exception:
+        return None
+    return json.loads(raw)["db_id"]
+
+
+def _claim_content(content_key: str, db_id: str) -> bool:
+    try:
+        # Not an upsert: the first upload to finish wins
+        supabase.storage.from_(BUCKET_NAME).upload(
+            path=_content_path(content_key),
+            file=json.dumps({"db_id": db_id, "created_at": time.time()}).encode("utf-8"),
+            file_options={"content-type": "application/json"},
+        )
+    except Exception:
+        return False
+    return True
+
+
+def register_content(db_id: str, content_key: str) -> bool:
+    """
+    Offer a freshly uploaded DB as the shared index for its content.
+
+    Returns False if a concurrent upload of the same file registered first;
+    this DB then simply stays on its own.
+    """
+    if not _claim_content(content_key, db_id):
+        return False
+
+    _add_ref(content_key, db_id)
+    manifest = load_manifest(db_id)
+    manifest["content_key"] = content_key
+    _save_manifest(db_id, manifest)
+    return True
+
+
+def create_alias(shared_id: str, content_key: str):
+    """
+    A new ID that reads the shared index of shared_id, without embedding or
+    uploading anything. Returns None if the shared index is being deleted.
+    """
+    alias_id = new_db_id()
+    _add_ref(content_key, alias_id)
+    # delete_vector_db removes the content entry before counting refs, so a
+    # ref added while the entry still exists is always seen
+    if find_shared_index(content_key) != shared_id:
+        supabase.storage.from_(BUCKET_NAME).remove([_ref_path(content_key, alias_id)])
+        return None
+
+    _save_manifest(alias_id, {
+        "version": 0,
+        "deltas": [],
+        "embedding_model": get_embedding_model(shared_id),
+        "base_id": shared_id,
+        "content_key": content_key,
+    })
+    return alias_id
+
+
+def delete_vector_db(db_id: str) -> None:
+    """Delete an ID; a shared base index is only removed once no other ID refers to it."""
+    bucket = supabase.storage.from_(BUCKET_NAME)
+    manifest = load_manifest(db_id)
+    base_id = manifest.get("base_id", db_id)
+    content_key = manifest.get("content_key")
+    own_files = list(manifest["deltas"]) + [_study_pack_path(db_id), _manifest_path(db_id)]
+
+    if content_key is None:
+        bucket.remove(own_files + [_base_path(db_id)])
+        return
+
+    bucket.remove([_ref_path(content_key, db_id)])
+    if not _refs(content_key):
+        bucket.remove([_content_path(content_key)])
+        if not _refs(content_key):
+            # Last reference: the shared index goes too
+            shared_files = [_base_path(base_id), _study_pack_path(base_id), _manifest_path(base_id)]
+            bucket.remove(list(dict.fromkeys(own_files + shared_files)))
+            return
+        # An alias was created meanwhile; keep sharing
+        _claim_content(content_key, base_id)
+
+    if base_id == db_id:
+        # Other IDs still read this base index and study pack, so only the
+        # ID itself goes away
+        bucket.remove(list(manifest["deltas"]))
+        _save_manifest(db_id, {
+            "version": 0,
+            "deltas": [],
+            "embedding_model": manifest.get("embedding_model", LEGACY_MODEL),
+            "content_key": content_key,
+            "deleted": True,
+        })
+    else:
+        bucket.remove(own_files)
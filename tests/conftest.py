@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+# The modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep test calls out of the real usage ledger and away from real providers
+os.environ.setdefault("USAGE_LEDGER_PATH", os.path.join(tempfile.mkdtemp(), "usage.sqlite3"))
+os.environ.setdefault("LLM_PROVIDER_MODE", "fake")
@@ -0,0 +1,12 @@
+from chat_rendering import normalize_llm_math
+
+
+def test_latex_brackets_become_display_math():
+    assert normalize_llm_math(r"\[ x^2 + y^2 \]") == "$$\nx^2 + y^2\n$$"
+    assert normalize_llm_math(r"[ \frac{a}{b} ]") == "$$\n\\frac{a}{b}\n$$"
+
+
+def test_citations_links_and_plain_brackets_are_left_alone():
+    text = "See [1], the [docs](https://example.com) and the [optional] flag."
+
+    assert normalize_llm_math(text) == text
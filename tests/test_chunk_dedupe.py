@@ -0,0 +1,40 @@
+from langchain_core.documents import Document
+
+from chunk_dedupe import dedupe_chunks, strip_repeated_lines
+
+EXERCISE = (
+    "Exercise {n}. A train travels {km} km in {hours} hours at a constant speed. "
+    "Find its average speed and show the units in your answer."
+)
+
+
+def test_chunks_that_differ_only_in_numbers_are_kept():
+    docs = [
+        Document(EXERCISE.format(n=1, km=120, hours=2)),
+        Document(EXERCISE.format(n=2, km=300, hours=5)),
+    ]
+
+    kept, stats = dedupe_chunks(docs)
+
+    assert len(kept) == 2
+    assert stats["exact_duplicates"] == 0
+
+
+def test_whitespace_and_case_variants_are_exact_duplicates():
+    text = EXERCISE.format(n=1, km=120, hours=2)
+    docs = [Document(text), Document("  " + text.upper().replace(" ", "\n"))]
+
+    kept, stats = dedupe_chunks(docs)
+
+    assert len(kept) == 1
+    assert stats["exact_duplicates"] == 1
+    assert kept[0].metadata["duplicate_count"] == 1
+
+
+def test_numbered_footers_are_stripped_at_page_edges():
+    topics = ["Cells", "Tissues", "Organs", "Systems"]
+    pages = [Document(f"{topic} are covered here.\nPage {i} of 4") for i, topic in enumerate(topics, 1)]
+
+    strip_repeated_lines(pages)
+
+    assert [page.page_content for page in pages] == [f"{topic} are covered here." for topic in topics]
@@ -0,0 +1,115 @@
+import uuid
+
+import pytest
+
+import llm_providers
+import quiz_engine
+from context_cache import ContextCache, DocumentContext, FakeContextBackend
+from llm_providers import FakeProvider, GeminiProvider, HedgedRouter, LLMResponse, fake_quiz_reply
+
+TEXT = "Photosynthesis turns light into chemical energy. " * 600
+
+
+def contexts(**kwargs):
+    # Handle caches are looked up by name, so every test gets its own
+    return ContextCache(FakeContextBackend(**kwargs), f"test_contexts_{uuid.uuid4().hex}", min_chars=0)
+
+
+@pytest.fixture
+def routers(monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(llm_providers, "_routers", {})
+
+    def install(provider):
+        for feature in ("summary", "quiz"):
+            llm_providers.set_router(feature, HedgedRouter([provider]))
+
+    return install
+
+
+def test_one_registration_serves_summary_and_quiz_calls(routers):
+    cache = contexts()
+    sent = []
+    provider = FakeProvider(
+        f"flash-lite-{uuid.uuid4().hex[:8]}", contexts=cache,
+        reply=lambda prompt: sent.append(prompt) or fake_quiz_reply(prompt),
+    )
+    routers(provider)
+
+    quiz_engine.generate_summary(TEXT)
+    quiz_engine.generate_quiz(TEXT, [])
+    quiz_engine.generate_quiz(TEXT, [])
+
+    assert len(cache.backend.documents) == 1
+    assert provider.cached_calls == provider.calls == 3
+    # Only the task went out; the document stayed behind the handle
+    assert all(TEXT[:200] not in prompt for prompt in sent)
+
+
+def test_failed_registration_falls_back_to_the_prompt_prefix(routers):
+    cache = contexts(min_chars=10 ** 9)
+    sent = []
+    provider = FakeProvider(
+        f"flash-lite-{uuid.uuid4().hex[:8]}", contexts=cache,
+        reply=lambda prompt: sent.append(prompt) or fake_quiz_reply(prompt),
+    )
+    routers(provider)
+
+    quiz_engine.generate_summary(TEXT)
+    quiz_engine.generate_quiz(TEXT, [])
+
+    assert cache.backend.documents == {}
+    assert provider.cached_calls == 0
+    # Both calls start with the same document prefix, for implicit prefix caching
+    context = quiz_engine.document_context(TEXT)
+    assert all(prompt.startswith(context.preamble) for prompt in sent)
+    # The failure is remembered, registration is not retried on every call
+    assert cache.handles.stats["negative_hits"] >= 1
+
+
+def test_expired_handle_is_invalidated_and_the_call_retried_inline(monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    cache = contexts()
+    monkeypatch.setattr(llm_providers, "gemini_contexts", cache)
+    provider = GeminiProvider("gemini-2.5-flash-lite")
+    context = DocumentContext(TEXT)
+    calls = []
+
+    def generate(contents, system, use_search, json_schema, handle=None):
+        calls.append((contents, handle))
+        if handle is not None and len(calls) == 1:
+            raise RuntimeError("404 NOT_FOUND. CachedContent not found (or permission denied)")
+        return LLMResponse(text="ok", provider="gemini", model=provider.model, context_cached=handle is not None)
+
+    monkeypatch.setattr(provider, "_generate", generate)
+
+    response = provider.generate("Summarize the document above.", context=context)
+
+    assert response.text == "ok"
+    assert not response.context_cached
+    (first, expired_handle), (retried, retry_handle) = calls
+    assert expired_handle is not None and first == "Summarize the document above."
+    assert retry_handle is None and retried == context.prefixed("Summarize the document above.")
+
+    # The next call registers the document again instead of reusing the dead handle
+    provider.generate("Summarize the document above.", context=context)
+    assert calls[-1][1] not in (None, expired_handle)
+    assert len(cache.backend.documents) == 2
+
+
+def test_rate_limit_on_a_cached_call_is_not_retried_inline(monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    cache = contexts()
+    monkeypatch.setattr(llm_providers, "gemini_contexts", cache)
+    provider = GeminiProvider("gemini-2.5-flash-lite")
+    calls = []
+
+    def generate(contents, system, use_search, json_schema, handle=None):
+        calls.append(handle)
+        raise RuntimeError("429 RESOURCE_EXHAUSTED")
+
+    monkeypatch.setattr(provider, "_generate", generate)
+
+    with pytest.raises(RuntimeError, match="429"):
+        provider.generate("Summarize the document above.", context=DocumentContext(TEXT))
+    assert len(calls) == 1
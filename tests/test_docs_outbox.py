@@ -0,0 +1,127 @@
+import threading
+import time
+
+import pytest
+
+import docs_outbox
+from docs_outbox import DocsOutbox, backoff, stand_in_server
+
+
+@pytest.fixture
+def webhook():
+    server = stand_in_server(port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(docs_outbox, "BASE_BACKOFF", 0.05)
+    monkeypatch.setattr(docs_outbox, "POLL_SECONDS", 0.1)
+
+
+def url(server):
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def wait_for(outbox, export_id, condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        export = next(e for e in outbox.session_exports("s") if e["id"] == export_id)
+        if condition(export):
+            return export
+        time.sleep(0.02)
+    raise AssertionError(f"export never reached the expected state: {export}")
+
+
+def test_export_is_delivered(tmp_path, webhook):
+    outbox = DocsOutbox(str(tmp_path / "outbox.sqlite3"), url(webhook))
+
+    export_id = outbox.enqueue("s", "Summary", summary="text")
+
+    export = wait_for(outbox, export_id, lambda e: e["status"] == "delivered")
+    assert export["attempts"] == 1
+    assert webhook.received == [{"title": "Summary", "summary": "text"}]
+
+
+def test_server_errors_are_retried_with_backoff(tmp_path, webhook):
+    webhook.failure_rate = 1.0
+    outbox = DocsOutbox(str(tmp_path / "outbox.sqlite3"), url(webhook))
+
+    export_id = outbox.enqueue("s", "Quiz", quiz_results=[{"q": 1}])
+
+    retrying = wait_for(outbox, export_id, lambda e: e["status"] == "queued" and e["attempts"] >= 2)
+    assert "HTTP 503" in retrying["last_error"]
+    assert retrying["next_attempt_at"] > retrying["created_at"]
+
+    webhook.failure_rate = 0.0
+    delivered = wait_for(outbox, export_id, lambda e: e["status"] == "delivered")
+    assert delivered["attempts"] >= 3
+    assert len(webhook.received) == 1
+
+
+def test_backoff_doubles_up_to_the_cap():
+    assert 0.8 * docs_outbox.BASE_BACKOFF <= backoff(1) <= 1.2 * docs_outbox.BASE_BACKOFF
+    assert backoff(30) <= 1.2 * docs_outbox.MAX_BACKOFF
+    assert min(backoff(4) for _ in range(50)) > max(backoff(2) for _ in range(50))
+
+
+def test_permanent_rejection_is_not_retried(tmp_path, webhook):
+    webhook.failure_rate = 1.0
+    webhook.failure_status = 400
+    outbox = DocsOutbox(str(tmp_path / "outbox.sqlite3"), url(webhook))
+
+    export_id = outbox.enqueue("s", "Summary", summary="text")
+
+    export = wait_for(outbox, export_id, lambda e: e["status"] == "failed")
+    assert export["attempts"] == 1
+    assert "HTTP 400" in export["last_error"]
+
+
+def test_gives_up_after_max_attempts_and_can_be_retried(tmp_path, webhook, monkeypatch):
+    monkeypatch.setattr(docs_outbox, "MAX_ATTEMPTS", 3)
+    webhook.failure_rate = 1.0
+    outbox = DocsOutbox(str(tmp_path / "outbox.sqlite3"), url(webhook))
+
+    export_id = outbox.enqueue("s", "Summary", summary="text")
+    export = wait_for(outbox, export_id, lambda e: e["status"] == "failed")
+    assert export["attempts"] == 3
+
+    webhook.failure_rate = 0.0
+    outbox.retry(export_id)
+    wait_for(outbox, export_id, lambda e: e["status"] == "delivered")
+
+
+def test_export_in_flight_at_a_restart_is_sent_again(tmp_path, webhook):
+    path = str(tmp_path / "outbox.sqlite3")
+    # The first process dies while its webhook call hangs
+    hanging = stand_in_server(port=0, delay=5.0)
+    threading.Thread(target=hanging.serve_forever, daemon=True).start()
+    first = DocsOutbox(path, url(hanging))
+    export_id = first.enqueue("s", "Summary", summary="text")
+    wait_for(first, export_id, lambda e: e["status"] == "sending")
+
+    restarted = DocsOutbox(path, url(webhook))
+
+    wait_for(restarted, export_id, lambda e: e["status"] == "delivered")
+    assert webhook.received == [{"title": "Summary", "summary": "text"}]
+    hanging.shutdown()
+    hanging.server_close()
+
+
+def test_worker_survives_database_errors(tmp_path, webhook, monkeypatch):
+    outbox = DocsOutbox(str(tmp_path / "outbox.sqlite3"), url(webhook))
+    real_claim = outbox._claim_due
+    failures = iter([True, True])
+
+    def flaky_claim():
+        if next(failures, False):
+            raise RuntimeError("database is locked")
+        return real_claim()
+
+    monkeypatch.setattr(outbox, "_claim_due", flaky_claim)
+    export_id = outbox.enqueue("s", "Summary", summary="text")
+
+    wait_for(outbox, export_id, lambda e: e["status"] == "delivered")
@@ -0,0 +1,48 @@
+import time
+
+import pytest
+
+# ingest_jobs reads its default encoding from vector_compression
+pytest.importorskip("faiss")
+
+import ingest_jobs  # noqa: E402
+from ingest_jobs import IngestionQueue  # noqa: E402
+
+
+@pytest.fixture
+def queue():
+    queue = IngestionQueue(max_workers=1)
+    yield queue
+    queue._pool.shutdown()
+    queue._manager.shutdown()
+
+
+def finished(job_id, stage="done", age=0.0):
+    now = time.time()
+    return {"job_id": job_id, "file_name": "notes.pdf", "stage": stage,
+            "submitted_at": now - age, "updated_at": now - age}
+
+
+def test_finished_job_expires_after_its_result_was_read(queue, monkeypatch):
+    monkeypatch.setattr(ingest_jobs, "JOB_RESULT_TTL", 0.05)
+    queue.jobs["read"] = finished("read")
+    queue.jobs["unread"] = finished("unread")
+    queue.jobs["running"] = dict(finished("running", stage="embedding"), updated_at=0)
+
+    assert queue.status("read")["stage"] == "done"
+    time.sleep(0.1)
+    queue._prune()
+
+    assert queue.status("read") is None
+    assert queue.status("unread") is not None
+    assert queue.status("running") is not None
+
+
+def test_unread_job_expires_eventually(queue, monkeypatch):
+    monkeypatch.setattr(ingest_jobs, "JOB_UNREAD_TTL", 60)
+    queue.jobs["old"] = finished("old", stage="failed", age=120)
+    queue.jobs["new"] = finished("new", stage="failed")
+
+    queue._prune()
+
+    assert sorted(queue.jobs.keys()) == ["new"]
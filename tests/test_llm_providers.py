@@ -0,0 +1,153 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import llm_providers
+from llm_providers import FakeProvider, HedgedRouter, ProviderCancelled, lognormal_latency
+import quota_scheduler
+from quota_scheduler import BATCH, INTERACTIVE, scheduler
+
+
+def fake(name, **kwargs):
+    # Latency trackers are per model, so every test gets fresh models
+    return FakeProvider(f"{name}-{uuid.uuid4().hex[:8]}", contexts=None, **kwargs)
+
+
+class RecordingProvider(FakeProvider):
+    """Remembers whether the router cancelled its call."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cancelled = threading.Event()
+
+    def generate(self, prompt, system=None, use_search=False, cancel=None, json_schema=None, context=None):
+        try:
+            return super().generate(prompt, system, use_search, cancel, json_schema, context)
+        except ProviderCancelled:
+            self.cancelled.set()
+            raise
+
+
+def test_fast_primary_is_not_hedged():
+    primary = fake("primary", latency=lognormal_latency(0.02, 0.2))
+    backup = fake("backup", latency=lognormal_latency(0.02, 0.2))
+    router = HedgedRouter([primary, backup], default_hedge_delay=1.0)
+
+    response = router.generate("hello")
+
+    assert response.model == primary.model
+    assert not response.hedged
+    assert backup.calls == 0
+
+
+def test_slow_primary_is_hedged_to_backup():
+    primary = fake("primary", latency=lambda: 2.0)
+    backup = fake("backup", latency=lognormal_latency(0.05, 0.2))
+    router = HedgedRouter([primary, backup], default_hedge_delay=0.1)
+
+    started = time.perf_counter()
+    response = router.generate("hello")
+
+    assert response.model == backup.model
+    assert response.hedged
+    assert time.perf_counter() - started < 1.0
+
+
+def test_losing_attempt_is_cancelled():
+    primary = RecordingProvider(f"primary-{uuid.uuid4().hex[:8]}", latency=lambda: 5.0, contexts=None)
+    backup = fake("backup", latency=lognormal_latency(0.05, 0.2))
+    router = HedgedRouter([primary, backup], default_hedge_delay=0.1)
+
+    response = router.generate("hello")
+
+    assert response.model == backup.model
+    # The primary stops waiting instead of holding a hedge worker for 5 s
+    assert primary.cancelled.wait(1.0)
+
+
+def test_failed_primary_fails_over_without_waiting_for_the_hedge_delay():
+    primary = fake("primary", failure_rate=1.0)
+    backup = fake("backup", latency=lognormal_latency(0.05, 0.2))
+    router = HedgedRouter([primary, backup], default_hedge_delay=10.0)
+
+    started = time.perf_counter()
+    response = router.generate("hello")
+
+    assert response.model == backup.model
+    assert primary.tracker.failures == 1
+    assert time.perf_counter() - started < 1.0
+
+
+def test_every_provider_failing_raises_the_last_error():
+    router = HedgedRouter(
+        [fake("primary", failure_rate=1.0), fake("backup", failure_rate=1.0)],
+        default_hedge_delay=0.1,
+    )
+
+    with pytest.raises(RuntimeError, match="backup"):
+        router.generate("hello")
+
+
+def test_stream_skips_a_provider_that_fails_before_its_first_chunk():
+    primary = fake("primary", failure_rate=1.0)
+    backup = fake("backup", latency=lambda: 0.01, reply=lambda prompt: "streamed answer")
+    router = HedgedRouter([primary, backup])
+
+    assert "".join(router.stream("hello")) == "streamed answer"
+    assert primary.tracker.failures == 1
+
+
+def test_latency_history_reorders_providers():
+    slow = fake("slow", latency=lambda: 0.05)
+    fast = fake("fast", latency=lambda: 0.001)
+    for _ in range(10):
+        slow.tracker.record(0.5)
+        fast.tracker.record(0.01)
+    router = HedgedRouter([slow, fast])
+
+    assert router.ranked() == [fast, slow]
+    assert router.generate("hello").model == fast.model
+
+
+def test_call_waiting_for_quota_does_not_hold_a_hedge_worker(monkeypatch):
+    monkeypatch.setattr(llm_providers, "_hedge_pool", ThreadPoolExecutor(max_workers=1))
+    # 6 rpm: one token in the bucket, the next one ~10 s later
+    limited = fake("limited", rpm=6)
+    batch = HedgedRouter([limited], priority=BATCH)
+    batch.generate("first")
+
+    waiting = threading.Thread(target=batch.generate, args=("second",), daemon=True)
+    waiting.start()
+    time.sleep(0.1)
+
+    interactive = HedgedRouter([fake("chat")], priority=INTERACTIVE)
+    started = time.perf_counter()
+    interactive.generate("hello")
+
+    assert waiting.is_alive()
+    assert time.perf_counter() - started < 1.0
+
+
+def test_scoped_gemini_key_reaches_hedge_workers(monkeypatch):
+    monkeypatch.delenv("GEMINI_API_KEY", raising=False)
+    seen = []
+    provider = fake("keyed", reply=lambda prompt: seen.append(llm_providers.gemini_api_key()) or "ok")
+    router = HedgedRouter([provider])
+
+    with llm_providers.using_gemini_key("job-key"):
+        router.generate("hello")
+
+    assert seen == ["job-key"]
+    assert llm_providers.gemini_api_key() is None
+
+
+def test_fake_quota_stays_on_its_own_bucket():
+    limited = fake("limited", rpm=6)
+
+    scheduler.acquire(limited.quota_key())
+
+    assert limited.model not in quota_scheduler.RPM
+    assert not scheduler.has_capacity(limited.quota_key())
@@ -0,0 +1,83 @@
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+import llm_providers
+from context_cache import ContextCache, DocumentContext, FakeContextBackend
+from llm_providers import FakeProvider, GeminiProvider, HedgedRouter
+from usage_ledger import call_cost, get_ledger, set_session
+
+TEXT = "Photosynthesis turns light into chemical energy. " * 600
+
+
+@pytest.fixture
+def session():
+    session_id = f"test-{uuid.uuid4().hex}"
+    set_session(session_id)
+    yield session_id
+    set_session(None)
+
+
+def session_totals(session_id):
+    get_ledger().flush()
+    return get_ledger().totals(("feature", "model"), session_id=session_id)
+
+
+def fake_stream_client(chunks):
+    models = SimpleNamespace(generate_content_stream=lambda **kwargs: iter(chunks))
+    return lambda api_key: SimpleNamespace(models=models)
+
+
+def test_generate_records_tokens_and_cost(session):
+    provider = FakeProvider(f"fake-{uuid.uuid4().hex[:8]}", contexts=None)
+    HedgedRouter([provider], feature="chat").generate("hello there")
+
+    (row,) = session_totals(session)
+    assert (row["feature"], row["calls"], row["output_tokens"]) == ("chat", 1, 20)
+    assert row["cache_hits"] == 0
+
+
+def test_streamed_call_on_a_cached_document_is_recorded_as_cached(session):
+    contexts = ContextCache(FakeContextBackend(), f"test_contexts_{uuid.uuid4().hex}", min_chars=0)
+    provider = FakeProvider(f"fake-{uuid.uuid4().hex[:8]}", contexts=contexts)
+    router = HedgedRouter([provider], feature="quiz")
+
+    "".join(router.stream("Write 5 questions.", context=DocumentContext(TEXT)))
+
+    (row,) = session_totals(session)
+    assert row["cache_hits"] == 1
+    assert row["cached_tokens"] == len(TEXT) // 4
+
+
+def test_gemini_stream_usage_comes_from_the_last_chunk(session, monkeypatch):
+    pytest.importorskip("google.genai")
+    monkeypatch.setenv("GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(llm_providers, "gemini_contexts",
+                        ContextCache(FakeContextBackend(), f"test_contexts_{uuid.uuid4().hex}", min_chars=0))
+    usage = SimpleNamespace(prompt_token_count=3100, candidates_token_count=42, cached_content_token_count=3000)
+    monkeypatch.setattr(llm_providers, "_gemini_client", fake_stream_client([
+        SimpleNamespace(text="Q1 ", usage_metadata=None),
+        SimpleNamespace(text="Q2", usage_metadata=usage),
+    ]))
+    router = HedgedRouter([GeminiProvider("gemini-2.5-flash-lite")], feature="quiz")
+
+    assert "".join(router.stream("Write 5 questions.", context=DocumentContext(TEXT))) == "Q1 Q2"
+
+    (row,) = session_totals(session)
+    assert (row["input_tokens"], row["output_tokens"], row["cached_tokens"]) == (3100, 42, 3000)
+    assert row["cache_hits"] == 1
+    assert row["cost_usd"] == round(call_cost("gemini-2.5-flash-lite", 3100, 42, 3000), 6)
+
+
+def test_stream_closed_early_is_estimated_from_the_text_sent(session):
+    provider = FakeProvider(f"fake-{uuid.uuid4().hex[:8]}", contexts=None, reply=lambda prompt: "x" * 400)
+    stream = HedgedRouter([provider], feature="quiz").stream("Write 5 questions.", context=DocumentContext(TEXT))
+
+    next(stream)
+    stream.close()
+
+    (row,) = session_totals(session)
+    assert row["calls"] == 1
+    assert row["cache_hits"] == 0
+    assert row["input_tokens"] >= len(TEXT) // 4
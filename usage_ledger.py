@@ -0,0 +1,203 @@
+"""
+Token usage and cost ledger for every LLM call.
+
+Each call (including hedges and failovers, which are billed too) is logged
+with its feature, session, provider, model, input / output / cached tokens,
+latency and whether the document came from a context cache. Rows go to a
+local SQLite table through a background writer, so the request path never
+waits on the disk.
+
+    python usage_ledger.py --hours 24     # spend by feature and model
+"""
+import contextvars
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+LEDGER_PATH = os.getenv("USAGE_LEDGER_PATH", ".usage_ledger.sqlite3")
+
+# USD per million tokens: (input, cached input, output). List prices at the
+# time of writing; override with LLM_PRICES='{"model": [in, cached, out]}'.
+PRICES = {
+    "gemini-2.5-flash-lite": (0.10, 0.025, 0.40),
+    "gemini-2.5-flash": (0.30, 0.075, 2.50),
+    "gemini-flash-latest": (0.30, 0.075, 2.50),
+    "llama-3.1-8b-instant": (0.05, 0.05, 0.08),
+    "llama-3.3-70b-versatile": (0.59, 0.59, 0.79),
+}
+PRICES.update({model: tuple(price) for model, price in json.loads(os.getenv("LLM_PRICES", "{}")).items()})
+
+GROUP_COLUMNS = ("feature", "provider", "model", "session_id")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS calls (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    session_id TEXT,
+    feature TEXT NOT NULL,
+    provider TEXT,
+    model TEXT,
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    cached_tokens INTEGER,
+    latency REAL,
+    context_cached INTEGER NOT NULL DEFAULT 0,
+    hedge INTEGER NOT NULL DEFAULT 0,
+    streamed INTEGER NOT NULL DEFAULT 0,
+    estimated INTEGER NOT NULL DEFAULT 0,
+    cost REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS calls_time ON calls (created_at);
+CREATE INDEX IF NOT EXISTS calls_session ON calls (session_id, created_at);
+"""
+
+_COLUMNS = (
+    "created_at", "session_id", "feature", "provider", "model", "input_tokens", "output_tokens",
+    "cached_tokens", "latency", "context_cached", "hedge", "streamed", "estimated", "cost", "error",
+)
+
+
+# ----------------- Session -----------------
+
+# Set once per script run by the app; LLM worker threads inherit it through
+# contextvars.copy_context()
+_session = contextvars.ContextVar("usage_session", default=None)
+
+
+def set_session(session_id) -> None:
+    _session.set(session_id)
+
+
+def current_session():
+    return _session.get()
+
+
+def estimate_tokens(text: str) -> int:
+    # Same rule of thumb as conversation_memory, for streams without usage data
+    return len(text or "") // 4
+
+
+def call_cost(model, input_tokens, output_tokens, cached_tokens=None):
+    """USD for one call, or None for a model without a known price."""
+    price = PRICES.get(model)
+    if price is None or input_tokens is None:
+        return None
+    cached = min(cached_tokens or 0, input_tokens)
+    return ((input_tokens - cached) * price[0] + cached * price[1] + (output_tokens or 0) * price[2]) / 1e6
+
+
+# ----------------- Ledger -----------------
+
+class UsageLedger:
+    def __init__(self, path: str = LEDGER_PATH):
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._run, name="usage-ledger", daemon=True)
+        self._writer.start()
+
+    def record(self, feature: str, provider=None, model=None, input_tokens=None, output_tokens=None,
+               cached_tokens=None, latency=None, context_cached=False, hedge=False, streamed=False,
+               estimated=False, error=None) -> None:
+        """Queue one call; returns at once."""
+        self._queue.put((
+            time.time(), current_session(), feature, provider, model, input_tokens, output_tokens,
+            cached_tokens, latency, int(context_cached), int(hedge), int(streamed), int(estimated),
+            call_cost(model, input_tokens, output_tokens, cached_tokens),
+            None if error is None else str(error)[:300],
+        ))
+
+    def record_response(self, feature: str, response, hedge=False) -> None:
+        self.record(
+            feature, response.provider, response.model, response.input_tokens, response.output_tokens,
+            response.cached_tokens, response.latency, response.context_cached, hedge,
+        )
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Wait until every queued row is written."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def _run(self):
+        while True:
+            rows = [self._queue.get()]
+            while True:
+                try:
+                    rows.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self._lock:
+                    self._db.execute("BEGIN")
+                    self._db.executemany(
+                        f"INSERT INTO calls ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                        rows,
+                    )
+                    self._db.execute("COMMIT")
+            except Exception as e:
+                # Losing usage rows must never break a user request
+                print(f"Usage ledger write failed: {e}")
+                with self._lock:
+                    if self._db.in_transaction:
+                        self._db.execute("ROLLBACK")
+            finally:
+                for _ in rows:
+                    self._queue.task_done()
+
+    # ----------------- Reports -----------------
+
+    def totals(self, group_by=("feature",), since=None, session_id=None):
+        """Calls, tokens, cost and latency per group, most expensive first."""
+        for column in group_by:
+            if column not in GROUP_COLUMNS:
+                raise ValueError(f"Cannot group usage by {column}")
+        where, params = ["created_at >= ?"], [since or 0]
+        if session_id is not None:
+            where.append("session_id = ?")
+            params.append(session_id)
+        columns = ", ".join(group_by)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {columns}, COUNT(*) AS calls, "
+                "SUM(error IS NOT NULL) AS errors, "
+                "COALESCE(SUM(input_tokens), 0) AS input_tokens, "
+                "COALESCE(SUM(output_tokens), 0) AS output_tokens, "
+                "COALESCE(SUM(cached_tokens), 0) AS cached_tokens, "
+                "SUM(context_cached) AS cache_hits, "
+                "SUM(hedge) AS hedges, "
+                "ROUND(COALESCE(SUM(cost), 0), 6) AS cost_usd, "
+                "ROUND(AVG(latency), 2) AS avg_latency, "
+                "ROUND(MAX(latency), 2) AS max_latency "
+                f"FROM calls WHERE {' AND '.join(where)} "
+                f"GROUP BY {columns} ORDER BY cost_usd DESC, input_tokens DESC",
+                params,
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+
+@lru_cache(maxsize=1)
+def get_ledger() -> UsageLedger:
+    """One ledger and writer per process."""
+    return UsageLedger()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="LLM token usage and cost report")
+    parser.add_argument("--hours", type=float, default=24)
+    parser.add_argument("--by", nargs="+", default=["feature", "model"], choices=GROUP_COLUMNS)
+    args = parser.parse_args()
+
+    for row in get_ledger().totals(args.by, since=time.time() - args.hours * 3600):
+        print(row)
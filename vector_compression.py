@@ -0,0 +1,154 @@
+import os
+import random
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+from embedding_models import model_meta
+
+# ----------------- Vector encodings -----------------
+#
+#   float32   exact vectors, 4 bytes per dimension (the original format)
+#   float16   half precision, 2 bytes per dimension, near lossless
+#   int8      8-bit scalar quantization, 1 byte per dimension
+#   pca<N>    PCA down to N dimensions, e.g. pca256 (stored as float16)
+#
+# The encoding is picked at ingestion and recorded in index_meta.json next
+# to the index, with the embedding model that built it; FAISS reads every one of them back with the same call.
+
+VECTOR_ENCODINGS = ("float32", "float16", "int8", "pca256", "pca128")
+DEFAULT_VECTOR_ENCODING = os.getenv("VECTOR_ENCODING", "float32")
+
+RECALL_K = 10
+RECALL_SAMPLE_QUERIES = 200
+# Relative size of the noise added to a stored vector to make a recall query
+RECALL_QUERY_NOISE = 0.5
+
+
+def _pca_dimension(vector_encoding: str) -> int:
+    return int(vector_encoding[len("pca"):])
+
+
+def applied_encoding(vectordb: FAISS, vector_encoding: str) -> str:
+    """
+    The encoding build_compact_index really uses for vectordb.
+
+    PCA needs more chunks than output dimensions; smaller indexes get float16.
+    """
+    if vector_encoding.startswith("pca"):
+        reduced = _pca_dimension(vector_encoding)
+        if reduced >= vectordb.index.d or vectordb.index.ntotal < reduced:
+            return "float16"
+    return vector_encoding
+
+
+def build_compact_index(vectors: np.ndarray, vector_encoding: str):
+    dimension = vectors.shape[1]
+
+    if vector_encoding == "float32":
+        index = faiss.IndexFlatL2(dimension)
+    elif vector_encoding == "float16":
+        index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+    elif vector_encoding == "int8":
+        index = faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+    elif vector_encoding.startswith("pca"):
+        reduced = _pca_dimension(vector_encoding)
+        if reduced >= dimension or len(vectors) < reduced:
+            # Too few chunks to fit the projection; half precision is the next best thing
+            return build_compact_index(vectors, "float16")
+        pca = faiss.PCAMatrix(dimension, reduced)
+        inner = faiss.IndexScalarQuantizer(reduced, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+        index = faiss.IndexPreTransform(pca, inner)
+    else:
+        raise ValueError(f"Unknown vector encoding: {vector_encoding}")
+
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def all_vectors(vectordb: FAISS) -> np.ndarray:
+    return vectordb.index.reconstruct_n(0, vectordb.index.ntotal)
+
+
+def compress_vector_db(vectordb: FAISS, vector_encoding: str) -> FAISS:
+    """Returns a copy of vectordb whose index uses vector_encoding; documents are shared."""
+    compact = FAISS(
+        embedding_function=vectordb.embedding_function,
+        index=build_compact_index(all_vectors(vectordb), vector_encoding),
+        docstore=vectordb.docstore,
+        index_to_docstore_id=dict(vectordb.index_to_docstore_id),
+        normalize_L2=vectordb._normalize_L2,
+        distance_strategy=vectordb.distance_strategy,
+    )
+    return compact
+
+
+def measure_recall(full_db: FAISS, compact_db: FAISS, k: int = RECALL_K) -> float:
+    """
+    recall@k of compact_db against the full precision index.
+
+    Queries are stored chunk vectors with noise added, so no query is itself
+    in the index (a stored vector always finds itself first, which inflated
+    the number). For each one we count how many of the exact top-k
+    neighbours the compact index also returns.
+    """
+    ntotal = full_db.index.ntotal
+    if ntotal == 0:
+        return 1.0
+    k = min(k, ntotal)
+
+    sample = random.sample(range(ntotal), min(RECALL_SAMPLE_QUERIES, ntotal))
+    stored = np.vstack([full_db.index.reconstruct(i) for i in sample])
+    norms = np.linalg.norm(stored, axis=1, keepdims=True)
+    noise = np.random.default_rng(0).standard_normal(stored.shape).astype("float32")
+    noise *= RECALL_QUERY_NOISE * norms / np.linalg.norm(noise, axis=1, keepdims=True)
+    queries = stored + noise
+    # Same length as the chunks, like a real embedded question
+    queries *= norms / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+    _, exact = full_db.index.search(queries, k)
+    _, approx = compact_db.index.search(queries, k)
+
+    found = sum(len(set(e) & set(a)) for e, a in zip(exact, approx))
+    return found / (len(sample) * k)
+
+
+def index_meta(vectordb: FAISS, vector_encoding: str, recall=None) -> dict:
+    return {
+        **model_meta(vectordb),
+        "vector_encoding": vector_encoding,
+        "ntotal": vectordb.index.ntotal,
+        f"recall_at_{RECALL_K}": recall,
+    }
+
+
+def merge_vector_dbs(base: FAISS, delta: FAISS) -> None:
+    """
+    Add every chunk of delta to base in place.
+
+    Re-adding the vectors (instead of FAISS merge_from) works across encodings,
+    so a float32 delta can be applied on top of a quantized base index.
+    """
+    ids = [delta.index_to_docstore_id[i] for i in range(delta.index.ntotal)]
+    docs = [delta.docstore.search(doc_id) for doc_id in ids]
+    base.add_embeddings(
+        list(zip([doc.page_content for doc in docs], all_vectors(delta))),
+        metadatas=[doc.metadata for doc in docs],
+        ids=ids,
+    )
+
+
+def compare_encodings(vectordb: FAISS, encodings=VECTOR_ENCODINGS):
+    """Index size and recall@k of every encoding for one vector DB, to pick a default."""
+    report = []
+    for vector_encoding in encodings:
+        compact = compress_vector_db(vectordb, vector_encoding)
+        report.append({
+            "vector_encoding": applied_encoding(vectordb, vector_encoding),
+            "index_bytes": len(faiss.serialize_index(compact.index)),
+            f"recall_at_{RECALL_K}": measure_recall(vectordb, compact),
+        })
+    return report